@@ -0,0 +1,725 @@
+import argparse
+from collections import deque
+from json import loads
+from math import inf
+from threading import RLock
+from time import sleep, time
+from typing import Any, Callable
+from weakref import WeakSet
+
+import numpy as np
+
+from config import AppConfig, load_power_station_configs
+from history import parse_reading
+from logger import getLogger
+from metrics import REGISTRY
+from mqtt_client import MQTTClient, get_mqtt_client
+from scheduler import PeriodicTask, Scheduler
+from telemetry_batch import (
+    STATUS_OFFLINE,
+    STATUS_ONLINE,
+    STATUS_RUNNING,
+    decode_batch,
+    decode_manifest,
+)
+
+logger = getLogger(__name__)
+
+AGGREGATORS: WeakSet = WeakSet()
+
+REGISTRY.sampled(
+    "grid_aggregator_readings_total",
+    "Readings ingested by the grid aggregator",
+    lambda: [(dict(), sum(aggregator.readings for aggregator in list(AGGREGATORS)))],
+    kind="counter",
+)
+
+STATUS_CODES: dict[str, int] = dict(
+    offline=STATUS_OFFLINE, online=STATUS_ONLINE, running=STATUS_RUNNING
+)
+
+# Initial capacity of the per-station and per-zone arrays, doubled when full
+INITIAL_CAPACITY: int = 1024
+
+
+class SlidingWindow:
+    """
+    Mean, minimum and maximum of the samples of the last `seconds`.
+
+    Samples are folded into buckets of `resolution` seconds. Pushing a sample only
+    updates the running sum, count and extremes of the current bucket; when a
+    bucket closes it enters a running sum and two monotonic deques, from which
+    expired buckets leave at the front. Every operation is amortized O(1) and the
+    memory is bounded by the number of buckets, however many samples arrive.
+
+    Attributes:
+        seconds (float): Length of the window
+        resolution (float): Length of a bucket
+    """
+
+    def __init__(self, seconds: float, resolution: float = 1.0):
+        """
+        Initialize an empty window.
+
+        Args:
+            seconds (float): Length of the window
+            resolution (float, optional): Length of a bucket, the granularity at
+                which samples expire. Defaults to 1.0.
+        """
+        self.seconds: float = seconds
+        self.resolution: float = resolution
+        self.__buckets_per_window: int = max(int(seconds // resolution), 1)
+
+        # Closed buckets: (bucket, sum, count), and (bucket, extreme) kept monotonic
+        self.__closed: deque = deque()
+        self.__lows: deque = deque()
+        self.__highs: deque = deque()
+        self.__closed_sum: float = 0
+        self.__closed_count: int = 0
+
+        self.__bucket: int | None = None
+        self.__sum: float = 0
+        self.__count: int = 0
+        self.__low: float = inf
+        self.__high: float = -inf
+
+    def push(self, timestamp: float, value: float):
+        """
+        Add a sample.
+
+        Args:
+            timestamp (float): Time of the sample, never earlier than the last one
+            value (float): The sample
+        """
+        bucket = int(timestamp // self.resolution)
+        if bucket != self.__bucket:
+            self.__roll(bucket)
+        self.__sum += value
+        self.__count += 1
+        if value < self.__low:
+            self.__low = value
+        if value > self.__high:
+            self.__high = value
+
+    def expire(self, timestamp: float):
+        """
+        Drop the samples that left the window by `timestamp`, without adding one.
+
+        Args:
+            timestamp (float): The current time
+        """
+        bucket = int(timestamp // self.resolution)
+        if bucket != self.__bucket:
+            self.__roll(bucket)
+
+    def __roll(self, bucket: int):
+        if self.__count:
+            closed = (self.__bucket, self.__sum, self.__count)
+            self.__closed.append(closed)
+            self.__closed_sum += self.__sum
+            self.__closed_count += self.__count
+            while self.__lows and self.__lows[-1][1] >= self.__low:
+                self.__lows.pop()
+            self.__lows.append((self.__bucket, self.__low))
+            while self.__highs and self.__highs[-1][1] <= self.__high:
+                self.__highs.pop()
+            self.__highs.append((self.__bucket, self.__high))
+
+        self.__bucket = bucket
+        self.__sum, self.__count = 0, 0
+        self.__low, self.__high = inf, -inf
+
+        oldest = bucket - self.__buckets_per_window
+        while self.__closed and self.__closed[0][0] <= oldest:
+            _, total, count = self.__closed.popleft()
+            self.__closed_sum -= total
+            self.__closed_count -= count
+        while self.__lows and self.__lows[0][0] <= oldest:
+            self.__lows.popleft()
+        while self.__highs and self.__highs[0][0] <= oldest:
+            self.__highs.popleft()
+
+    def __len__(self) -> int:
+        return self.__closed_count + self.__count
+
+    @property
+    def mean(self) -> float | None:
+        """
+        Mean of the samples in the window, None if it is empty.
+        """
+        count = self.__closed_count + self.__count
+        return (self.__closed_sum + self.__sum) / count if count else None
+
+    @property
+    def min(self) -> float | None:
+        """
+        Smallest sample in the window, None if it is empty.
+        """
+        low = min(self.__lows[0][1] if self.__lows else inf, self.__low)
+        return low if low != inf else None
+
+    @property
+    def max(self) -> float | None:
+        """
+        Largest sample in the window, None if it is empty.
+        """
+        high = max(self.__highs[0][1] if self.__highs else -inf, self.__high)
+        return high if high != -inf else None
+
+    def as_dict(self) -> dict:
+        """
+        Return the statistics of the window.
+
+        Returns:
+            dict: mean, min, max and the number of samples
+        """
+        mean = self.mean
+        return dict(
+            mean=round(mean, 1) if mean is not None else None,
+            min=self.min,
+            max=self.max,
+            samples=len(self),
+        )
+
+
+class Ledger:
+    """
+    Latest value of many sources (stations or zones), kept in growable arrays.
+
+    Keeps the total of the latest values and one subtotal per region up to date
+    on every change, in O(1) for a single value and in a few array operations
+    for a batch of values.
+
+    Attributes:
+        index (dict[str, int]): Source id -> position in the arrays
+        values (np.ndarray): int64 latest value of every source
+        regions (np.ndarray): Region index of every source
+        region_totals (np.ndarray): int64 sum of the values of every region
+        total (int): Sum of every value
+    """
+
+    def __init__(self, region_index: dict[str, int]):
+        """
+        Initialize an empty ledger.
+
+        Args:
+            region_index (dict[str, int]): Region name -> index, shared by the
+                ledgers of one aggregator; index 0 is the unnamed region
+        """
+        self.region_index: dict[str, int] = region_index
+        self.index: dict[str, int] = {}
+        self.values: np.ndarray = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+        self.regions: np.ndarray = np.zeros(INITIAL_CAPACITY, dtype=np.intp)
+        self.region_totals: np.ndarray = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+        self.total: int = 0
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def slot(self, source_id: str) -> int:
+        """
+        Return the position of a source, adding it if it is new.
+
+        Args:
+            source_id (str): Station or zone id
+
+        Returns:
+            int: Its position in the arrays
+        """
+        slot = self.index.get(source_id)
+        if slot is None:
+            slot = self.index[source_id] = len(self.index)
+            if slot == len(self.values):
+                self.values = np.concatenate([self.values, np.zeros_like(self.values)])
+                self.regions = np.concatenate(
+                    [self.regions, np.zeros_like(self.regions)]
+                )
+        return slot
+
+    def set(self, slot: int, value: int):
+        """
+        Replace the latest value of one source.
+
+        Args:
+            slot (int): Position of the source
+            value (int): Its new value
+        """
+        delta = value - int(self.values[slot])
+        if delta:
+            self.values[slot] = value
+            self.total += delta
+            self.region_totals[self.regions[slot]] += delta
+
+    def set_many(self, slots: np.ndarray, values: np.ndarray):
+        """
+        Replace the latest values of many sources at once.
+
+        Args:
+            slots (np.ndarray): Positions of the sources, each at most once
+            values (np.ndarray): Their new values
+        """
+        deltas = values - self.values[slots]
+        self.values[slots] = values
+        self.total += int(deltas.sum())
+        np.add.at(self.region_totals, self.regions[slots], deltas)
+
+    def assign_region(self, slot: int, region: str):
+        """
+        Move a source, and its current value, to a region.
+
+        Args:
+            slot (int): Position of the source
+            region (str): Name of the region
+        """
+        region_id = self.region_index.setdefault(region, len(self.region_index))
+        if region_id >= len(self.region_totals):
+            self.region_totals = np.concatenate(
+                [self.region_totals, np.zeros_like(self.region_totals)]
+            )
+        value = int(self.values[slot])
+        self.region_totals[self.regions[slot]] -= value
+        self.region_totals[region_id] += value
+        self.regions[slot] = region_id
+
+    def region_total(self, region_id: int) -> int:
+        """
+        Return the sum of the values of a region.
+
+        Args:
+            region_id (int): Index of the region
+
+        Returns:
+            int: The subtotal, 0 for regions without sources in this ledger
+        """
+        if region_id >= len(self.region_totals):
+            return 0
+        return int(self.region_totals[region_id])
+
+
+class GridAggregator:
+    """
+    Tracks the supply/demand balance of the grid from the MQTT telemetry.
+
+    Subscribes to the output, status and metadata topics of every station, to
+    the batched telemetry of fleets, and to the demand and metadata topics of
+    the consumption zones. The latest value of every station and zone is kept in
+    array-backed Ledgers, so every reading updates the totals and the per-region
+    subtotals in O(1) instead of re-summing. Topics are resolved to their
+    handler and array slot once and then looked up in a dict.
+
+    Stations sharing a pooled connection have no Last Will of their own: the
+    connection's will goes to `{MQTT_TOPIC_PREFIX}/connection/<id>/status`. The
+    aggregator follows these presence topics and, while a connection is
+    offline, counts the stations whose metadata names it as offline. Batched
+    fleets report the status of every station in each batch instead.
+
+    The balance is published every AGGREGATOR_PUBLISH_INTERVAL_SECONDS to
+    `{GRID_TOPIC_PREFIX}/balance`. The sliding windows sample the totals on the
+    same tick, so their statistics are not skewed by the partial totals seen
+    while the readings of one round arrive.
+
+    Attributes:
+        supply (Ledger): Latest output of every station
+        demand (Ledger): Latest demand of every zone
+        supply_window (SlidingWindow): Total supply, sampled every publish tick
+        demand_window (SlidingWindow): Total demand, sampled every publish tick
+        running (int): Number of stations reporting "running"
+        readings (int): Number of readings ingested so far
+    """
+
+    balance_topic: str = "balance"
+
+    def __init__(
+        self,
+        app_config: AppConfig,
+        mqtt_client: MQTTClient | None = None,
+        clock: Callable[[], float] = time,
+    ):
+        """
+        Initialize the aggregator.
+
+        Args:
+            app_config (AppConfig): Configuration providing the broker settings,
+                the topic prefixes and the AGGREGATOR_* settings
+            mqtt_client (MQTTClient, optional): A shared, externally managed client.
+                If None, the aggregator creates and owns its own connection.
+            clock (Callable[[], float], optional): Timestamps the readings.
+                Defaults to time.time.
+        """
+        self.app_config: AppConfig = app_config
+        self.clock: Callable[[], float] = clock
+        self.regions: dict[str, int] = {"": 0}
+        self.supply: Ledger = Ledger(self.regions)
+        self.demand: Ledger = Ledger(self.regions)
+        self.supply_window = SlidingWindow(app_config.AGGREGATOR_WINDOW_SECONDS)
+        self.demand_window = SlidingWindow(app_config.AGGREGATOR_WINDOW_SECONDS)
+        self.statuses: np.ndarray = np.zeros(INITIAL_CAPACITY, dtype=np.uint8)
+        self.running: int = 0
+        self.readings: int = 0
+
+        self.owns_client: bool = mqtt_client is None
+        self.mqqt_client: MQTTClient = mqtt_client or get_mqtt_client(
+            app_config=app_config.model_copy(update={"POWER_STATION_ID": "aggregator"})
+        )
+
+        station_prefix = app_config.MQTT_TOPIC_PREFIX
+        zone_prefix = app_config.ZONE_TOPIC_PREFIX
+        self.subscriptions: list[str] = [
+            f"{station_prefix}/+/output",
+            f"{station_prefix}/+/status",
+            f"{station_prefix}/metadata/+",
+            f"{station_prefix}/connection/+/status",
+            f"{station_prefix}/batch/+/manifest",
+            f"{station_prefix}/batch/+/telemetry",
+            f"{zone_prefix}/+/demand",
+            f"{zone_prefix}/+/metadata",
+        ]
+        # topic -> (handler, slot), resolved on the first message of a topic
+        self.__routes: dict[str, tuple[Callable[[int, bytes], None], int]] = {}
+        # batch id -> station slot of every record index
+        self.__manifests: list[np.ndarray] = []
+        # Pooled connections: client id -> index, the station slots on every
+        # connection, and the statuses held while a connection is offline
+        self.__connection_ids: dict[str, int] = {}
+        self.__members: list[set[int]] = []
+        self.__held: list[dict[int, int] | None] = []
+        self.__connection_of: dict[int, int] = {}
+        # Messages arrive on the network thread, snapshots run on the scheduler
+        self.__lock = RLock()
+        self.__scheduler: Scheduler | None = None
+        self.__owns_scheduler: bool = False
+        self.__task: PeriodicTask | None = None
+        AGGREGATORS.add(self)
+
+    def startup_sequence(self, scheduler: Scheduler | None = None):
+        """
+        Subscribe to the telemetry and register the balance publisher.
+
+        Args:
+            scheduler (Scheduler, optional): Shared scheduler driving the
+                publisher. If None, the aggregator starts and owns a private one.
+        """
+        logger.info("Initializing GridAggregator startup-sequence...")
+        if self.owns_client:
+            self.mqqt_client.connect()
+            timeout = self.app_config.MQTT_CONNECT_TIMEOUT_SECONDS
+            if not self.mqqt_client.wait_until_connected(timeout):
+                logger.warning(
+                    f"MQTT broker did not accept the connection within {timeout}s, "
+                    "retrying in the background"
+                )
+        for subscription in self.subscriptions:
+            self.mqqt_client.subscribe(
+                topic=subscription, qos=0, on_message=self.handle
+            )
+
+        self.__owns_scheduler = scheduler is None
+        self.__scheduler = scheduler or Scheduler(workers=1, name="aggregator")
+        self.__task = self.__scheduler.schedule_periodic(
+            self.publish_balance, self.app_config.AGGREGATOR_PUBLISH_INTERVAL_SECONDS
+        )
+        if self.__owns_scheduler:
+            self.__scheduler.start()
+        logger.info("GridAggregator startup-sequence COMPLETED.")
+
+    def shutdown_sequence(self):
+        """
+        Cancel the publisher, unsubscribe and release the private scheduler and client.
+        """
+        logger.info("Initializing GridAggregator shutdown-sequence...")
+        if self.__scheduler is not None and self.__task is not None:
+            self.__scheduler.cancel(self.__task)
+            self.__task = None
+            if self.__owns_scheduler:
+                self.__scheduler.stop()
+        if self.owns_client:
+            self.mqqt_client.disconnect()
+        else:
+            for subscription in self.subscriptions:
+                self.mqqt_client.unsubscribe(subscription)
+        logger.info("GridAggregator shutdown-sequence COMPLETED.")
+
+    def handle(self, client: Any, userdata: Any, message: Any):
+        """
+        Callback handler for every subscribed MQTT message.
+
+        Args:
+            client: MQTT client instance (not used)
+            userdata: MQTT user data (not used)
+            message: The MQTT message
+        """
+        try:
+            self.ingest(message.topic, message.payload)
+        except (ValueError, KeyError, TypeError, OverflowError, IndexError) as error:
+            logger.warning(f"Invalid message on {message.topic}: {error}")
+
+    def ingest(self, topic: str, payload: bytes):
+        """
+        Apply one message to the aggregate.
+
+        Args:
+            topic (str): The topic of the message
+            payload (bytes): Its payload
+        """
+        with self.__lock:
+            route = self.__routes.get(topic)
+            if route is None:
+                route = self.__routes[topic] = self.__resolve(topic)
+            handler, slot = route
+            handler(slot, payload)
+
+    def __resolve(self, topic: str) -> tuple[Callable[[int, bytes], None], int]:
+        """
+        Find the handler and slot of a topic not seen before.
+        """
+        station_prefix = self.app_config.MQTT_TOPIC_PREFIX + "/"
+        zone_prefix = self.app_config.ZONE_TOPIC_PREFIX + "/"
+        if topic.startswith(zone_prefix):
+            zone_id, kind = topic[len(zone_prefix) :].split("/")
+            slot = self.demand.slot(zone_id)
+            if kind == "demand":
+                return self.__on_demand, slot
+            return self.__on_zone_metadata, slot
+
+        parts = topic[len(station_prefix) :].split("/")
+        if parts[0] == "batch":
+            batch = len(self.__manifests)
+            self.__manifests.append(np.zeros(0, dtype=np.intp))
+            manifest_topic = f"{station_prefix}batch/{parts[1]}/manifest"
+            telemetry_topic = f"{station_prefix}batch/{parts[1]}/telemetry"
+            self.__routes[manifest_topic] = (self.__on_manifest, batch)
+            self.__routes[telemetry_topic] = (self.__on_batch, batch)
+            return self.__routes[topic]
+
+        if parts[0] == "connection" and len(parts) == 3 and parts[2] == "status":
+            return self.__on_connection, self.__connection(parts[1])
+        if parts[0] == "metadata":
+            # Station metadata lives at {prefix}/metadata/<station id>
+            parts.reverse()
+        station_id, kind = parts
+        slot = self.supply.slot(station_id)
+        self.__grow_statuses()
+        handlers = dict(
+            output=self.__on_output,
+            status=self.__on_status,
+            metadata=self.__on_station_metadata,
+        )
+        return handlers[kind], slot
+
+    def __grow_statuses(self):
+        """
+        Keep the status array as long as the arrays of the supply ledger.
+        """
+        missing = len(self.supply.values) - len(self.statuses)
+        if missing > 0:
+            self.statuses = np.concatenate(
+                [self.statuses, np.zeros(missing, dtype=self.statuses.dtype)]
+            )
+
+    def __on_output(self, slot: int, payload: bytes):
+        _, value = parse_reading(payload, 0.0)
+        self.supply.set(slot, value)
+        self.readings += 1
+
+    def __on_demand(self, slot: int, payload: bytes):
+        _, value = parse_reading(payload, 0.0)
+        self.demand.set(slot, value)
+        self.readings += 1
+
+    def __connection(self, client_id: str) -> int:
+        """
+        Return the index of a pooled connection, adding it if it is new.
+        """
+        connection = self.__connection_ids.get(client_id)
+        if connection is None:
+            connection = self.__connection_ids[client_id] = len(self.__members)
+            self.__members.append(set())
+            self.__held.append(None)
+        return connection
+
+    def __on_status(self, slot: int, payload: bytes):
+        status = STATUS_CODES[payload.decode()]
+        connection = self.__connection_of.get(slot)
+        if connection is not None and (held := self.__held[connection]) is not None:
+            held[slot] = status  # Applied once the connection is back
+            return
+        self.__set_status(slot, status)
+
+    def __set_status(self, slot: int, status: int):
+        previous = int(self.statuses[slot])
+        self.statuses[slot] = status
+        self.running += (status == STATUS_RUNNING) - (previous == STATUS_RUNNING)
+        if status == STATUS_OFFLINE:
+            # The last reading of a station that went away no longer counts
+            self.supply.set(slot, 0)
+
+    def __on_connection(self, connection: int, payload: bytes):
+        presence = payload.decode()
+        if presence not in ("online", "offline"):
+            raise ValueError(f"Unknown connection presence: {presence!r}")
+        held = self.__held[connection]
+        if presence == "offline" and held is None:
+            # The stations are unreachable: hold their statuses until it returns
+            members = self.__members[connection]
+            self.__held[connection] = {
+                slot: int(self.statuses[slot]) for slot in members
+            }
+            for slot in members:
+                self.__set_status(slot, STATUS_OFFLINE)
+        elif presence == "online" and held is not None:
+            self.__held[connection] = None
+            for slot, status in held.items():
+                self.__set_status(slot, status)
+
+    def __assign_connection(self, slot: int, client_id: str | None):
+        """
+        Move a station to the pooled connection its metadata names.
+        """
+        previous = self.__connection_of.pop(slot, None)
+        if previous is not None:
+            self.__members[previous].discard(slot)
+            held = self.__held[previous]
+            if held is not None and slot in held:
+                self.__set_status(slot, held.pop(slot))
+        if client_id is None:
+            return
+        connection = self.__connection(client_id)
+        self.__members[connection].add(slot)
+        self.__connection_of[slot] = connection
+        held = self.__held[connection]
+        if held is not None:
+            held[slot] = int(self.statuses[slot])
+            self.__set_status(slot, STATUS_OFFLINE)
+
+    def __on_station_metadata(self, slot: int, payload: bytes):
+        metadata = parse_metadata(payload)
+        self.supply.assign_region(slot, metadata.get("region", ""))
+        self.__assign_connection(slot, metadata.get("connection"))
+
+    def __on_zone_metadata(self, slot: int, payload: bytes):
+        self.demand.assign_region(slot, parse_metadata(payload).get("region", ""))
+
+    def __on_manifest(self, batch: int, payload: bytes):
+        station_ids = decode_manifest(payload)
+        slots = [self.supply.slot(station_id) for station_id in station_ids]
+        self.__grow_statuses()
+        self.__manifests[batch] = np.array(slots, dtype=np.intp)
+
+    def __on_batch(self, batch: int, payload: bytes):
+        manifest = self.__manifests[batch]
+        if not len(manifest):
+            return  # The retained manifest has not arrived yet
+        _, records = decode_batch(payload)
+        slots = manifest[records["index"]]
+        statuses = records["status"]
+        self.running += int(np.count_nonzero(statuses == STATUS_RUNNING)) - int(
+            np.count_nonzero(self.statuses[slots] == STATUS_RUNNING)
+        )
+        self.statuses[slots] = statuses
+        self.supply.set_many(slots, records["output"].astype(np.int64))
+        self.readings += len(records)
+
+    def snapshot(self) -> dict:
+        """
+        Return the current balance of the grid.
+
+        Returns:
+            dict: Totals, per-region subtotals and the window statistics
+        """
+        with self.__lock:
+            now = self.clock()
+            self.supply_window.expire(now)
+            self.demand_window.expire(now)
+            regions = {}
+            for name, index in self.regions.items():
+                supply = self.supply.region_total(index)
+                demand = self.demand.region_total(index)
+                if name or supply or demand:
+                    regions[name or "unassigned"] = dict(
+                        supply_kw=supply, demand_kw=demand, balance_kw=supply - demand
+                    )
+            return dict(
+                ts=round(now, 3),
+                supply_kw=self.supply.total,
+                demand_kw=self.demand.total,
+                balance_kw=self.supply.total - self.demand.total,
+                stations=len(self.supply),
+                running=self.running,
+                zones=len(self.demand),
+                regions=regions,
+                window=dict(
+                    seconds=self.supply_window.seconds,
+                    supply=self.supply_window.as_dict(),
+                    demand=self.demand_window.as_dict(),
+                ),
+            )
+
+    def sample(self):
+        """
+        Add the current supply and demand totals to the sliding windows.
+        """
+        with self.__lock:
+            now = self.clock()
+            self.supply_window.push(now, self.supply.total)
+            self.demand_window.push(now, self.demand.total)
+
+    def publish_balance(self):
+        """
+        Sample the totals and publish the current balance of the grid.
+        """
+        self.sample()
+        self.mqqt_client.publish(
+            topic=f"{self.app_config.GRID_TOPIC_PREFIX}/{self.balance_topic}",
+            payload=self.snapshot(),
+            policy="coalesce_latest",
+        )
+
+
+def parse_metadata(payload: bytes) -> dict[str, Any]:
+    """
+    Parse a station or zone metadata payload.
+
+    Args:
+        payload (bytes): The JSON metadata
+
+    Returns:
+        dict[str, Any]: The metadata
+
+    Raises:
+        ValueError: If the payload is not a JSON object, or its region or
+            connection is not a string
+    """
+    metadata = loads(payload)
+    if not isinstance(metadata, dict):
+        raise ValueError(f"Metadata must be an object: {metadata!r}")
+    for key in ("region", "connection"):
+        if not isinstance(metadata.get(key, ""), str):
+            raise ValueError(f"Metadata {key} must be a string: {metadata[key]!r}")
+    return metadata
+
+
+if __name__ == "__main__":
+    """
+    Run the grid aggregator against the configured broker.
+
+    Example usage:
+        python aggregator.py --station-prefix PS_001
+    """
+    parser = argparse.ArgumentParser(description="⚡ Grid balance aggregator")
+    parser.add_argument(
+        "-sp",
+        "--station-prefix",
+        type=str,
+        help="Prefix for power station-specific environment variables (e.g., PS_001)",
+    )
+    args = parser.parse_args()
+
+    aggregator = GridAggregator(
+        load_power_station_configs(station_prefix=args.station_prefix)
+    )
+    aggregator.startup_sequence()
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        aggregator.shutdown_sequence()
@@ -0,0 +1,424 @@
+from asyncio import (
+    AbstractEventLoop,
+    Event,
+    Future,
+    Semaphore,
+    Task,
+    get_running_loop,
+    shield,
+    sleep,
+    wait_for,
+)
+from threading import get_ident
+from time import monotonic
+from typing import Any, Callable
+
+from config import AppConfig
+from logger import getLogger
+from mqtt_client import (
+    MQTTClient,
+    encode_payload,
+    get_resilience_options,
+    kept_by_paho,
+)
+from offline_buffer import OfflineBuffer
+from paho.mqtt import client as mqtt_client
+
+logger = getLogger(__name__)
+
+
+class AsyncMQTTClient(MQTTClient):
+    """
+    An MQTT client whose network I/O is driven by an asyncio event loop.
+
+    Instead of paho's background thread (`loop_start()`), the client socket is
+    registered with the running event loop, so a single loop can serve many
+    connections. The synchronous publish()/subscribe() surface of MQTTClient is
+    kept, and publish_async() additionally awaits the broker acknowledgement for
+    QoS 1/2 messages within a bounded in-flight window. Reconnects and the replay
+    of the offline buffer run as tasks on the same loop.
+
+    Opening the socket (DNS lookup, TCP and TLS handshakes) blocks, so it runs in
+    the loop's default executor; many clients thus connect concurrently without
+    stalling the loop. Everything else happens on the loop thread.
+
+    All methods must be called from the event loop thread.
+    """
+
+    def __init__(
+        self,
+        client_id: str,
+        host: str,
+        port: int,
+        username: str,
+        password: str,
+        enable_websocket: bool,
+        unique_suffix: bool = True,
+        offline_buffer: OfflineBuffer | None = None,
+        replay_rate: float = 500.0,
+        reconnect_min_delay: int = 1,
+        reconnect_max_delay: int = 60,
+        will_topic: str | None = None,
+        max_queued: int = 10_000,
+        max_inflight: int = 20,
+    ):
+        """
+        Initialize an asyncio MQTT client.
+
+        Args:
+            client_id (str): Unique identifier for this client
+            host (str): MQTT broker hostname or IP address
+            port (int): MQTT broker port
+            username (str): Authentication username
+            password (str): Authentication password
+            enable_websocket (bool): Use websockets instead of TCP if True
+            unique_suffix (bool, optional): Append a random suffix to the client id.
+                Defaults to True.
+            offline_buffer (OfflineBuffer, optional): Buffer for messages published
+                while disconnected. If None, such messages are dropped.
+            replay_rate (float, optional): Maximum buffered messages replayed per
+                second after a reconnect. Defaults to 500.0.
+            reconnect_min_delay (int, optional): First reconnect backoff in seconds.
+                Defaults to 1.
+            reconnect_max_delay (int, optional): Upper bound of the reconnect backoff
+                in seconds. Defaults to 60.
+            will_topic (str, optional): Topic receiving a retained "offline" Last
+                Will. Defaults to no will.
+            max_queued (int, optional): Pending messages before backpressure
+                applies. Defaults to 10_000.
+            max_inflight (int, optional): Maximum number of unacknowledged QoS 1/2
+                messages awaited by publish_async(). Defaults to 20.
+        """
+        super().__init__(
+            client_id=client_id,
+            host=host,
+            port=port,
+            username=username,
+            password=password,
+            enable_websocket=enable_websocket,
+            unique_suffix=unique_suffix,
+            offline_buffer=offline_buffer,
+            replay_rate=replay_rate,
+            reconnect_min_delay=reconnect_min_delay,
+            reconnect_max_delay=reconnect_max_delay,
+            will_topic=will_topic,
+            max_queued=max_queued,
+        )
+        self.max_inflight: int = max_inflight
+        self.client.max_inflight_messages_set(max_inflight)
+
+        self.__loop: AbstractEventLoop | None = None
+        self.__misc_task: Task | None = None
+        self.__loop_thread: int | None = None
+        self.__connect_task: Task | None = None
+        self.__reconnect_task: Task | None = None
+        self.__replay_task: Task | None = None
+        self.__stopping: bool = False
+        self.__connected_event: Event | None = None
+        self.__inflight: Semaphore | None = None
+        self.__pending: dict[int, Future] = {}
+
+        self.client.on_socket_open = self.__on_socket_open
+        self.client.on_socket_close = self.__on_socket_close
+        self.client.on_socket_register_write = self.__on_socket_register_write
+        self.client.on_socket_unregister_write = self.__on_socket_unregister_write
+
+    def connect(self):
+        """
+        Connect to the MQTT broker and register the socket with the running loop.
+
+        Returns immediately: the socket is opened in the loop's executor and the
+        CONNACK is processed asynchronously; use wait_connected() to await it.
+        If the broker is unreachable, reconnect attempts continue in the background
+        with exponential backoff.
+        """
+        self.__loop = get_running_loop()
+        self.__loop_thread = get_ident()
+        self.__connected_event = Event()
+        self.__inflight = Semaphore(self.max_inflight)
+        self.__stopping = False
+        # Only stores the address; the blocking part is reconnect(), see __open()
+        self.client.connect_async(self.host, self.port)
+        self.__connect_task = self.__loop.create_task(self.__first_connect())
+
+    def disconnect(self):
+        """
+        Disconnect from the MQTT broker and release pending publish waiters.
+        """
+        self.__stopping = True
+        for task in (self.__reconnect_task, self.__replay_task):
+            if task is not None:
+                task.cancel()
+        self.client.disconnect()
+        self.__release_pending(False)
+
+    async def wait_connected(self, timeout: float | None = None) -> bool:
+        """
+        Wait until the broker has accepted the connection.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Defaults to no limit.
+
+        Returns:
+            bool: True if connected, False if the timeout expired
+        """
+        try:
+            await wait_for(self.__connected_event.wait(), timeout)
+        except TimeoutError:
+            return False
+        return True
+
+    def on_connect(
+        self, client: mqtt_client.Client, userdata: Any, flags: dict, rc: int
+    ) -> None:
+        """
+        Callback for when the client connects to the broker.
+
+        Args:
+            client: The client instance
+            userdata: User data of any type
+            flags: Response flags sent by the broker
+            rc (int): Connection result code
+        """
+        super().on_connect(client, userdata, flags, rc)
+        if self.connected:
+            self.__connected_event.set()
+
+    def on_disconnect(self, client: mqtt_client.Client, userdata: Any, rc: int) -> None:
+        """
+        Callback for when the client disconnects from the broker.
+
+        Args:
+            client: The client instance
+            userdata: User data of any type
+            rc (int): Disconnection result code
+        """
+        super().on_disconnect(client, userdata, rc)
+        if self.__connected_event is not None:
+            self.__connected_event.clear()
+        self.__release_pending(False)
+        if not self.__stopping:
+            self.__schedule_reconnect()
+
+    def replay_offline_buffer(self):
+        """
+        Start replaying the offline buffer as a task on the event loop.
+        """
+        if self.__replay_task is None or self.__replay_task.done():
+            self.__replay_task = self.__loop.create_task(self.__replay_loop())
+
+    def on_publish(self, client: mqtt_client.Client, userdata: Any, mid: int) -> None:
+        """
+        Callback for when a message has been acknowledged by the broker.
+
+        Args:
+            client: The client instance
+            userdata: User data of any type
+            mid (int): Message id of the acknowledged message
+        """
+        super().on_publish(client, userdata, mid)
+        future = self.__pending.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(True)
+
+    async def publish_async(
+        self, topic: str, payload: Any, qos: int = 1, retain: bool = False
+    ) -> bool:
+        """
+        Publish a message and wait until the broker acknowledges it.
+
+        At most `max_inflight` messages are awaited at the same time; further
+        callers wait for a free slot, which applies backpressure to the producer.
+
+        Args:
+            topic (str): The topic to publish to
+            payload (Any): The message to publish (dictionaries will be JSON-encoded)
+            qos (int, optional): Quality of Service level. Defaults to 1.
+            retain (bool, optional): Ask the broker to retain the message for late
+                subscribers. Defaults to False.
+
+        Returns:
+            bool: True if the message was sent (QoS 0) or acknowledged (QoS 1/2),
+                False otherwise
+        """
+        async with self.__inflight:
+            if not self.connected:
+                logger.warning("MQTT client not connected. Cannot publish.")
+                return False
+
+            sent = monotonic()
+            result = self.client.publish(
+                topic=topic,
+                payload=encode_payload(payload),
+                qos=qos,
+                retain=retain,
+            )
+            self.track(result, qos, sent)
+            if result.rc:
+                logger.error(f"Failed to publish to topic {topic}")
+                return False
+            if qos == 0:
+                return True
+
+            future = self.__loop.create_future()
+            self.__pending[result.mid] = future
+            return await future
+
+    def __schedule_reconnect(self) -> None:
+        if self.__reconnect_task is None or self.__reconnect_task.done():
+            self.__reconnect_task = self.__loop.create_task(self.__reconnect_loop())
+
+    async def __first_connect(self) -> None:
+        if not await self.__open():
+            self.__schedule_reconnect()
+
+    async def __open(self) -> bool:
+        """
+        Open the socket and send CONNECT on an executor thread.
+
+        Returns:
+            bool: False if the broker could not be reached
+        """
+        opening = self.__loop.run_in_executor(None, self.client.reconnect)
+        opening.add_done_callback(self.__opened)
+        try:
+            # A cancelled caller must not abandon the socket being opened
+            await shield(opening)
+        except OSError as error:
+            logger.warning(f"Failed to connect to {self.host}:{self.port}: {error}")
+            return False
+        return not self.__stopping
+
+    def __opened(self, opening: Future) -> None:
+        if self.__stopping and opening.exception() is None:
+            # disconnect() was called while the socket was being opened
+            self.client.disconnect()
+
+    async def __reconnect_loop(self) -> None:
+        """
+        Reconnect with exponential backoff until the broker accepts the connection.
+        """
+        delay = self.reconnect_min_delay
+        while not self.connected and not self.__stopping:
+            await sleep(delay)
+            if await self.__open():
+                if await self.wait_connected(self.reconnect_max_delay):
+                    return
+            else:
+                logger.warning(f"Reconnect failed, retrying in {delay}s")
+            delay = min(delay * 2, self.reconnect_max_delay)
+
+    async def __replay_loop(self) -> None:
+        """
+        Publish buffered messages at `replay_rate`, backing off while publishing fails.
+        """
+        delay = 1 / self.replay_rate
+        backoff = delay
+        while self.connected:
+            message = self.offline_buffer.pop()
+            if message is None:
+                self.replaying = False
+                logger.info(
+                    f"Offline buffer replay COMPLETED: {self.offline_buffer.stats()}"
+                )
+                return
+
+            sent = monotonic()
+            result = self.client.publish(*message)
+            self.track(result, message.qos, sent)
+            if result.rc:
+                if not kept_by_paho(result, message.qos):
+                    self.offline_buffer.requeue(message)
+                backoff = min(backoff * 2, self.reconnect_max_delay)
+                await sleep(backoff)
+                continue
+
+            backoff = delay
+            await sleep(delay)
+
+    def __release_pending(self, result: bool) -> None:
+        for future in self.__pending.values():
+            if not future.done():
+                future.set_result(result)
+        self.__pending.clear()
+
+    def __in_loop(self, callback: Callable[..., Any], *args: Any) -> None:
+        """
+        Run a socket callback on the loop thread; paho also calls them from the
+        executor thread opening the socket.
+        """
+        if get_ident() == self.__loop_thread:
+            callback(*args)
+        else:
+            self.__loop.call_soon_threadsafe(callback, *args)
+
+    # The socket callbacks pass the file descriptor: a deferred callback may run
+    # after paho closed the socket object
+    def __on_socket_open(
+        self, client: mqtt_client.Client, userdata: Any, sock: Any
+    ) -> None:
+        self.__in_loop(self.__register_socket, sock.fileno())
+
+    def __register_socket(self, fd: int) -> None:
+        self.__loop.add_reader(fd, self.client.loop_read)
+        self.__misc_task = self.__loop.create_task(self.__misc_loop())
+
+    def __on_socket_close(
+        self, client: mqtt_client.Client, userdata: Any, sock: Any
+    ) -> None:
+        self.__in_loop(self.__unregister_socket, sock.fileno())
+
+    def __unregister_socket(self, fd: int) -> None:
+        self.__loop.remove_reader(fd)
+        self.__loop.remove_writer(fd)
+        if self.__misc_task is not None:
+            self.__misc_task.cancel()
+            self.__misc_task = None
+
+    def __on_socket_register_write(
+        self, client: mqtt_client.Client, userdata: Any, sock: Any
+    ) -> None:
+        self.__in_loop(self.__loop.add_writer, sock.fileno(), client.loop_write)
+
+    def __on_socket_unregister_write(
+        self, client: mqtt_client.Client, userdata: Any, sock: Any
+    ) -> None:
+        self.__in_loop(self.__loop.remove_writer, sock.fileno())
+
+    async def __misc_loop(self) -> None:
+        """
+        Drive paho's keep-alive and retry housekeeping once per second.
+        """
+        while self.client.loop_misc() == mqtt_client.MQTT_ERR_SUCCESS:
+            await sleep(1)
+
+
+def get_async_mqtt_client(
+    app_config: AppConfig, unique_suffix: bool = True, will_topic: str | None = None
+) -> AsyncMQTTClient:
+    """
+    Create and return an asyncio MQTT client using configuration from the application settings.
+
+    Args:
+        app_config (AppConfig): Application configuration containing MQTT connection settings
+        unique_suffix (bool, optional): Append a random suffix to the client id.
+            Defaults to True.
+        will_topic (str, optional): Topic receiving a retained "offline" Last Will.
+            Defaults to no will.
+
+    Returns:
+        AsyncMQTTClient: A configured asyncio MQTT client instance ready for connection
+    """
+    return AsyncMQTTClient(
+        client_id=app_config.POWER_STATION_ID,
+        host=app_config.MQTT_HOST,
+        port=app_config.MQTT_PORT,
+        username=app_config.MQTT_USERNAME,
+        password=app_config.MQTT_PASSWORD,
+        enable_websocket=app_config.ENABLE_WEBSOCKET,
+        unique_suffix=unique_suffix,
+        will_topic=will_topic,
+        max_queued=app_config.MQTT_MAX_QUEUED_MESSAGES,
+        max_inflight=app_config.MQTT_MAX_INFLIGHT,
+        **get_resilience_options(app_config),
+    )
@@ -0,0 +1,778 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import socket
+import threading
+from time import monotonic, sleep, time
+from typing import Any
+
+import numpy as np
+
+from aggregator import GridAggregator
+from config import AppConfig, generate_fleet_configs, load_power_station_configs
+from embedded_broker import start_broker_process
+from fleet import FleetSimulator
+from logger import getLogger
+from metrics import process_cpu_seconds, process_rss_bytes
+from mqtt_client import MQTTClient, get_mqtt_client
+from sinks import FileSink, TimestampedMQTTSink
+from telemetry_batch import STATUS_RUNNING, BatchEncoder, encode_manifest
+
+logger = getLogger(__name__)
+
+LATENCY_PERCENTILES: tuple[float, ...] = (50, 90, 99, 99.9)
+
+
+def timestamped_client(**kwargs: Any) -> TimestampedMQTTSink:
+    """
+    Client factory stamping every published reading with its publish time.
+
+    Accepts the arguments of get_mqtt_client(), so it can be handed to a
+    FleetSimulator; MessageCounter derives the end-to-end latency from the stamps.
+    """
+    return TimestampedMQTTSink(get_mqtt_client(**kwargs))
+
+
+def latency_summary(latencies: np.ndarray) -> dict:
+    """
+    Summarize publish-to-receive latencies.
+
+    Args:
+        latencies (np.ndarray): Latencies in seconds
+
+    Returns:
+        dict: Sample count, mean, max and LATENCY_PERCENTILES in milliseconds
+    """
+    if not len(latencies):
+        return dict(samples=0)
+
+    milliseconds = latencies * 1000
+    summary = dict(
+        samples=len(latencies),
+        mean_ms=round(float(milliseconds.mean()), 3),
+        max_ms=round(float(milliseconds.max()), 3),
+    )
+    for percentile, value in zip(
+        LATENCY_PERCENTILES, np.percentile(milliseconds, LATENCY_PERCENTILES)
+    ):
+        summary[f"p{percentile:g}_ms"] = round(float(value), 3)
+    return summary
+
+
+def environment() -> dict:
+    """
+    Describe the machine a benchmark ran on, so results can be compared fairly.
+
+    Returns:
+        dict: Host, interpreter and library details
+    """
+    return dict(
+        timestamp=round(time(), 3),
+        python=platform.python_version(),
+        implementation=platform.python_implementation(),
+        platform=platform.platform(),
+        cpus=os.cpu_count(),
+        numpy=np.__version__,
+    )
+
+
+class MessageCounter:
+    """
+    Counts the messages the broker delivers on a topic filter.
+
+    Messages stamped by TimestampedMQTTSink also yield a publish-to-receive latency;
+    up to `max_latencies` of them are kept in a preallocated array.
+
+    Attributes:
+        received (int): Number of messages received so far
+        measured (int): Number of latencies recorded so far
+    """
+
+    def __init__(
+        self, app_config: AppConfig, topic: str, max_latencies: int = 1_000_000
+    ):
+        """
+        Initialize the counter.
+
+        Args:
+            app_config (AppConfig): Configuration providing the broker settings
+            topic (str): Topic filter to subscribe to, wildcards allowed
+            max_latencies (int, optional): Capacity of the latency array; later
+                latencies are not recorded. Defaults to 1_000_000.
+        """
+        self.received: int = 0
+        self.measured: int = 0
+        self.topic: str = topic
+        self.__latencies: np.ndarray = np.empty(max_latencies, dtype=np.float64)
+        self.mqqt_client: MQTTClient = get_mqtt_client(
+            app_config=app_config.model_copy(
+                update={"POWER_STATION_ID": "benchmark_counter"}
+            )
+        )
+
+    def start(self):
+        """
+        Connect and subscribe to the topic filter.
+        """
+        self.mqqt_client.connect()
+        sleep(0.1)
+        self.mqqt_client.subscribe(topic=self.topic, qos=0, on_message=self.__count)
+
+    def stop(self):
+        """
+        Disconnect from the broker.
+        """
+        self.mqqt_client.disconnect()
+
+    def latencies(self, start: int = 0, end: int | None = None) -> np.ndarray:
+        """
+        Return the recorded latencies, optionally of a window of recordings.
+
+        Args:
+            start (int, optional): Value of `measured` at the start of the window.
+                Defaults to 0.
+            end (int, optional): Value of `measured` at the end of the window.
+                Defaults to the latest recording.
+
+        Returns:
+            np.ndarray: Latencies in seconds
+        """
+        end = self.measured if end is None else end
+        return self.__latencies[start:end]
+
+    def __count(self, client: Any, userdata: Any, message: Any):
+        """
+        Callback counting every delivered message and recording its latency.
+        """
+        received_at = time()
+        self.received += 1
+
+        payload = message.payload
+        if self.measured < len(self.__latencies) and payload.startswith(b'{"ts"'):
+            self.__latencies[self.measured] = received_at - json.loads(payload)["ts"]
+            self.measured += 1
+
+
+class Sample:
+    """
+    A snapshot of the counters a benchmark phase is measured against.
+    """
+
+    def __init__(self, counter: MessageCounter, broker_pid: int | None):
+        """
+        Take a snapshot.
+
+        Args:
+            counter (MessageCounter): Counter of the messages delivered by the broker
+            broker_pid (int, optional): Pid of the broker process, if known
+        """
+        self.time: float = monotonic()
+        self.received: int = counter.received
+        self.measured: int = counter.measured
+        self.cpu: float | None = process_cpu_seconds()
+        self.rss: int | None = process_rss_bytes()
+        self.broker_cpu: float | None = (
+            process_cpu_seconds(broker_pid) if broker_pid else None
+        )
+
+    @staticmethod
+    def percent(start: float | None, end: float | None, elapsed: float) -> float | None:
+        """
+        Convert a CPU-seconds delta into a utilisation percentage.
+
+        Args:
+            start (float | None): CPU seconds at the start of the phase
+            end (float | None): CPU seconds at the end of the phase
+            elapsed (float): Wall-clock seconds of the phase
+
+        Returns:
+            float | None: CPU utilisation in percent, or None if unknown
+        """
+        if start is None or end is None:
+            return None
+        return round(100 * (end - start) / elapsed, 2)
+
+
+def bench_pool(args: argparse.Namespace, app_config: AppConfig) -> dict:
+    """
+    Compare one connection per station against pooled connections.
+
+    Runs the same fleet once per requested connection count and measures the
+    message rate delivered by the broker, the broker CPU (when its pid is known)
+    and the CPU and thread count of the simulator process.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments
+        app_config (AppConfig): Base configuration of the fleet
+
+    Returns:
+        dict: Machine-readable benchmark results
+    """
+    results = []
+    for connections in args.connections:
+        # 0 is shorthand for the legacy layout: one connection per station
+        connections = connections or args.stations
+        counter = MessageCounter(app_config, f"{app_config.MQTT_TOPIC_PREFIX}/#")
+        counter.start()
+
+        fleet = FleetSimulator(
+            app_configs=generate_fleet_configs(app_config, args.stations),
+            workers=args.workers,
+            connections=connections,
+        )
+        fleet.startup_sequence()
+        sleep(args.warmup)
+
+        start = Sample(counter, args.broker_pid)
+        sleep(args.duration)
+        end = Sample(counter, args.broker_pid)
+        elapsed = end.time - start.time
+
+        results.append(
+            dict(
+                stations=args.stations,
+                connections=connections,
+                threads=threading.active_count(),
+                msgs_per_sec=round((end.received - start.received) / elapsed, 1),
+                client_cpu_percent=Sample.percent(start.cpu, end.cpu, elapsed),
+                broker_cpu_percent=Sample.percent(
+                    start.broker_cpu, end.broker_cpu, elapsed
+                ),
+                scheduler=fleet.scheduler.stats.as_dict(),
+            )
+        )
+        fleet.shutdown_sequence()
+        counter.stop()
+        logger.warning(f"pool benchmark: {results[-1]}")
+
+    return dict(benchmark="pool", duration_seconds=args.duration, results=results)
+
+
+def bench_suite(args: argparse.Namespace, app_config: AppConfig) -> dict:
+    """
+    Measure throughput, latency, resource usage and jitter for several fleet sizes.
+
+    Every run starts K stations whose readings are stamped with their publish
+    time, subscribes to the whole topic tree and measures, over the same window:
+
+    - the message rate delivered by the broker,
+    - publish-to-receive latency percentiles of the stamped readings,
+    - CPU and resident memory of the simulator, in total and per station,
+    - the dispatch jitter of the fleet scheduler.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments
+        app_config (AppConfig): Base configuration of the fleet
+
+    Returns:
+        dict: Machine-readable benchmark results
+    """
+    results = []
+    for stations in args.stations:
+        counter = MessageCounter(app_config, f"{app_config.MQTT_TOPIC_PREFIX}/#")
+        counter.start()
+        baseline_rss = process_rss_bytes()
+
+        fleet = FleetSimulator(
+            app_configs=generate_fleet_configs(app_config, stations),
+            workers=args.workers,
+            connections=args.connections,
+            seed=args.seed,
+            client_factory=timestamped_client,
+        )
+        fleet.startup_sequence()
+        for station in fleet.stations:
+            station.control(True)
+        sleep(args.warmup)
+
+        start = Sample(counter, args.broker_pid)
+        sleep(args.duration)
+        end = Sample(counter, args.broker_pid)
+        elapsed = end.time - start.time
+
+        cpu_percent = Sample.percent(start.cpu, end.cpu, elapsed)
+        fleet_rss = (
+            end.rss - baseline_rss if None not in (end.rss, baseline_rss) else None
+        )
+        scheduler = fleet.scheduler.stats.as_dict()
+        results.append(
+            dict(
+                stations=stations,
+                connections=args.connections,
+                workers=args.workers,
+                throughput=dict(
+                    msgs_per_sec=round((end.received - start.received) / elapsed, 1),
+                    expected_outputs_per_sec=round(
+                        sum(
+                            1 / station.app_config.PUBLISH_INTERVAL_SECONDS
+                            for station in fleet.stations
+                        ),
+                        1,
+                    ),
+                ),
+                latency=latency_summary(
+                    counter.latencies(start.measured, end.measured)
+                ),
+                resources=dict(
+                    threads=threading.active_count(),
+                    cpu_percent=cpu_percent,
+                    cpu_percent_per_station=(
+                        round(cpu_percent / stations, 4)
+                        if cpu_percent is not None
+                        else None
+                    ),
+                    rss_bytes=end.rss,
+                    rss_bytes_per_station=(
+                        fleet_rss // stations if fleet_rss is not None else None
+                    ),
+                    broker_cpu_percent=Sample.percent(
+                        start.broker_cpu, end.broker_cpu, elapsed
+                    ),
+                ),
+                scheduler=dict(
+                    dispatched=scheduler["dispatched"],
+                    overruns=scheduler["overruns"],
+                    missed=scheduler["missed"],
+                    jitter_max_ms=round(scheduler["jitter_max"] * 1000, 3),
+                    jitter_mean_ms=round(scheduler["jitter_mean"] * 1000, 3),
+                ),
+            )
+        )
+        fleet.shutdown_sequence()
+        counter.stop()
+        logger.warning(f"suite benchmark: {results[-1]}")
+
+    return dict(
+        benchmark="suite",
+        duration_seconds=args.duration,
+        environment=environment(),
+        results=results,
+    )
+
+
+def bench_aggregator(args: argparse.Namespace, app_config: AppConfig) -> dict:
+    """
+    Measure how many readings per second the grid aggregator ingests on one core.
+
+    Feeds pre-built messages straight into GridAggregator.ingest(), without a
+    broker, once as one message per station reading and once as batched
+    telemetry, for `--duration` seconds each.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments
+        app_config (AppConfig): Configuration providing the topic prefixes
+
+    Returns:
+        dict: Machine-readable benchmark results
+    """
+    rng = np.random.default_rng(args.seed)
+    station_ids = [f"PS_{index:06d}" for index in range(args.stations)]
+    prefix = app_config.MQTT_TOPIC_PREFIX
+    # Never connected: nothing is published during the measurement
+    aggregator = GridAggregator(app_config, mqtt_client=FileSink(os.devnull))
+
+    messages = [
+        (f"{prefix}/{station_id}/output", str(value).encode())
+        for station_id, value in zip(
+            station_ids, rng.integers(0, 5000, args.stations).tolist()
+        )
+    ]
+    batch_topic = f"{prefix}/batch/0/telemetry"
+    aggregator.ingest(f"{prefix}/batch/0/manifest", encode_manifest(station_ids))
+    batch = BatchEncoder(args.stations).encode(
+        time(),
+        rng.integers(0, 5000, args.stations),
+        np.full(args.stations, STATUS_RUNNING, dtype=np.uint8),
+    )
+
+    def rate(ingest_all: Any) -> float:
+        readings, started = aggregator.readings, monotonic()
+        while monotonic() - started < args.duration:
+            ingest_all()
+        elapsed = monotonic() - started
+        return round((aggregator.readings - readings) / elapsed, 1)
+
+    def ingest_messages():
+        for topic, payload in messages:
+            aggregator.ingest(topic, payload)
+
+    # Resolve every topic once, as a running aggregator would have
+    ingest_messages()
+    results = dict(
+        stations=args.stations,
+        station_topics_readings_per_sec=rate(ingest_messages),
+        batch_readings_per_sec=rate(lambda: aggregator.ingest(batch_topic, batch)),
+        supply_kw=aggregator.supply.total,
+    )
+    logger.warning(f"aggregator benchmark: {results}")
+    return dict(
+        benchmark="aggregator",
+        duration_seconds=args.duration,
+        environment=environment(),
+        results=[results],
+    )
+
+
+def bench_lifecycle(args: argparse.Namespace, app_config: AppConfig) -> dict:
+    """
+    Measure how long fleets take to start and to shut down.
+
+    Every round starts a FleetSimulator, records the time until the broker had
+    acknowledged every pooled connection and until the startup sequence
+    returned, lets it publish for `--warmup` seconds and records the time its
+    shutdown sequence took. Rounds are `--warmup` seconds apart.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments
+        app_config (AppConfig): Base configuration of the fleet
+
+    Returns:
+        dict: Machine-readable benchmark results
+    """
+    app_config = app_config.model_copy(
+        update=dict(
+            MQTT_CONNECT_CONCURRENCY=args.concurrency
+            or app_config.MQTT_CONNECT_CONCURRENCY,
+            MQTT_CONNECT_JITTER_SECONDS=app_config.MQTT_CONNECT_JITTER_SECONDS
+            if args.jitter is None
+            else args.jitter,
+        )
+    )
+    results = []
+    for stations in args.stations:
+        configs = generate_fleet_configs(app_config, stations)
+        rounds = []
+        for _ in range(args.rounds):
+            # Let the broker drain the traffic of the previous fleet first
+            sleep(args.warmup)
+            fleet = FleetSimulator(
+                app_configs=configs,
+                workers=args.workers,
+                connections=args.connections,
+            )
+            fleet.startup_sequence()
+            connect_seconds = fleet.pool.connect_seconds
+            sleep(args.warmup)
+            fleet.shutdown_sequence()
+            rounds.append(
+                (connect_seconds, fleet.startup_seconds, fleet.shutdown_seconds)
+            )
+
+        def summary(values: list[float | None]) -> dict:
+            if None in values:
+                return dict(failed=values.count(None))
+            return dict(
+                median=round(float(np.median(values)), 4),
+                max=round(max(values), 4),
+            )
+
+        connect, startup, shutdown = (list(column) for column in zip(*rounds))
+        results.append(
+            dict(
+                stations=stations,
+                connections=args.connections,
+                concurrency=app_config.MQTT_CONNECT_CONCURRENCY,
+                jitter_seconds=app_config.MQTT_CONNECT_JITTER_SECONDS,
+                rounds=args.rounds,
+                all_connected_seconds=summary(connect),
+                startup_seconds=summary(startup),
+                shutdown_seconds=summary(shutdown),
+            )
+        )
+        logger.warning(f"lifecycle benchmark: {results[-1]}")
+
+    return dict(
+        benchmark="lifecycle",
+        environment=environment(),
+        shutdown_timeout_seconds=app_config.SHUTDOWN_TIMEOUT_SECONDS,
+        results=results,
+    )
+
+
+def bench_reconnect(args: argparse.Namespace, app_config: AppConfig) -> dict:
+    """
+    Count the deliveries of numbered QoS 1 messages across dropped connections.
+
+    A publisher sends `--messages` numbered messages at `--rate` per second and
+    has its socket cut `--drops` times along the way. After each cut, its
+    disconnect callback is held back for `--stalled` messages: paho has closed
+    the socket while the client still believes it is connected, the window in
+    which a message could be both kept by paho and buffered by the client.
+    paho resends the QoS 1 messages it kept and the offline buffer replays the
+    ones published while disconnected. A subscriber on its own connection counts
+    how often every number arrives: each one must arrive exactly once.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments
+        app_config (AppConfig): Configuration providing the broker settings
+
+    Returns:
+        dict: Machine-readable results, with the missing and duplicated messages
+    """
+    topic = f"{app_config.MQTT_TOPIC_PREFIX}/benchmark/reconnect"
+    deliveries = np.zeros(args.messages, dtype=np.int64)
+
+    def count(client: Any, userdata: Any, message: Any):
+        deliveries[int(message.payload)] += 1
+
+    subscriber = get_mqtt_client(
+        app_config=app_config.model_copy(
+            update={"POWER_STATION_ID": "benchmark_subscriber"}
+        )
+    )
+    publisher = get_mqtt_client(
+        app_config=app_config.model_copy(
+            update={"POWER_STATION_ID": "benchmark_publisher"}
+        )
+    )
+    timeout = app_config.MQTT_CONNECT_TIMEOUT_SECONDS
+    subscriber.connect()
+    subscriber.wait_until_connected(timeout)
+    subscriber.subscribe(topic=topic, qos=1, on_message=count)
+    publisher.connect()
+    publisher.wait_until_connected(timeout)
+    sleep(0.1)  # Let the subscription settle
+
+    on_disconnect = publisher.client.on_disconnect
+    lost, resume = threading.Event(), threading.Event()
+
+    def held_back_on_disconnect(*callback_args: Any):
+        lost.set()
+        resume.wait(timeout)
+        on_disconnect(*callback_args)
+
+    drops = set(np.linspace(0, args.messages, args.drops + 2, dtype=int)[1:-1].tolist())
+    started = monotonic()
+    stalled_until = -1
+    for number in range(args.messages):
+        if number in drops and (sock := publisher.client.socket()) is not None:
+            lost.clear()
+            resume.clear()
+            publisher.client.on_disconnect = held_back_on_disconnect
+            sock.shutdown(socket.SHUT_RDWR)
+            lost.wait(timeout)
+            stalled_until = number + args.stalled
+        elif number == stalled_until:
+            resume.set()
+            publisher.client.on_disconnect = on_disconnect
+        publisher.publish(topic=topic, payload=str(number), qos=1)
+        sleep(1 / args.rate)
+    resume.set()
+
+    deadline = monotonic() + args.timeout
+    while np.count_nonzero(deliveries) < args.messages and monotonic() < deadline:
+        sleep(0.1)
+    elapsed = monotonic() - started
+    sleep(1.0)  # Late duplicates
+    publisher.disconnect()
+    subscriber.disconnect()
+
+    delivered = int(np.count_nonzero(deliveries))
+    results = dict(
+        messages=args.messages,
+        drops=len(drops),
+        delivered=delivered,
+        missing=args.messages - delivered,
+        duplicated=int(np.count_nonzero(deliveries > 1)),
+        seconds=round(elapsed, 3),
+    )
+    logger.warning(f"reconnect benchmark: {results}")
+    return dict(
+        benchmark="reconnect",
+        environment=environment(),
+        results=[results],
+    )
+
+
+def main() -> None:
+    """
+    Run a benchmark against a broker and print its results as JSON.
+
+    Command-line arguments:
+        -sp, --station-prefix: Prefix for power station-specific environment variables
+        --broker-pid: Pid of the broker process, used to measure its CPU usage
+        --embedded-broker: Run against an embedded broker in a child process
+        --output: Also write the JSON results to this file
+        pool: Compare one connection per station against pooled connections
+        suite: Measure throughput, latency, CPU/RSS and jitter for several fleet sizes
+        aggregator: Measure the ingest rate of the grid aggregator, without a broker
+        lifecycle: Measure fleet startup (time to all connected) and shutdown times
+        reconnect: Count QoS 1 deliveries across dropped connections
+
+    Returns:
+        None
+    """
+    parser = argparse.ArgumentParser(
+        description="⚡ Power Station Simulator benchmarks",
+        epilog="""
+Examples:
+  # Run without any external service, against the embedded broker
+  python benchmark.py -sp PS_001 --embedded-broker suite --stations 100 1000
+
+  # Track throughput, latency, CPU/RSS and jitter against the mosquitto container
+  docker compose up -d mosquitto
+  python benchmark.py -sp PS_001 --output bench.json suite --stations 100 1000 5000
+
+  # Compare 1 connection per station with 1, 4 and 16 pooled connections
+  python benchmark.py -sp PS_001 --broker-pid $(docker inspect -f '{{.State.Pid}}' mosquitto) \\
+      pool --stations 1000 --connections 0 1 4 16
+
+  # Check that the grid aggregator keeps up with 100k readings/sec on one core
+  python benchmark.py aggregator --stations 10000
+
+  # Time fleet startup and shutdown with 64 connections, 8 handshakes at a time
+  python benchmark.py -sp PS_001 --embedded-broker --warmup 1 \\
+      lifecycle --stations 1000 10000 --connections 64 --concurrency 8
+
+  # Check that every QoS 1 message arrives exactly once across 3 dropped connections
+  python benchmark.py -sp PS_001 --embedded-broker reconnect --drops 3
+""",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "-sp",
+        "--station-prefix",
+        type=str,
+        help="Prefix for power station-specific environment variables (e.g., PS_001)",
+    )
+    parser.add_argument(
+        "--broker-pid",
+        type=int,
+        help="Pid of the broker process, used to measure its CPU usage",
+    )
+    parser.add_argument(
+        "--embedded-broker",
+        action="store_true",
+        help="Run against an embedded broker in a child process instead of MQTT_HOST",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10.0, help="Measured seconds per run"
+    )
+    parser.add_argument(
+        "--warmup", type=float, default=2.0, help="Unmeasured seconds per run"
+    )
+    parser.add_argument("--output", type=str, help="Also write the JSON results here")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    pool_parser = subparsers.add_parser(
+        "pool", help="Compare one connection per station against pooled connections"
+    )
+    pool_parser.add_argument("--stations", type=int, default=1000)
+    pool_parser.add_argument("--workers", type=int, default=4)
+    pool_parser.add_argument(
+        "--connections",
+        type=int,
+        nargs="+",
+        default=[0, 1, 4, 16],
+        help="Connection counts to compare, 0 means one connection per station",
+    )
+
+    suite_parser = subparsers.add_parser(
+        "suite",
+        help="Measure throughput, latency, CPU/RSS and jitter for several fleet sizes",
+    )
+    suite_parser.add_argument(
+        "--stations",
+        type=int,
+        nargs="+",
+        default=[100, 1000],
+        help="Fleet sizes to measure",
+    )
+    suite_parser.add_argument("--workers", type=int, default=4)
+    suite_parser.add_argument("--connections", type=int, default=1)
+    suite_parser.add_argument("--seed", type=int, default=0)
+
+    aggregator_parser = subparsers.add_parser(
+        "aggregator",
+        help="Measure the ingest rate of the grid aggregator, without a broker",
+    )
+    aggregator_parser.add_argument("--stations", type=int, default=10000)
+    aggregator_parser.add_argument("--seed", type=int, default=0)
+
+    lifecycle_parser = subparsers.add_parser(
+        "lifecycle",
+        help="Measure fleet startup (time to all connected) and shutdown times",
+    )
+    lifecycle_parser.add_argument(
+        "--stations",
+        type=int,
+        nargs="+",
+        default=[1000, 10000],
+        help="Fleet sizes to measure",
+    )
+    lifecycle_parser.add_argument("--workers", type=int, default=4)
+    lifecycle_parser.add_argument("--connections", type=int, default=16)
+    lifecycle_parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="Connections awaiting their CONNACK at once (default: MQTT_CONNECT_CONCURRENCY)",
+    )
+    lifecycle_parser.add_argument(
+        "--jitter",
+        type=float,
+        help="Maximum random delay before each connect (default: MQTT_CONNECT_JITTER_SECONDS)",
+    )
+    lifecycle_parser.add_argument("--rounds", type=int, default=3)
+
+    reconnect_parser = subparsers.add_parser(
+        "reconnect", help="Count QoS 1 deliveries across dropped connections"
+    )
+    reconnect_parser.add_argument("--messages", type=int, default=5000)
+    reconnect_parser.add_argument(
+        "--rate", type=float, default=1000.0, help="Messages published per second"
+    )
+    reconnect_parser.add_argument(
+        "--drops", type=int, default=3, help="Times the publisher's socket is cut"
+    )
+    reconnect_parser.add_argument(
+        "--stalled",
+        type=int,
+        default=10,
+        help="Messages published after each cut before the client notices it",
+    )
+    reconnect_parser.add_argument(
+        "--timeout",
+        type=float,
+        default=30.0,
+        help="Seconds to wait for the deliveries after the last publish",
+    )
+
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    app_config = load_power_station_configs(station_prefix=args.station_prefix)
+    broker = None
+    if args.embedded_broker:
+        broker, port = start_broker_process()
+        args.broker_pid = broker.pid
+        app_config = app_config.model_copy(
+            update={
+                "MQTT_HOST": "127.0.0.1",
+                "MQTT_PORT": port,
+                "ENABLE_WEBSOCKET": False,
+            }
+        )
+
+    benchmarks = dict(
+        pool=bench_pool,
+        suite=bench_suite,
+        aggregator=bench_aggregator,
+        lifecycle=bench_lifecycle,
+        reconnect=bench_reconnect,
+    )
+    try:
+        results = json.dumps(benchmarks[args.benchmark](args, app_config), indent=2)
+    finally:
+        if broker is not None:
+            broker.terminate()
+            broker.wait()
+    print(results)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(results + "\n")
+
+
+if __name__ == "__main__":
+    main()
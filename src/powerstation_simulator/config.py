@@ -1,12 +1,19 @@
+from functools import cache
 from os import getenv
-from typing import Annotated
+from typing import Annotated, Literal, Self
 
 from logger import getLogger
-from pydantic import Field
+from pydantic import Field, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 logger = getLogger(__name__)
 
+# Intervals derived from PUBLISH_INTERVAL_SECONDS unless configured explicitly
+DERIVED_INTERVALS: dict[str, int] = dict(
+    STATUS_PUBLISH_INTERVAL_SECONDS=2,
+    METADATA_PUBLISH_INTERVAL_SECONDS=5,
+)
+
 
 class AppConfig(BaseSettings):
     """
@@ -31,6 +38,10 @@ class AppConfig(BaseSettings):
     POWER_STATION_ID: Annotated[str, Field()] = "PS_001"
     LOCATION: Annotated[str, Field()] = "Dhaka, Bangladesh"
     CAPACITY_KW: Annotated[int, Field()] = 1000
+    # Control groups: {prefix}/region/<REGION>/control and, for every
+    # comma-separated tag, {prefix}/tag/<tag>/control
+    REGION: Annotated[str, Field()] = ""
+    TAGS: Annotated[str, Field()] = ""
 
     # MQTT broker config
     MQTT_HOST: Annotated[str, Field()] = "127.0.0.1"
@@ -38,14 +49,99 @@ class AppConfig(BaseSettings):
     MQTT_USERNAME: Annotated[str, Field()] = "extinctcoder"
     MQTT_PASSWORD: Annotated[str, Field()] = "Mosquitto123456#"
     MQTT_TOPIC_PREFIX: Annotated[str, Field()] = "smartgrid/powerstation"
+    # Consumption zones publish to {ZONE_TOPIC_PREFIX}/<zone id>/demand
+    ZONE_TOPIC_PREFIX: Annotated[str, Field()] = "smartgrid/zone"
 
     ENABLE_WEBSOCKET: Annotated[bool, Field()] = False
+    MQTT_MAX_INFLIGHT: Annotated[int, Field(gt=0)] = 20
+    # Unsent and unacknowledged messages per connection before backpressure applies
+    MQTT_MAX_QUEUED_MESSAGES: Annotated[int, Field(gt=0)] = 10_000
+    MQTT_RECONNECT_MIN_DELAY_SECONDS: Annotated[int, Field(gt=0)] = 1
+    MQTT_RECONNECT_MAX_DELAY_SECONDS: Annotated[int, Field(gt=0)] = 60
+    # Seconds to wait for the broker to acknowledge a connection (CONNACK)
+    MQTT_CONNECT_TIMEOUT_SECONDS: Annotated[float, Field(gt=0)] = 10.0
+    # Fleet startup: connections awaiting their CONNACK at once, and the random
+    # delay spreading their connects so a restart does not stampede the broker
+    MQTT_CONNECT_CONCURRENCY: Annotated[int, Field(gt=0)] = 16
+    MQTT_CONNECT_JITTER_SECONDS: Annotated[float, Field(ge=0)] = 0.1
+    # Upper bound of a fleet shutdown, after which stragglers are abandoned
+    SHUTDOWN_TIMEOUT_SECONDS: Annotated[float, Field(gt=0)] = 5.0
+    # Virtual-time runs: wait this long for the queued telemetry before disconnecting
+    SINK_DRAIN_TIMEOUT_SECONDS: Annotated[float, Field(gt=0)] = 60.0
+
+    # Offline buffering while the broker is unreachable
+    ENABLE_OFFLINE_BUFFER: Annotated[bool, Field()] = True
+    OFFLINE_BUFFER_MAX_BYTES: Annotated[int, Field(gt=0)] = 8 * 1024 * 1024
+    OFFLINE_BUFFER_MAX_MESSAGES: Annotated[int, Field(gt=0)] = 100_000
+    OFFLINE_BUFFER_POLICY: Annotated[
+        Literal["drop_oldest", "coalesce_latest"], Field()
+    ] = "drop_oldest"
+    OFFLINE_REPLAY_RATE: Annotated[float, Field(gt=0)] = 500.0
 
     # Simulator settings
-    PUBLISH_INTERVAL_SECONDS: Annotated[int, Field()] = 1
+    PUBLISH_INTERVAL_SECONDS: Annotated[int, Field(gt=0)] = 1
+
+    # Default to 2x / 5x the configured PUBLISH_INTERVAL_SECONDS
+    STATUS_PUBLISH_INTERVAL_SECONDS: Annotated[int | None, Field(gt=0)] = None
+    METADATA_PUBLISH_INTERVAL_SECONDS: Annotated[int | None, Field(gt=0)] = None
+
+    # Report-by-exception: publish an output when it moves by more than the
+    # percentage of the last published value or the kW deadband (0 disables
+    # either), and at least every OUTPUT_HEARTBEAT_SECONDS (0 disables)
+    OUTPUT_DEADBAND_PERCENT: Annotated[float, Field(ge=0)] = 0.0
+    OUTPUT_DEADBAND_KW: Annotated[float, Field(ge=0)] = 0.0
+    OUTPUT_HEARTBEAT_SECONDS: Annotated[int, Field(ge=0)] = 60
+
+    # Publish metadata and status retained, only when they change, with a Last
+    # Will marking the station (or its pooled connection) offline; False
+    # re-publishes them periodically instead
+    ENABLE_RETAINED_STATE: Annotated[bool, Field()] = True
+
+    # Fleet telemetry
+    ENABLE_BATCH_TELEMETRY: Annotated[bool, Field()] = False
+    ENABLE_STATION_TOPICS: Annotated[bool, Field()] = True
+
+    # Runtime metrics, 0 disables the HTTP endpoint / the MQTT publishing
+    METRICS_PORT: Annotated[int, Field(ge=0)] = 0
+    METRICS_PUBLISH_INTERVAL_SECONDS: Annotated[int, Field(ge=0)] = 0
+
+    # Grid aggregator: publishes the supply/demand balance to
+    # {GRID_TOPIC_PREFIX}/balance, with statistics over a sliding window
+    GRID_TOPIC_PREFIX: Annotated[str, Field()] = "smartgrid/grid"
+    AGGREGATOR_PUBLISH_INTERVAL_SECONDS: Annotated[float, Field(gt=0)] = 1.0
+    AGGREGATOR_WINDOW_SECONDS: Annotated[int, Field(gt=0)] = 300
+
+    @model_validator(mode="after")
+    def derive_intervals(self) -> Self:
+        """
+        Derive the intervals left unset from the configured publish interval.
+
+        Derived values are kept out of model_fields_set, so they can be told
+        apart from explicit ones; call this again on a copy that changes the
+        publish interval.
+        """
+        for field, factor in DERIVED_INTERVALS.items():
+            if field not in self.model_fields_set:
+                self.__dict__[field] = self.PUBLISH_INTERVAL_SECONDS * factor
+        return self
+
+
+@cache
+def prefixed_config(env_prefix: str) -> AppConfig:
+    """
+    Load the config of an environment variable prefix, once per prefix.
 
-    STATUS_PUBLISH_INTERVAL_SECONDS: int = PUBLISH_INTERVAL_SECONDS * 2
-    METADATA_PUBLISH_INTERVAL_SECONDS: int = PUBLISH_INTERVAL_SECONDS * 5
+    Uses the `_env_prefix` init argument of BaseSettings, so every station shares
+    the AppConfig class (and stays picklable) and the env file is parsed once.
+
+    Args:
+        env_prefix (str): Prefix of the variables, e.g. 'PS_001_'
+
+    Returns:
+        AppConfig: The loaded config, shared by every caller; derive variants
+            with model_copy()
+    """
+    return AppConfig(_env_prefix=env_prefix)
 
 
 def load_power_station_configs(station_prefix: str | None = None) -> AppConfig:
@@ -58,12 +154,32 @@ def load_power_station_configs(station_prefix: str | None = None) -> AppConfig:
     logger.info(f"Simple Power Station SIMULATOR serving station : {station_prefix}")
 
     if not station_prefix:
-        return AppConfig()  # fallback to default or global settings
+        return prefixed_config("")  # fallback to default or global settings
+
+    return prefixed_config(station_prefix.upper().replace("-", "_") + "_")
+
 
-    class AppConfigWithPrefix(AppConfig):
-        model_config = {
-            **AppConfig.model_config,
-            "env_prefix": station_prefix.upper().replace("-", "_") + "_",
-        }
+def generate_fleet_configs(app_config: AppConfig, fleet_size: int) -> list[AppConfig]:
+    """
+    Derive the configs of a fleet of identical stations from a single base config.
+
+    Each station gets the base POWER_STATION_ID suffixed with a zero-padded index,
+    e.g. 'PS_001_00000', 'PS_001_00001', ...
+
+    Args:
+        app_config (AppConfig): The base configuration shared by every station
+        fleet_size (int): Number of stations to generate
+
+    Returns:
+        list[AppConfig]: One configuration per station
+    """
+    logger.info(
+        f"Generating fleet of {fleet_size} stations from {app_config.POWER_STATION_ID}"
+    )
 
-    return AppConfigWithPrefix()
+    return [
+        app_config.model_copy(
+            update={"POWER_STATION_ID": f"{app_config.POWER_STATION_ID}_{index:05d}"}
+        )
+        for index in range(fleet_size)
+    ]
@@ -0,0 +1,243 @@
+from asyncio import Semaphore, gather
+from asyncio import sleep as async_sleep
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from random import uniform
+from threading import Thread
+from time import monotonic, sleep
+from typing import Callable
+from zlib import crc32
+
+from config import AppConfig
+from logger import getLogger
+from metrics import REGISTRY
+from mqtt_client import MQTTClient, get_mqtt_client
+
+logger = getLogger(__name__)
+
+POOL_CONNECT = REGISTRY.histogram(
+    "powerstation_pool_connect_seconds",
+    "Time from the first connect of a pool until every connection was acknowledged",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+).labels()
+
+
+def presence_topic_of(app_config: AppConfig, client_id: str) -> str:
+    """
+    Return the retained online/offline topic of a pooled connection.
+
+    Args:
+        app_config (AppConfig): Configuration providing the topic prefix
+        client_id (str): The client id of the connection
+
+    Returns:
+        str: e.g. 'smartgrid/powerstation/connection/PS_001_pool_000/status'
+    """
+    return f"{app_config.MQTT_TOPIC_PREFIX}/connection/{client_id}/status"
+
+
+class MQTTConnectionPool:
+    """
+    Multiplexes many logical stations over a fixed number of broker connections.
+
+    Every station is pinned to one pooled connection by a stable hash of its id,
+    so the same station always lands on the same connection, even across process
+    restarts. The control commands of the stations pinned to a connection are
+    dispatched by one ControlRouter per connection (see control_plane).
+
+    With ENABLE_RETAINED_STATE, every connection publishes a retained "online" to
+    its presence topic on connect, and its Last Will turns it "offline" when the
+    connection is lost; the metadata of every station names its connection.
+
+    Connections are opened in parallel, at most MQTT_CONNECT_CONCURRENCY of them
+    awaiting their CONNACK at once, each after a random delay of up to
+    MQTT_CONNECT_JITTER_SECONDS, so large fleets neither serialize their
+    handshakes nor stampede the broker.
+
+    Attributes:
+        clients (list[MQTTClient]): The physical connections of the pool
+        presence_topics (list[str]): The presence topic of every connection
+        connect_seconds (float | None): Time the last connect() took until the
+            broker had acknowledged every connection, None if it did not
+    """
+
+    def __init__(
+        self,
+        app_config: AppConfig,
+        size: int = 1,
+        client_factory: Callable[..., MQTTClient] = get_mqtt_client,
+    ):
+        """
+        Initialize the pool.
+
+        Args:
+            app_config (AppConfig): Configuration providing the broker settings.
+                Its POWER_STATION_ID is used as the prefix of the client ids.
+            size (int, optional): Number of physical connections. Defaults to 1.
+            client_factory (Callable[..., MQTTClient], optional): Builds a client
+                from a config, e.g. get_async_mqtt_client. Defaults to get_mqtt_client.
+        """
+        if size < 1:
+            raise ValueError("A connection pool needs at least one connection")
+
+        self.retained_state: bool = app_config.ENABLE_RETAINED_STATE
+        self.connect_concurrency: int = app_config.MQTT_CONNECT_CONCURRENCY
+        self.connect_jitter: float = app_config.MQTT_CONNECT_JITTER_SECONDS
+        self.connect_timeout: float = app_config.MQTT_CONNECT_TIMEOUT_SECONDS
+        self.connect_seconds: float | None = None
+        self.clients: list[MQTTClient] = []
+        self.presence_topics: list[str] = []
+        for index in range(size):
+            client_id = f"{app_config.POWER_STATION_ID}_pool_{index:03d}"
+            presence_topic = presence_topic_of(app_config, client_id)
+            client = client_factory(
+                app_config=app_config.model_copy(
+                    update={"POWER_STATION_ID": client_id}
+                ),
+                unique_suffix=False,
+                will_topic=presence_topic if self.retained_state else None,
+            )
+            if self.retained_state:
+                client.on_connected.append(
+                    partial(client.publish, presence_topic, "online", retain=True)
+                )
+            self.clients.append(client)
+            self.presence_topics.append(presence_topic)
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    def client_for(self, station_id: str) -> MQTTClient:
+        """
+        Return the connection a station is pinned to.
+
+        Args:
+            station_id (str): The POWER_STATION_ID of the station
+
+        Returns:
+            MQTTClient: The pooled connection serving this station
+        """
+        return self.clients[crc32(station_id.encode()) % len(self.clients)]
+
+    def connect(self, timeout: float | None = None) -> bool:
+        """
+        Connect every pooled connection and wait for the broker to accept them.
+
+        Connections the broker has not accepted in time keep retrying in the
+        background; until then their messages go to the offline buffer.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait for every CONNACK.
+                Defaults to MQTT_CONNECT_TIMEOUT_SECONDS.
+
+        Returns:
+            bool: True if every connection was accepted in time
+        """
+        logger.info(f"Connecting {len(self.clients)} pooled MQTT connections...")
+        started = monotonic()
+        deadline = started + (timeout or self.connect_timeout)
+
+        def open_connection(client: MQTTClient) -> bool:
+            sleep(uniform(0, self.connect_jitter))
+            client.connect()
+            return client.wait_until_connected(max(deadline - monotonic(), 0))
+
+        with ThreadPoolExecutor(
+            max_workers=min(self.connect_concurrency, len(self.clients)),
+            thread_name_prefix="pool-connect",
+        ) as executor:
+            connected = list(executor.map(open_connection, self.clients))
+        return self.__connected(connected, started)
+
+    async def connect_async(self, timeout: float | None = None) -> bool:
+        """
+        The asyncio counterpart of connect(), for pools of AsyncMQTTClients.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait for every CONNACK.
+                Defaults to MQTT_CONNECT_TIMEOUT_SECONDS.
+
+        Returns:
+            bool: True if every connection was accepted in time
+        """
+        logger.info(f"Connecting {len(self.clients)} pooled MQTT connections...")
+        started = monotonic()
+        deadline = started + (timeout or self.connect_timeout)
+        handshakes = Semaphore(self.connect_concurrency)
+
+        async def open_connection(client: MQTTClient) -> bool:
+            async with handshakes:
+                await async_sleep(uniform(0, self.connect_jitter))
+                client.connect()
+                return await client.wait_connected(max(deadline - monotonic(), 0))
+
+        connected = await gather(*map(open_connection, self.clients))
+        return self.__connected(connected, started)
+
+    def __connected(self, connected: list[bool], started: float) -> bool:
+        """
+        Record and log the outcome of a connect.
+        """
+        elapsed = monotonic() - started
+        if all(connected):
+            self.connect_seconds = elapsed
+            POOL_CONNECT.observe(elapsed)
+            logger.info(
+                f"Broker accepted {len(connected)} pooled MQTT connections in {elapsed:.3f}s"
+            )
+            return True
+        self.connect_seconds = None
+        logger.error(
+            f"MQTT broker accepted {sum(connected)}/{len(connected)} pooled connections "
+            f"within {elapsed:.1f}s, the others keep retrying"
+        )
+        return False
+
+    def disconnect(self, timeout: float | None = None) -> bool:
+        """
+        Disconnect every pooled connection from the broker.
+
+        A clean disconnect does not trigger the Last Will, so the connections
+        mark themselves offline first.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait for the network
+                loops to stop, e.g. while they sleep in a reconnect backoff. The
+                connections are then stopped in parallel, on helper threads,
+                and those still stopping past the timeout are abandoned; pools
+                of AsyncMQTTClients must not pass it. Defaults to stopping them
+                one after the other, without limit.
+
+        Returns:
+            bool: True if every network loop stopped in time
+        """
+        for client, presence_topic in zip(self.clients, self.presence_topics):
+            if self.retained_state:
+                client.publish(presence_topic, "offline", retain=True)
+
+        stopped = len(self.clients)
+        if timeout is None:
+            for client in self.clients:
+                client.disconnect()
+        else:
+            deadline = monotonic() + timeout
+            stoppers = [
+                Thread(
+                    target=client.disconnect,
+                    name=f"{client.client_id}-stop",
+                    daemon=True,
+                )
+                for client in self.clients
+            ]
+            for stopper in stoppers:
+                stopper.start()
+            for stopper in stoppers:
+                stopper.join(max(deadline - monotonic(), 0))
+            stopped = sum(not stopper.is_alive() for stopper in stoppers)
+            if stopped < len(self.clients):
+                logger.warning(
+                    f"{len(self.clients) - stopped}/{len(self.clients)} pooled MQTT "
+                    f"connections did not stop within {timeout}s"
+                )
+        logger.info(f"Disconnected {stopped} pooled MQTT connections.")
+        return stopped == len(self.clients)
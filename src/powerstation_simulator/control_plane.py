@@ -0,0 +1,181 @@
+from collections import defaultdict
+from time import perf_counter, time
+from typing import Any
+
+from connection_pool import MQTTConnectionPool
+from logger import getLogger
+from metrics import REGISTRY
+from mqtt_client import MQTTClient
+from station_simulator import StationSimulator, parse_control_payload
+
+logger = getLogger(__name__)
+
+CONTROL_DISPATCH = REGISTRY.histogram(
+    "powerstation_control_dispatch_seconds",
+    "Time spent dispatching one control message to the stations it addresses",
+).labels()
+CONTROL_REJECTED = REGISTRY.counter(
+    "powerstation_control_rejected_total",
+    "Control messages that could not be parsed",
+).labels()
+
+
+def control_topics_of(station: StationSimulator) -> list[str]:
+    """
+    Return every control topic a station listens on.
+
+    Args:
+        station (StationSimulator): The station
+
+    Returns:
+        list[str]: Its own control topic, `{prefix}/all/control`, the topic of its
+            REGION and one topic per comma-separated TAG
+    """
+    config = station.app_config
+    prefix = config.MQTT_TOPIC_PREFIX
+    control = station.control_topic
+    topics = [station.control_topic_path, f"{prefix}/all/{control}"]
+    if config.REGION:
+        topics.append(f"{prefix}/region/{config.REGION}/{control}")
+    topics.extend(
+        f"{prefix}/tag/{tag.strip()}/{control}"
+        for tag in config.TAGS.split(",")
+        if tag.strip()
+    )
+    return topics
+
+
+class ControlRouter:
+    """
+    Dispatches the control commands of every station served by one connection.
+
+    The router subscribes once to every distinct control topic of its stations,
+    so a shared `all`, region or tag topic is one subscription per connection,
+    and the broker only delivers commands addressing a station of this
+    connection. It looks up the addressed stations in a precomputed topic index,
+    so each message costs one dict lookup no matter how many stations the fleet
+    has.
+
+    A message may address a group and carry per-station commands (see
+    parse_control_payload); ids outside the addressed group are ignored. Every
+    message is acknowledged once on `{topic}/ack` with the number of stations
+    it was applied to.
+
+    Attributes:
+        mqtt_client (MQTTClient): The connection the stations publish through
+        by_topic (dict[str, dict[str, StationSimulator]]): Control topic ->
+            station id -> station
+        subscriptions (list[str]): The control topics of the router, the keys
+            of `by_topic`
+    """
+
+    ack_topic: str = "ack"
+
+    def __init__(self, stations: list[StationSimulator], mqtt_client: MQTTClient):
+        """
+        Initialize the router and build its topic index.
+
+        Args:
+            stations (list[StationSimulator]): Stations served by the connection
+            mqtt_client (MQTTClient): The connection receiving their commands
+        """
+        self.mqtt_client: MQTTClient = mqtt_client
+        self.by_topic: dict[str, dict[str, StationSimulator]] = defaultdict(dict)
+        for station in stations:
+            for topic in control_topics_of(station):
+                self.by_topic[topic][station.app_config.POWER_STATION_ID] = station
+        self.by_topic = dict(self.by_topic)
+        self.subscriptions: list[str] = list(self.by_topic)
+
+    def start(self):
+        """
+        Subscribe to the control topics of the stations.
+        """
+        for subscription in self.subscriptions:
+            self.mqtt_client.subscribe(topic=subscription, on_message=self.handle)
+
+    def stop(self):
+        """
+        Unsubscribe from the control topics of the stations.
+        """
+        for subscription in self.subscriptions:
+            self.mqtt_client.unsubscribe(subscription)
+
+    def handle(self, client: Any, userdata: Any, message: Any):
+        """
+        Callback handler for MQTT control messages.
+
+        Args:
+            client: MQTT client instance (not used)
+            userdata: MQTT user data (not used)
+            message: MQTT message containing the control commands
+        """
+        stations = self.by_topic.get(message.topic)
+        if stations is None:
+            return
+
+        started = perf_counter()
+        payload = message.payload.decode(errors="replace")
+        try:
+            commands = parse_control_payload(payload)
+            accepted = True
+        except ValueError as error:
+            logger.warning(f"Invalid control message on {message.topic}: {error}")
+            CONTROL_REJECTED.inc()
+            commands, accepted = [], False
+
+        applied = 0
+        try:
+            for command in commands:
+                if command.station_id is None:
+                    for station in stations.values():
+                        station.apply_command(command)
+                    applied += len(stations)
+                elif (station := stations.get(command.station_id)) is not None:
+                    station.apply_command(command)
+                    applied += 1
+        except Exception:
+            # An exception would kill the network thread of the whole connection
+            logger.exception(f"Failed to apply control message on {message.topic}")
+            CONTROL_REJECTED.inc()
+            accepted = False
+
+        ack = dict(
+            command=payload,
+            accepted=accepted,
+            stations=applied,
+            connection=self.mqtt_client.client_id,
+        )
+        if len(stations) == 1:
+            ack["running"] = next(iter(stations.values())).running
+        self.mqtt_client.publish(
+            topic=f"{message.topic}/{self.ack_topic}", payload=ack, policy="block"
+        )
+
+        elapsed = perf_counter() - started
+        CONTROL_DISPATCH.observe(elapsed)
+        sent = commands[0].sent if commands else None
+        latency = f", {time() - sent:.3f}s after it was sent" if sent else ""
+        logger.info(
+            f"Control message on {message.topic} applied to {applied} stations "
+            f"in {elapsed * 1000:.1f}ms{latency}"
+        )
+
+
+def build_control_routers(
+    stations: list[StationSimulator], pool: MQTTConnectionPool
+) -> list[ControlRouter]:
+    """
+    Build one router per pooled connection over the stations pinned to it.
+
+    Args:
+        stations (list[StationSimulator]): The stations of the fleet
+        pool (MQTTConnectionPool): The pool the stations are multiplexed over
+
+    Returns:
+        list[ControlRouter]: The routers, in pool order
+    """
+    pinned: dict[int, list[StationSimulator]] = {id(c): [] for c in pool.clients}
+    for station in stations:
+        pinned[id(station.mqqt_client)].append(station)
+    return [ControlRouter(pinned[id(client)], client) for client in pool.clients]
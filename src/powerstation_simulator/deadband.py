@@ -0,0 +1,133 @@
+import numpy as np
+
+from config import AppConfig
+from metrics import REGISTRY
+
+OUTPUTS_REPORTED = REGISTRY.counter(
+    "powerstation_outputs_reported_total",
+    "Output readings published by report-by-exception",
+).labels()
+OUTPUTS_SUPPRESSED = REGISTRY.counter(
+    "powerstation_outputs_suppressed_total",
+    "Output readings withheld by the deadband",
+).labels()
+
+
+class Deadband:
+    """
+    Report-by-exception filter for the outputs of a group of stations.
+
+    Called once per publish interval with the new readings, it selects the
+    stations whose output moved by more than OUTPUT_DEADBAND_PERCENT of the last
+    published value or by more than OUTPUT_DEADBAND_KW, plus the stations that
+    stayed silent for OUTPUT_HEARTBEAT_SECONDS. A threshold of 0 is disabled;
+    with both disabled every reading is published. The first reading of every
+    station is always published.
+
+    Silence is counted in ticks rather than seconds, so the filter behaves the
+    same on the real and on the virtual clock.
+
+    Attributes:
+        enabled (bool): False if every reading is published
+        reported (int): Readings selected for publishing so far
+        suppressed (int): Readings withheld so far
+    """
+
+    def __init__(
+        self,
+        size: int,
+        percent: np.ndarray | float = 0.0,
+        kw: np.ndarray | float = 0.0,
+        heartbeat_ticks: np.ndarray | int = 0,
+    ):
+        """
+        Initialize the filter.
+
+        Args:
+            size (int): Number of stations
+            percent (np.ndarray | float, optional): Relative deadband of every
+                station, in percent of the last published value. Defaults to 0.0.
+            kw (np.ndarray | float, optional): Absolute deadband of every station,
+                in kilowatts. Defaults to 0.0.
+            heartbeat_ticks (np.ndarray | int, optional): Maximum number of ticks
+                without a publish, 0 for no heartbeat. Defaults to 0.
+        """
+        self.ratio: np.ndarray = np.broadcast_to(
+            np.asarray(percent, dtype=np.float64) / 100, size
+        )
+        self.kw: np.ndarray = np.broadcast_to(np.asarray(kw, dtype=np.float64), size)
+        self.heartbeat_ticks: np.ndarray = np.broadcast_to(
+            np.asarray(heartbeat_ticks, dtype=np.int64), size
+        )
+        self.enabled: bool = bool((self.ratio > 0).any() or (self.kw > 0).any())
+        self.reported: int = 0
+        self.suppressed: int = 0
+
+        self.__last: np.ndarray = np.zeros(size, dtype=np.float64)
+        self.__seen: np.ndarray = np.zeros(size, dtype=np.bool_)
+        # Ticks since the last publish
+        self.__silent: np.ndarray = np.zeros(size, dtype=np.int64)
+        self.__all: np.ndarray = np.ones(size, dtype=np.bool_)
+
+    @classmethod
+    def from_configs(cls, app_configs: list[AppConfig]) -> "Deadband":
+        """
+        Create the filter of a group of stations from their configs.
+
+        Args:
+            app_configs (list[AppConfig]): Configs of the stations, in output order
+
+        Returns:
+            Deadband: The filter of the group
+        """
+        return cls(
+            len(app_configs),
+            percent=np.array(
+                [config.OUTPUT_DEADBAND_PERCENT for config in app_configs]
+            ),
+            kw=np.array([config.OUTPUT_DEADBAND_KW for config in app_configs]),
+            heartbeat_ticks=np.array(
+                [
+                    -(
+                        -config.OUTPUT_HEARTBEAT_SECONDS
+                        // config.PUBLISH_INTERVAL_SECONDS
+                    )
+                    for config in app_configs
+                ]
+            ),
+        )
+
+    def select(self, outputs: np.ndarray) -> np.ndarray:
+        """
+        Select the readings of this tick that are to be published.
+
+        Args:
+            outputs (np.ndarray): The new output of every station
+
+        Returns:
+            np.ndarray: Boolean mask of the stations to publish; treat it as
+                read-only
+        """
+        if not self.enabled:
+            self.reported += len(outputs)
+            OUTPUTS_REPORTED.inc(len(outputs))
+            return self.__all
+
+        self.__silent += 1
+        delta = np.abs(outputs - self.__last)
+        publish = ((self.ratio > 0) & (delta > self.ratio * np.abs(self.__last))) | (
+            (self.kw > 0) & (delta > self.kw)
+        )
+        publish |= (self.heartbeat_ticks > 0) & (self.__silent >= self.heartbeat_ticks)
+        publish |= ~self.__seen
+        self.__seen |= publish
+
+        self.__last[publish] = outputs[publish]
+        self.__silent[publish] = 0
+
+        reported = int(np.count_nonzero(publish))
+        self.reported += reported
+        self.suppressed += len(outputs) - reported
+        OUTPUTS_REPORTED.inc(reported)
+        OUTPUTS_SUPPRESSED.inc(len(outputs) - reported)
+        return publish
@@ -0,0 +1,761 @@
+import argparse
+import socket
+import sys
+from asyncio import (
+    AbstractEventLoop,
+    BaseTransport,
+    Event,
+    Protocol,
+    Server,
+    TimerHandle,
+    get_running_loop,
+    new_event_loop,
+    run,
+)
+from pathlib import Path
+from struct import Struct
+from subprocess import Popen
+from threading import Event as ThreadEvent
+from threading import Thread
+from time import monotonic, sleep
+from typing import NamedTuple
+
+from logger import getLogger
+
+logger = getLogger(__name__)
+
+# MQTT 3.1.1 control packet types, in the upper nibble of the fixed header
+CONNECT: int = 0x10
+CONNACK: int = 0x20
+PUBLISH: int = 0x30
+PUBACK: int = 0x40
+SUBSCRIBE: int = 0x80
+SUBACK: int = 0x90
+UNSUBSCRIBE: int = 0xA0
+UNSUBACK: int = 0xB0
+PINGREQ: int = 0xC0
+PINGRESP: int = 0xD0
+DISCONNECT: int = 0xE0
+
+CONNACK_ACCEPTED: int = 0x00
+CONNACK_BAD_PROTOCOL: int = 0x01
+CONNACK_IDENTIFIER_REJECTED: int = 0x02
+SUBACK_FAILURE: int = 0x80
+
+UINT16: Struct = Struct(">H")
+
+# Upper bound of the memoized topic -> subscribers routes
+ROUTE_CACHE_SIZE: int = 100_000
+
+
+def encode_length(length: int) -> bytes:
+    """
+    Encode the remaining length of a packet as an MQTT variable byte integer.
+
+    Args:
+        length (int): Number of bytes following the fixed header
+
+    Returns:
+        bytes: One to four encoded bytes
+    """
+    encoded = bytearray()
+    while True:
+        length, digit = divmod(length, 128)
+        encoded.append(digit | 0x80 if length else digit)
+        if not length:
+            return bytes(encoded)
+
+
+def encode_publish(
+    topic: bytes, payload: bytes, qos: int, retain: bool, packet_id: int = 0
+) -> bytes:
+    """
+    Encode a PUBLISH packet.
+
+    Args:
+        topic (bytes): UTF-8 encoded topic name
+        payload (bytes): Application message
+        qos (int): 0 or 1
+        retain (bool): Value of the RETAIN flag
+        packet_id (int, optional): Packet identifier, required for QoS 1. Defaults to 0.
+
+    Returns:
+        bytes: The encoded packet
+    """
+    header = UINT16.pack(len(topic)) + topic
+    if qos:
+        header += UINT16.pack(packet_id)
+    return (
+        bytes((PUBLISH | qos << 1 | retain,))
+        + encode_length(len(header) + len(payload))
+        + header
+        + payload
+    )
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """
+    Check whether a topic name matches a subscription filter.
+
+    Args:
+        topic_filter (str): Filter, possibly containing `+` and `#` wildcards
+        topic (str): Topic name of a published message
+
+    Returns:
+        bool: True if a subscription to the filter receives the message
+    """
+    if topic.startswith("$") and topic_filter[:1] in ("+", "#"):
+        return False
+
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for index, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if index >= len(topic_levels):
+            return False
+        if level != "+" and level != topic_levels[index]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def valid_filter(topic_filter: str) -> bool:
+    """
+    Check that wildcards only appear as whole levels and `#` only last.
+
+    Args:
+        topic_filter (str): The subscription filter
+
+    Returns:
+        bool: True if the filter is well-formed
+    """
+    if not topic_filter:
+        return False
+    levels = topic_filter.split("/")
+    for index, level in enumerate(levels):
+        if ("+" in level or "#" in level) and len(level) > 1:
+            return False
+        if level == "#" and index != len(levels) - 1:
+            return False
+    return True
+
+
+class RetainedMessage(NamedTuple):
+    """
+    The last retained message of a topic.
+    """
+
+    topic: bytes
+    payload: bytes
+    qos: int
+
+
+class SubscriptionNode:
+    """
+    One level of the subscription trie.
+
+    Attributes:
+        children (dict[str, SubscriptionNode]): Child levels, including "+" and "#"
+        subscribers (dict[BrokerSession, int]): Sessions subscribed to the filter
+            ending at this level, mapped to their granted QoS
+    """
+
+    __slots__ = ("children", "subscribers")
+
+    def __init__(self):
+        self.children: dict[str, SubscriptionNode] = {}
+        self.subscribers: dict[BrokerSession, int] = {}
+
+
+class BrokerSession(Protocol):
+    """
+    One client connection of an EmbeddedBroker.
+
+    Parses the incoming byte stream into MQTT packets and hands them to the
+    broker. Every session is a clean session: subscriptions and in-flight
+    messages are discarded on disconnect.
+
+    Attributes:
+        client_id (str | None): Client identifier, None until CONNECT is received
+        subscriptions (dict[str, int]): Filters of this session and their granted QoS
+        keepalive (float): Keep alive interval announced by the client, in seconds
+    """
+
+    def __init__(self, broker: "EmbeddedBroker"):
+        self.broker: EmbeddedBroker = broker
+        self.client_id: str | None = None
+        self.subscriptions: dict[str, int] = {}
+        self.keepalive: float = 0.0
+        self.transport = None
+        self.will: tuple[str, bytes, int, bool] | None = None
+
+        self.__buffer: bytes = b""
+        self.__next_packet_id: int = 0
+        self.__activity: bool = True
+        self.__keepalive_timer: TimerHandle | None = None
+        self.__closing: bool = False
+
+    def connection_made(self, transport: BaseTransport) -> None:
+        self.transport = transport
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        # Writes to a lost connection only make asyncio log a warning per message
+        self.__closing = True
+        if self.__keepalive_timer is not None:
+            self.__keepalive_timer.cancel()
+        self.broker.remove_session(self)
+
+    def close(self) -> None:
+        """
+        Close the connection; the will message is published unless DISCONNECT was received.
+        """
+        if not self.__closing:
+            self.__closing = True
+            self.transport.close()
+
+    def write(self, data: bytes) -> None:
+        """
+        Queue bytes for the client.
+        """
+        if not self.__closing and not self.transport.is_closing():
+            self.transport.write(data)
+
+    @property
+    def congested(self) -> bool:
+        """
+        True if the client reads slower than messages are routed to it.
+        """
+        return self.transport.get_write_buffer_size() > self.broker.max_queued_bytes
+
+    def next_packet_id(self) -> int:
+        """
+        Return the next packet identifier for an outgoing QoS 1 message.
+        """
+        self.__next_packet_id = self.__next_packet_id % 0xFFFF + 1
+        return self.__next_packet_id
+
+    def data_received(self, data: bytes) -> None:
+        self.__activity = True
+        # Most reads hold whole packets, so the leftover is usually empty
+        buffer = self.__buffer + data if self.__buffer else data
+        offset = 0
+        size = len(buffer)
+        while size - offset >= 2 and not self.__closing:
+            # Decode the remaining length, a variable byte integer of 1 to 4 bytes
+            length = 0
+            shift = 0
+            position = offset + 1
+            complete = False
+            while position < size and shift < 28:
+                digit = buffer[position]
+                position += 1
+                length |= (digit & 0x7F) << shift
+                shift += 7
+                if not digit & 0x80:
+                    complete = True
+                    break
+            if not complete:
+                if shift >= 28:
+                    logger.warning(f"Malformed packet from {self.client_id}")
+                    self.close()
+                    return
+                break
+            if position + length > size:
+                break
+
+            self.__handle(buffer[offset], buffer[position : position + length])
+            offset = position + length
+        self.__buffer = buffer[offset:]
+
+    def __handle(self, header: int, body: bytes) -> None:
+        packet_type = header & 0xF0
+        if self.client_id is None and packet_type != CONNECT:
+            logger.warning("Closing a connection that did not start with CONNECT")
+            self.close()
+        elif packet_type == PUBLISH:
+            self.__handle_publish(header, body)
+        elif packet_type == PUBACK:
+            pass
+        elif packet_type == PINGREQ:
+            self.write(bytes((PINGRESP, 0)))
+        elif packet_type == SUBSCRIBE:
+            self.__handle_subscribe(body)
+        elif packet_type == UNSUBSCRIBE:
+            self.__handle_unsubscribe(body)
+        elif packet_type == CONNECT:
+            self.__handle_connect(body)
+        elif packet_type == DISCONNECT:
+            self.will = None
+            self.close()
+        else:
+            logger.warning(
+                f"Unsupported packet type {packet_type:#x} from {self.client_id}"
+            )
+            self.close()
+
+    def __handle_connect(self, body: bytes) -> None:
+        if self.client_id is not None:
+            logger.warning(f"Second CONNECT from {self.client_id}")
+            self.close()
+            return
+
+        name_length = UINT16.unpack_from(body)[0]
+        protocol = body[2 : 2 + name_length]
+        position = 2 + name_length
+        level, flags = body[position], body[position + 1]
+        keepalive = UINT16.unpack_from(body, position + 2)[0]
+        position += 4
+
+        if (protocol, level) not in ((b"MQTT", 4), (b"MQIsdp", 3)):
+            self.write(bytes((CONNACK, 2, 0, CONNACK_BAD_PROTOCOL)))
+            self.close()
+            return
+
+        def read_field() -> bytes:
+            nonlocal position
+            length = UINT16.unpack_from(body, position)[0]
+            position += 2 + length
+            return body[position - length : position]
+
+        client_id = read_field().decode()
+        if flags & 0x04:
+            will_topic = read_field().decode()
+            will_payload = read_field()
+            self.will = (
+                will_topic,
+                will_payload,
+                (flags >> 3) & 0x03,
+                bool(flags & 0x20),
+            )
+        # Username and password are accepted without authentication
+
+        if not client_id:
+            if not flags & 0x02:
+                self.write(bytes((CONNACK, 2, 0, CONNACK_IDENTIFIER_REJECTED)))
+                self.close()
+                return
+            client_id = f"embedded-{id(self):x}"
+
+        self.client_id = client_id
+        self.keepalive = keepalive
+        self.broker.add_session(self)
+        self.write(bytes((CONNACK, 2, 0, CONNACK_ACCEPTED)))
+        if keepalive:
+            self.__keepalive_timer = self.broker.loop.call_later(
+                keepalive * 1.5, self.__check_keepalive
+            )
+
+    def __check_keepalive(self) -> None:
+        if not self.__activity:
+            logger.info(f"Keep alive of {self.client_id} expired")
+            self.close()
+            return
+        self.__activity = False
+        self.__keepalive_timer = self.broker.loop.call_later(
+            self.keepalive * 1.5, self.__check_keepalive
+        )
+
+    def __handle_publish(self, header: int, body: bytes) -> None:
+        qos = (header >> 1) & 0x03
+        topic_length = UINT16.unpack_from(body)[0]
+        topic = body[2 : 2 + topic_length]
+        position = 2 + topic_length
+        if qos == 1:
+            self.write(bytes((PUBACK, 2)) + body[position : position + 2])
+            position += 2
+        elif qos:
+            logger.warning(f"QoS {qos} is not supported, closing {self.client_id}")
+            self.close()
+            return
+
+        self.broker.publish(topic, body[position:], qos, bool(header & 0x01))
+
+    def __handle_subscribe(self, body: bytes) -> None:
+        packet_id = body[:2]
+        position = 2
+        granted = bytearray()
+        accepted = []
+        while position < len(body):
+            length = UINT16.unpack_from(body, position)[0]
+            topic_filter = body[position + 2 : position + 2 + length].decode()
+            qos = min(body[position + 2 + length] & 0x03, 1)
+            position += 3 + length
+
+            if valid_filter(topic_filter):
+                self.broker.subscribe(self, topic_filter, qos)
+                accepted.append(topic_filter)
+                granted.append(qos)
+            else:
+                granted.append(SUBACK_FAILURE)
+
+        self.write(
+            bytes((SUBACK,)) + encode_length(2 + len(granted)) + packet_id + granted
+        )
+        for topic_filter in accepted:
+            self.broker.send_retained(self, topic_filter)
+
+    def __handle_unsubscribe(self, body: bytes) -> None:
+        position = 2
+        while position < len(body):
+            length = UINT16.unpack_from(body, position)[0]
+            self.broker.unsubscribe(
+                self, body[position + 2 : position + 2 + length].decode()
+            )
+            position += 2 + length
+        self.write(bytes((UNSUBACK, 2)) + body[:2])
+
+
+class EmbeddedBroker:
+    """
+    An in-process MQTT 3.1.1 broker for tests, benchmarks and CI.
+
+    Supports QoS 0 and 1, retained messages, will messages and `+`/`#`
+    wildcard subscriptions over plain TCP. Subscriptions are kept in a trie,
+    and the resolved subscribers of a topic are memoized until the next
+    subscription change, so routing a message to a stable set of subscribers
+    is a single dictionary lookup. Outgoing QoS 1 messages are not
+    retransmitted, and QoS 0 messages are dropped for clients whose send
+    queue exceeds `max_queued_bytes`.
+
+    The broker either runs on the caller's event loop (`await serve()`) or in
+    a background thread (`start()` / `stop()`, or as a context manager).
+
+    Attributes:
+        host (str): Interface the broker listens on
+        port (int): Listening port; the chosen port once started with port 0
+        received (int): PUBLISH packets received from clients
+        delivered (int): PUBLISH packets routed to subscribers
+        dropped (int): QoS 0 messages dropped for congested subscribers
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 1883,
+        max_queued_bytes: int = 16 * 1024 * 1024,
+    ):
+        """
+        Initialize the broker.
+
+        Args:
+            host (str, optional): Interface to listen on. Defaults to "127.0.0.1".
+            port (int, optional): Port to listen on, 0 picks a free one. Defaults to 1883.
+            max_queued_bytes (int, optional): Send queue size above which a client is
+                considered congested. Defaults to 16 MiB.
+        """
+        self.host: str = host
+        self.port: int = port
+        self.max_queued_bytes: int = max_queued_bytes
+        self.loop: AbstractEventLoop | None = None
+
+        self.received: int = 0
+        self.delivered: int = 0
+        self.dropped: int = 0
+
+        self.sessions: dict[str, BrokerSession] = {}
+        self.retained: dict[str, RetainedMessage] = {}
+        self.__subscriptions: SubscriptionNode = SubscriptionNode()
+        self.__routes: dict[bytes, dict[BrokerSession, int]] = {}
+        self.listening: ThreadEvent = ThreadEvent()
+        self.__server: Server | None = None
+        self.__stopped: Event | None = None
+        self.__thread: Thread | None = None
+
+    def __enter__(self) -> "EmbeddedBroker":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def stats(self) -> dict:
+        """
+        Return the broker counters as a plain dictionary.
+
+        Returns:
+            dict: Counter names mapped to their current values
+        """
+        return dict(
+            clients=len(self.sessions),
+            retained=len(self.retained),
+            received=self.received,
+            delivered=self.delivered,
+            dropped=self.dropped,
+        )
+
+    async def serve(self) -> None:
+        """
+        Listen for clients on the running event loop until close() is called.
+        """
+        self.loop = get_running_loop()
+        self.__stopped = Event()
+        self.__server = await self.loop.create_server(
+            lambda: BrokerSession(self), self.host, self.port
+        )
+        self.port = self.__server.sockets[0].getsockname()[1]
+        self.listening.set()
+        logger.info(f"Embedded MQTT broker listening on {self.host}:{self.port}")
+        try:
+            await self.__stopped.wait()
+        finally:
+            self.__server.close()
+            for session in list(self.sessions.values()):
+                session.will = None
+                session.close()
+            await self.__server.wait_closed()
+            self.listening.clear()
+            logger.info(f"Embedded MQTT broker stopped: {self.stats()}")
+
+    def close(self) -> None:
+        """
+        Stop serve(); must be called from the broker's event loop.
+        """
+        if self.__stopped is not None:
+            self.__stopped.set()
+
+    def start(self, timeout: float = 5.0) -> None:
+        """
+        Run the broker on a private event loop in a background thread.
+
+        Args:
+            timeout (float, optional): Seconds to wait for the listening socket.
+                Defaults to 5.0.
+        """
+        loop = new_event_loop()
+
+        def run_loop():
+            try:
+                loop.run_until_complete(self.serve())
+            finally:
+                loop.close()
+
+        self.__thread = Thread(target=run_loop, name="embedded-broker", daemon=True)
+        self.__thread.start()
+        if not self.listening.wait(timeout):
+            raise TimeoutError("Embedded MQTT broker did not start in time")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """
+        Stop a broker started with start().
+
+        Args:
+            timeout (float, optional): Seconds to wait for the thread. Defaults to 5.0.
+        """
+        if self.__thread is None:
+            return
+        self.loop.call_soon_threadsafe(self.close)
+        self.__thread.join(timeout)
+        self.__thread = None
+
+    def add_session(self, session: BrokerSession) -> None:
+        """
+        Register a connected session, taking over an existing one with the same id.
+        """
+        previous = self.sessions.get(session.client_id)
+        if previous is not None:
+            logger.info(f"Client {session.client_id} reconnected, closing old session")
+            self.remove_session(previous)
+            previous.close()
+        self.sessions[session.client_id] = session
+
+    def remove_session(self, session: BrokerSession) -> None:
+        """
+        Drop the subscriptions of a session and publish its will message.
+        """
+        if self.sessions.get(session.client_id) is session:
+            del self.sessions[session.client_id]
+        for topic_filter in list(session.subscriptions):
+            self.unsubscribe(session, topic_filter)
+        if session.will is not None:
+            topic, payload, qos, retain = session.will
+            session.will = None
+            self.publish(topic.encode(), payload, min(qos, 1), retain)
+
+    def subscribe(self, session: BrokerSession, topic_filter: str, qos: int) -> None:
+        """
+        Add or update a subscription of a session.
+        """
+        node = self.__subscriptions
+        for level in topic_filter.split("/"):
+            node = node.children.setdefault(level, SubscriptionNode())
+        node.subscribers[session] = qos
+        session.subscriptions[topic_filter] = qos
+        self.__routes.clear()
+
+    def unsubscribe(self, session: BrokerSession, topic_filter: str) -> None:
+        """
+        Remove a subscription of a session, pruning empty trie levels.
+        """
+        if session.subscriptions.pop(topic_filter, None) is None:
+            return
+
+        levels = topic_filter.split("/")
+        path = [self.__subscriptions]
+        for level in levels:
+            path.append(path[-1].children[level])
+        del path[-1].subscribers[session]
+        for depth in range(len(levels), 0, -1):
+            node = path[depth]
+            if node.subscribers or node.children:
+                break
+            del path[depth - 1].children[levels[depth - 1]]
+        self.__routes.clear()
+
+    def __resolve(self, topic: bytes) -> dict[BrokerSession, int]:
+        """
+        Collect the sessions subscribed to a topic and their effective QoS.
+        """
+        levels = topic.decode().split("/")
+        system = levels[0].startswith("$")
+        routes: dict[BrokerSession, int] = {}
+
+        def collect(subscribers: dict[BrokerSession, int]) -> None:
+            for session, qos in subscribers.items():
+                if routes.get(session, -1) < qos:
+                    routes[session] = qos
+
+        nodes = [self.__subscriptions]
+        for depth, level in enumerate(levels):
+            matched = []
+            for node in nodes:
+                wildcards = not (system and depth == 0)
+                if wildcards and "#" in node.children:
+                    collect(node.children["#"].subscribers)
+                if level in node.children:
+                    matched.append(node.children[level])
+                if wildcards and "+" in node.children:
+                    matched.append(node.children["+"])
+            nodes = matched
+            if not nodes:
+                break
+        for node in nodes:
+            collect(node.subscribers)
+            # "a/#" also matches "a"
+            if "#" in node.children:
+                collect(node.children["#"].subscribers)
+        return routes
+
+    def publish(self, topic: bytes, payload: bytes, qos: int, retain: bool) -> None:
+        """
+        Store a retained message and route a message to its subscribers.
+
+        Args:
+            topic (bytes): UTF-8 encoded topic name
+            payload (bytes): Application message
+            qos (int): QoS the message was published with
+            retain (bool): RETAIN flag of the incoming message
+        """
+        self.received += 1
+        if retain:
+            name = topic.decode()
+            if payload:
+                self.retained[name] = RetainedMessage(topic, payload, qos)
+            else:
+                self.retained.pop(name, None)
+
+        routes = self.__routes.get(topic)
+        if routes is None:
+            if len(self.__routes) >= ROUTE_CACHE_SIZE:
+                self.__routes.clear()
+            routes = self.__routes[topic] = self.__resolve(topic)
+
+        packet = None
+        for session, granted in routes.items():
+            if granted and qos:
+                session.write(
+                    encode_publish(topic, payload, 1, False, session.next_packet_id())
+                )
+            elif session.congested:
+                self.dropped += 1
+                continue
+            else:
+                if packet is None:
+                    packet = encode_publish(topic, payload, 0, False)
+                session.write(packet)
+            self.delivered += 1
+
+    def send_retained(self, session: BrokerSession, topic_filter: str) -> None:
+        """
+        Send the retained messages matching a new subscription.
+        """
+        granted = session.subscriptions.get(topic_filter, 0)
+        if "+" in topic_filter or "#" in topic_filter:
+            messages = [
+                message
+                for name, message in self.retained.items()
+                if topic_matches(topic_filter, name)
+            ]
+        else:
+            message = self.retained.get(topic_filter)
+            messages = [message] if message else []
+
+        for message in messages:
+            qos = min(granted, message.qos)
+            session.write(
+                encode_publish(
+                    message.topic,
+                    message.payload,
+                    qos,
+                    True,
+                    session.next_packet_id() if qos else 0,
+                )
+            )
+            self.delivered += 1
+
+
+def start_broker_process(
+    host: str = "127.0.0.1", port: int = 0, timeout: float = 5.0
+) -> tuple[Popen, int]:
+    """
+    Run the embedded broker in a child process and wait until it accepts clients.
+
+    A separate process keeps the broker off the GIL of the process under test,
+    so its CPU usage can be measured on its own.
+
+    Args:
+        host (str, optional): Interface to listen on. Defaults to "127.0.0.1".
+        port (int, optional): Port to listen on, 0 picks a free one. Defaults to 0.
+        timeout (float, optional): Seconds to wait for the broker. Defaults to 5.0.
+
+    Returns:
+        tuple[Popen, int]: The broker process and its port
+    """
+    if not port:
+        with socket.socket() as probe:
+            probe.bind((host, 0))
+            port = probe.getsockname()[1]
+
+    process = Popen(
+        [sys.executable, str(Path(__file__)), "--host", host, "--port", str(port)]
+    )
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.1).close()
+            return process, port
+        except OSError:
+            if process.poll() is not None:
+                break
+            sleep(0.05)
+    process.kill()
+    raise TimeoutError(f"Embedded MQTT broker did not start on {host}:{port}")
+
+
+if __name__ == "__main__":
+    """
+    Run the embedded broker as a standalone process.
+
+    Example usage:
+        python embedded_broker.py --port 1883
+    """
+    parser = argparse.ArgumentParser(
+        description="⚡ Embedded MQTT 3.1.1 broker for tests and load runs"
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+
+    try:
+        run(EmbeddedBroker(host=args.host, port=args.port).serve())
+    except KeyboardInterrupt:
+        logger.info("Embedded MQTT broker interrupted")
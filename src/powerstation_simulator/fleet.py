@@ -0,0 +1,755 @@
+from asyncio import Event
+from asyncio import sleep as async_sleep
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AbstractContextManager, nullcontext
+from itertools import groupby
+from random import randrange
+from time import monotonic, perf_counter, time
+from typing import Callable
+
+import numpy as np
+
+from async_mqtt_client import get_async_mqtt_client
+from config import AppConfig
+from connection_pool import MQTTConnectionPool
+from control_plane import ControlRouter, build_control_routers
+from deadband import Deadband
+from logger import getLogger
+from metrics import REGISTRY
+from mqtt_client import MQTTClient, get_mqtt_client
+from output_generator import FleetOutputGenerator, StatefulOutputModel, station_seeds
+from scenario import Scenario, ScenarioEngine
+from scheduler import AsyncScheduler, Scheduler, VirtualScheduler
+from sinks import FileSink, HistorySink, TimestampedMQTTSink
+from station_simulator import StationSimulator
+from telemetry_batch import (
+    STATUS_OFFLINE,
+    STATUS_ONLINE,
+    STATUS_RUNNING,
+    BatchEncoder,
+    encode_manifest,
+)
+from trace_replay import TraceOutputSource, TraceReplay
+
+logger = getLogger(__name__)
+
+BATCH_PUBLISH = REGISTRY.histogram(
+    "powerstation_batch_publish_seconds",
+    "Time spent generating and publishing the outputs of one batch",
+).labels()
+
+
+class OutputBatch:
+    """
+    A group of stations whose outputs are generated and published in one tick.
+
+    Outputs go to the per-station topics (ENABLE_STATION_TOPICS) and/or, as one
+    compact binary message, to the batched telemetry topic of the batch
+    (ENABLE_BATCH_TELEMETRY), whose retained manifest maps record indices to
+    station ids.
+
+    Attributes:
+        stations (list[StationSimulator]): Stations of the batch, all sharing
+            the same PUBLISH_INTERVAL_SECONDS
+        generator (FleetOutputGenerator | TraceOutputSource | StatefulOutputModel):
+            Vectorized output generator of the batch
+        generator_lock (AbstractContextManager): Held while the outputs are
+            generated, e.g. the lock of the ScenarioEngine changing the generator
+        deadband (Deadband): Selects the outputs published to the per-station
+            topics; the batched telemetry always carries every station
+        batch_topic (str): Topic carrying the binary telemetry of the batch
+        manifest_topic (str): Topic carrying the retained manifest of the batch
+    """
+
+    batch_topic: str = "batch"
+
+    def __init__(
+        self,
+        stations: list[StationSimulator],
+        seed: int,
+        batch_id: str = "0",
+        mqtt_client: MQTTClient | None = None,
+        clock: Callable[[], float] = time,
+        trace_replay: TraceReplay | None = None,
+        scenario: Scenario | None = None,
+    ):
+        """
+        Initialize the batch.
+
+        Args:
+            stations (list[StationSimulator]): Stations of the batch
+            seed (int): Fleet-wide RNG seed
+            batch_id (str, optional): Identifier of the batch used in the batched
+                telemetry topic, e.g. the id of its first station. Defaults to "0".
+            mqtt_client (MQTTClient, optional): Client publishing the batched
+                telemetry. Defaults to the client of the first station.
+            clock (Callable[[], float], optional): Source of the batch timestamps.
+                Defaults to time.time.
+            trace_replay (TraceReplay, optional): Replay recorded outputs instead of
+                generating random ones. Defaults to None.
+            scenario (Scenario, optional): Generate the outputs with the stateful
+                model of a scenario, whose events ramp and derate them.
+                Defaults to None.
+        """
+        self.stations: list[StationSimulator] = stations
+        self.clock: Callable[[], float] = clock
+        app_config = stations[0].app_config
+        self.publish_station_topics: bool = app_config.ENABLE_STATION_TOPICS
+        self.publish_batch: bool = app_config.ENABLE_BATCH_TELEMETRY
+        self.mqqt_client: MQTTClient = mqtt_client or stations[0].mqqt_client
+        self.batch_topic_path: str = (
+            f"{app_config.MQTT_TOPIC_PREFIX}/{self.batch_topic}/{batch_id}/telemetry"
+        )
+        self.manifest_topic_path: str = (
+            f"{app_config.MQTT_TOPIC_PREFIX}/{self.batch_topic}/{batch_id}/manifest"
+        )
+        self.encoder: BatchEncoder = BatchEncoder(len(stations))
+        station_ids = [station.app_config.POWER_STATION_ID for station in stations]
+        self.generator: FleetOutputGenerator | TraceOutputSource | StatefulOutputModel
+        if trace_replay:
+            self.generator = trace_replay.source_for(
+                station_ids, app_config.PUBLISH_INTERVAL_SECONDS
+            )
+        elif scenario:
+            self.generator = scenario.output_model(
+                stations, app_config.PUBLISH_INTERVAL_SECONDS
+            )
+        else:
+            self.generator = FleetOutputGenerator(
+                capacities=np.array(
+                    [station.app_config.CAPACITY_KW for station in stations],
+                    dtype=np.float64,
+                ),
+                seeds=station_seeds(station_ids, seed),
+            )
+        self.generator_lock: AbstractContextManager = nullcontext()
+        self.deadband: Deadband = Deadband.from_configs(
+            [station.app_config for station in stations]
+        )
+
+    @property
+    def interval(self) -> float:
+        """
+        The publish interval shared by every station of the batch.
+        """
+        return self.stations[0].app_config.PUBLISH_INTERVAL_SECONDS
+
+    def publish_manifest(self):
+        """
+        Publish the retained manifest of the batched telemetry topic.
+        """
+        if self.publish_batch:
+            self.mqqt_client.publish(
+                topic=self.manifest_topic_path,
+                payload=encode_manifest(
+                    [station.app_config.POWER_STATION_ID for station in self.stations]
+                ),
+                retain=True,
+            )
+
+    def publish_outputs(self):
+        """
+        Generate the outputs of every station of the batch and publish them.
+        """
+        started = perf_counter()
+        with self.generator_lock:
+            running = np.fromiter(
+                (station.running for station in self.stations),
+                dtype=np.bool_,
+                count=len(self.stations),
+            )
+            outputs = self.generator.generate(running)
+        if any(station.setpoint_kw is not None for station in self.stations):
+            setpoints = np.fromiter(
+                (
+                    np.inf if station.setpoint_kw is None else station.setpoint_kw
+                    for station in self.stations
+                ),
+                dtype=np.float64,
+                count=len(self.stations),
+            )
+            outputs = np.minimum(outputs, setpoints).astype(outputs.dtype)
+
+        if self.publish_batch:
+            online = np.fromiter(
+                (station.online for station in self.stations),
+                dtype=np.bool_,
+                count=len(self.stations),
+            )
+            statuses = np.where(
+                running, STATUS_RUNNING, np.where(online, STATUS_ONLINE, STATUS_OFFLINE)
+            )
+            self.mqqt_client.publish(
+                topic=self.batch_topic_path,
+                payload=self.encoder.encode(self.clock(), outputs, statuses),
+                qos=0,
+                policy="coalesce_latest",
+            )
+
+        if self.publish_station_topics:
+            publish = self.deadband.select(outputs)
+            if self.deadband.enabled:
+                for index in np.flatnonzero(publish).tolist():
+                    self.stations[index].publish_output(int(outputs[index]))
+            else:
+                for station, output in zip(self.stations, outputs.tolist()):
+                    station.publish_output(output)
+        BATCH_PUBLISH.observe(perf_counter() - started)
+
+
+def build_output_batches(
+    stations: list[StationSimulator],
+    batches_per_interval: int,
+    seed: int,
+    pool: MQTTConnectionPool | None = None,
+    clock: Callable[[], float] = time,
+    trace_replay: TraceReplay | None = None,
+    scenario: Scenario | None = None,
+) -> list[OutputBatch]:
+    """
+    Split a fleet into output batches.
+
+    Stations are grouped by publish interval, and every group is split into
+    `batches_per_interval` batches so the publishing work can be spread over
+    several workers and over the interval.
+
+    Args:
+        stations (list[StationSimulator]): Every station of the fleet
+        batches_per_interval (int): Number of batches per publish interval
+        seed (int): Fleet-wide RNG seed
+        pool (MQTTConnectionPool, optional): Pool the batched telemetry topics
+            are spread over. Defaults to the client of each batch's first station.
+        clock (Callable[[], float], optional): Source of the batch timestamps.
+            Defaults to time.time.
+        trace_replay (TraceReplay, optional): Replay recorded outputs instead of
+            generating random ones. Defaults to None.
+        scenario (Scenario, optional): Generate the outputs with the stateful
+            model of a scenario. Defaults to None.
+
+    Returns:
+        list[OutputBatch]: The output batches of the fleet
+    """
+    if trace_replay and scenario:
+        raise ValueError("A fleet cannot replay traces and run a scenario at once")
+    batches = []
+
+    def interval_of(station: StationSimulator) -> int:
+        return station.app_config.PUBLISH_INTERVAL_SECONDS
+
+    for _, group in groupby(sorted(stations, key=interval_of), key=interval_of):
+        group = list(group)
+        size = -(-len(group) // batches_per_interval)
+        for start in range(0, len(group), size):
+            batch_id = group[start].app_config.POWER_STATION_ID
+            batches.append(
+                OutputBatch(
+                    group[start : start + size],
+                    seed,
+                    batch_id=batch_id,
+                    mqtt_client=pool.client_for(batch_id) if pool else None,
+                    clock=clock,
+                    trace_replay=trace_replay,
+                    scenario=scenario,
+                )
+            )
+    return batches
+
+
+def schedule_scenario(
+    scenario: Scenario,
+    batches: list[OutputBatch],
+    scheduler: Scheduler | AsyncScheduler | VirtualScheduler,
+    clock: Callable[[], float] = time,
+) -> ScenarioEngine:
+    """
+    Run a scenario against output batches built with it.
+
+    The events are checked once per tick of the fastest batch. Batches on other
+    workers generate their outputs under the lock of the engine, so an event is
+    never applied halfway through a tick.
+
+    Args:
+        scenario (Scenario): The scenario
+        batches (list[OutputBatch]): Batches built with `scenario`
+        scheduler (Scheduler | AsyncScheduler | VirtualScheduler): Scheduler
+            publishing the batches
+        clock (Callable[[], float], optional): Clock of the scheduler.
+            Defaults to time.time.
+
+    Returns:
+        ScenarioEngine: The engine applying the events
+    """
+    engine = ScenarioEngine(
+        scenario, [(batch.stations, batch.generator) for batch in batches], clock()
+    )
+    for batch in batches:
+        batch.generator_lock = engine.lock
+    scheduler.schedule_periodic(
+        lambda: engine.advance(clock()), min(batch.interval for batch in batches)
+    )
+    logger.info(f"Scheduled a scenario of {len(engine)} events")
+    return engine
+
+
+def stop_stations(stations: list[StationSimulator], deadline: float) -> int:
+    """
+    Shut down the stations of a fleet, publishing their offline status.
+
+    Stations left when the deadline passes are skipped; the presence topic of
+    their pooled connection still turns offline when it disconnects.
+
+    Args:
+        stations (list[StationSimulator]): The stations to shut down
+        deadline (float): Monotonic time to give up at
+
+    Returns:
+        int: Number of stations shut down
+    """
+    for index, station in enumerate(stations):
+        if monotonic() > deadline:
+            logger.warning(
+                f"Shutdown deadline passed, skipped {len(stations) - index} stations"
+            )
+            return index
+        station.shutdown_sequence(quiet=True)
+    return len(stations)
+
+
+class FleetSimulator:
+    """
+    Hosts many power stations in a single process.
+
+    All stations share a small pool of MQTT connections and one Scheduler backed
+    by a fixed pool of worker threads, so neither the thread count nor the number
+    of broker connections grows with the number of simulated stations. Outputs are
+    generated per batch of stations with a vectorized FleetOutputGenerator.
+
+    The pooled connections are opened in parallel and awaited (see
+    MQTTConnectionPool.connect), and shutdown completes within
+    SHUTDOWN_TIMEOUT_SECONDS, abandoning whatever is still running past it.
+
+    Attributes:
+        stations (list[StationSimulator]): The simulated stations of the fleet
+        routers (list[ControlRouter]): Dispatch the control commands of the
+            stations, one per pooled connection
+        startup_seconds (float | None): Duration of the last startup
+        shutdown_seconds (float | None): Duration of the last shutdown
+    """
+
+    def __init__(
+        self,
+        app_configs: list[AppConfig],
+        workers: int = 4,
+        connections: int = 1,
+        seed: int | None = None,
+        trace_replay: TraceReplay | None = None,
+        client_factory: Callable[..., MQTTClient] = get_mqtt_client,
+        scenario: Scenario | None = None,
+    ):
+        """
+        Initialize the fleet.
+
+        Args:
+            app_configs (list[AppConfig]): One configuration per station. The MQTT
+                settings of the first station are used for the shared connections.
+            workers (int, optional): Number of scheduler worker threads. Defaults to 4.
+            connections (int, optional): Number of physical broker connections the
+                stations are multiplexed over. Defaults to 1.
+            seed (int, optional): RNG seed making the generated outputs reproducible.
+                Defaults to a random seed.
+            trace_replay (TraceReplay, optional): Replay recorded outputs instead of
+                generating random ones. Defaults to None.
+            client_factory (Callable[..., MQTTClient], optional): Builds the pooled
+                clients. Defaults to get_mqtt_client.
+            scenario (Scenario, optional): Scenario of timed events to run against
+                the fleet. Defaults to None.
+        """
+        if not app_configs:
+            raise ValueError("A fleet needs at least one station config")
+
+        self.seed: int = seed if seed is not None else randrange(2**32)
+        self.trace_replay: TraceReplay | None = trace_replay
+        self.scenario: Scenario | None = scenario
+        self.engine: ScenarioEngine | None = None
+        self.workers: int = workers
+        self.scheduler: Scheduler = Scheduler(workers=workers, name="fleet")
+        self.pool: MQTTConnectionPool = MQTTConnectionPool(
+            app_config=app_configs[0], size=connections, client_factory=client_factory
+        )
+        self.stations: list[StationSimulator] = [
+            StationSimulator(
+                app_config=app_config,
+                mqtt_client=self.pool.client_for(app_config.POWER_STATION_ID),
+            )
+            for app_config in app_configs
+        ]
+        self.routers: list[ControlRouter] = build_control_routers(
+            self.stations, self.pool
+        )
+        self.shutdown_timeout: float = app_configs[0].SHUTDOWN_TIMEOUT_SECONDS
+        self.startup_seconds: float | None = None
+        self.shutdown_seconds: float | None = None
+
+    def startup_sequence(self):
+        """
+        Connect the pooled clients and register every station on the scheduler.
+
+        The first publish of each station is offset within its publish interval,
+        so the fleet does not emit all readings in a single burst.
+        """
+        logger.info(
+            f"Initializing FleetSimulator startup-sequence for {len(self.stations)} stations..."
+        )
+        started = monotonic()
+        self.pool.connect()
+
+        fleet_size = len(self.stations)
+        pinned: dict[int, list[tuple[int, StationSimulator]]] = defaultdict(list)
+        for index, station in enumerate(self.stations):
+            pinned[id(station.mqqt_client)].append((index, station))
+
+        def start_stations(stations: list[tuple[int, StationSimulator]]):
+            for index, station in stations:
+                station.startup_sequence(
+                    scheduler=self.scheduler,
+                    delay=station.app_config.PUBLISH_INTERVAL_SECONDS
+                    * index
+                    / fleet_size,
+                    schedule_output=False,
+                    subscribe_control=False,
+                    quiet=True,
+                )
+
+        # The stations of every connection publish their retained state in parallel
+        with ThreadPoolExecutor(
+            max_workers=min(self.pool.connect_concurrency, len(pinned)),
+            thread_name_prefix="fleet-startup",
+        ) as executor:
+            list(executor.map(start_stations, pinned.values()))
+        for router in self.routers:
+            router.start()
+
+        batches = build_output_batches(
+            self.stations,
+            self.workers,
+            self.seed,
+            self.pool,
+            trace_replay=self.trace_replay,
+            scenario=self.scenario,
+        )
+        if self.scenario:
+            self.engine = schedule_scenario(self.scenario, batches, self.scheduler)
+        for index, batch in enumerate(batches):
+            batch.publish_manifest()
+            self.scheduler.schedule_periodic(
+                batch.publish_outputs,
+                batch.interval,
+                batch.interval * index / len(batches),
+            )
+        self.scheduler.start()
+        self.startup_seconds = monotonic() - started
+        logger.info(
+            f"FleetSimulator startup-sequence COMPLETED in {self.startup_seconds:.3f}s."
+        )
+
+    def shutdown_sequence(self):
+        """
+        Stop the scheduler, every station and the pooled connections.
+
+        The scheduler is stopped first, so no reading is published after the
+        offline status of its station.
+        """
+        logger.info("Initializing FleetSimulator shutdown-sequence...")
+        started = monotonic()
+        deadline = started + self.shutdown_timeout
+        for router in self.routers:
+            router.stop()
+        self.scheduler.stop(timeout=self.shutdown_timeout)
+        stop_stations(self.stations, deadline)
+        self.pool.disconnect(timeout=max(deadline - monotonic(), 0))
+        self.shutdown_seconds = monotonic() - started
+        logger.info(
+            f"FleetSimulator shutdown-sequence COMPLETED in {self.shutdown_seconds:.3f}s."
+        )
+
+
+class AsyncFleetSimulator:
+    """
+    Hosts many power stations on a single asyncio event loop.
+
+    The asyncio counterpart of FleetSimulator: the pooled AsyncMQTTClients do their
+    network I/O on the loop and an AsyncScheduler fires the publishers, so the
+    whole fleet runs without any helper threads.
+
+    Attributes:
+        stations (list[StationSimulator]): The simulated stations of the fleet
+        routers (list[ControlRouter]): Dispatch the control commands of the
+            stations, one per pooled connection
+        startup_seconds (float | None): Duration of the last startup
+        shutdown_seconds (float | None): Duration of the last shutdown
+    """
+
+    def __init__(
+        self,
+        app_configs: list[AppConfig],
+        connections: int = 1,
+        seed: int | None = None,
+        trace_replay: TraceReplay | None = None,
+        scenario: Scenario | None = None,
+    ):
+        """
+        Initialize the fleet.
+
+        Args:
+            app_configs (list[AppConfig]): One configuration per station. The MQTT
+                settings of the first station are used for the shared connections.
+            connections (int, optional): Number of physical broker connections the
+                stations are multiplexed over. Defaults to 1.
+            seed (int, optional): RNG seed making the generated outputs reproducible.
+                Defaults to a random seed.
+            trace_replay (TraceReplay, optional): Replay recorded outputs instead of
+                generating random ones. Defaults to None.
+            scenario (Scenario, optional): Scenario of timed events to run against
+                the fleet. Defaults to None.
+        """
+        if not app_configs:
+            raise ValueError("A fleet needs at least one station config")
+
+        self.seed: int = seed if seed is not None else randrange(2**32)
+        self.trace_replay: TraceReplay | None = trace_replay
+        self.scenario: Scenario | None = scenario
+        self.engine: ScenarioEngine | None = None
+        self.scheduler: AsyncScheduler = AsyncScheduler(name="fleet")
+        self.pool: MQTTConnectionPool = MQTTConnectionPool(
+            app_config=app_configs[0],
+            size=connections,
+            client_factory=get_async_mqtt_client,
+        )
+        self.stations: list[StationSimulator] = [
+            StationSimulator(
+                app_config=app_config,
+                mqtt_client=self.pool.client_for(app_config.POWER_STATION_ID),
+            )
+            for app_config in app_configs
+        ]
+        self.routers: list[ControlRouter] = build_control_routers(
+            self.stations, self.pool
+        )
+        self.shutdown_timeout: float = app_configs[0].SHUTDOWN_TIMEOUT_SECONDS
+        self.startup_seconds: float | None = None
+        self.shutdown_seconds: float | None = None
+
+    async def startup_sequence(self, timeout: float | None = None):
+        """
+        Connect the pooled clients and register every station on the scheduler.
+
+        Args:
+            timeout (float, optional): Seconds to wait for the broker to accept
+                the connections. Defaults to MQTT_CONNECT_TIMEOUT_SECONDS.
+        """
+        logger.info(
+            f"Initializing AsyncFleetSimulator startup-sequence for {len(self.stations)} stations..."
+        )
+        started = monotonic()
+        await self.pool.connect_async(timeout)
+
+        fleet_size = len(self.stations)
+        for index, station in enumerate(self.stations):
+            station.startup_sequence(
+                scheduler=self.scheduler,
+                delay=station.app_config.PUBLISH_INTERVAL_SECONDS * index / fleet_size,
+                schedule_output=False,
+                subscribe_control=False,
+                quiet=True,
+            )
+        for router in self.routers:
+            router.start()
+
+        batches = build_output_batches(
+            self.stations,
+            1,
+            self.seed,
+            self.pool,
+            trace_replay=self.trace_replay,
+            scenario=self.scenario,
+        )
+        if self.scenario:
+            self.engine = schedule_scenario(self.scenario, batches, self.scheduler)
+        for batch in batches:
+            batch.publish_manifest()
+            self.scheduler.schedule_periodic(batch.publish_outputs, batch.interval)
+        self.scheduler.start()
+        self.startup_seconds = monotonic() - started
+        logger.info(
+            f"AsyncFleetSimulator startup-sequence COMPLETED in {self.startup_seconds:.3f}s."
+        )
+
+    async def shutdown_sequence(self):
+        """
+        Stop the scheduler, every station and the pooled connections.
+        """
+        logger.info("Initializing AsyncFleetSimulator shutdown-sequence...")
+        started = monotonic()
+        for router in self.routers:
+            router.stop()
+        self.scheduler.stop()
+        stop_stations(self.stations, started + self.shutdown_timeout)
+        self.pool.disconnect()
+        # Give the loop a chance to flush the DISCONNECT packet
+        await async_sleep(0)
+        self.shutdown_seconds = monotonic() - started
+        logger.info(
+            f"AsyncFleetSimulator shutdown-sequence COMPLETED in {self.shutdown_seconds:.3f}s."
+        )
+
+    async def run_forever(self):
+        """
+        Start the fleet and keep it running until the surrounding task is cancelled.
+        """
+        await self.startup_sequence()
+        try:
+            await Event().wait()
+        finally:
+            await self.shutdown_sequence()
+
+
+class VirtualFleetSimulator:
+    """
+    Runs a fleet on a simulated clock, faster than real time.
+
+    The stations and output batches are the same as in FleetSimulator, but a
+    VirtualScheduler drives them without sleeping, and every message is stamped
+    with the simulated time. Messages go to a CSV FileSink, to a HistorySink or,
+    wrapped as {"ts": ..., "value": ...}, to the MQTT broker.
+
+    Attributes:
+        stations (list[StationSimulator]): The simulated stations of the fleet
+        scheduler (VirtualScheduler): The scheduler owning the simulated clock
+        drain_timeout (float): Seconds the sink may take, after the run, to
+            publish the messages still queued
+    """
+
+    def __init__(
+        self,
+        app_configs: list[AppConfig],
+        start_time: float | None = None,
+        output_path: str | None = None,
+        seed: int | None = None,
+        trace_replay: TraceReplay | None = None,
+        history_path: str | None = None,
+        scenario: Scenario | None = None,
+    ):
+        """
+        Initialize the fleet.
+
+        Args:
+            app_configs (list[AppConfig]): One configuration per station
+            start_time (float, optional): Simulated unix time of the first reading.
+                Defaults to now.
+            output_path (str, optional): CSV file to write to. If None, messages are
+                published to the broker configured for the first station.
+            seed (int, optional): RNG seed making the generated outputs reproducible.
+                Defaults to a random seed.
+            trace_replay (TraceReplay, optional): Replay recorded outputs instead of
+                generating random ones. Defaults to None.
+            history_path (str, optional): History store directory receiving the
+                readings, instead of the CSV file or the broker. Defaults to None.
+            scenario (Scenario, optional): Scenario of timed events to run against
+                the fleet, in simulated time. Defaults to None.
+        """
+        if not app_configs:
+            raise ValueError("A fleet needs at least one station config")
+
+        self.seed: int = seed if seed is not None else randrange(2**32)
+        self.trace_replay: TraceReplay | None = trace_replay
+        self.scenario: Scenario | None = scenario
+        self.engine: ScenarioEngine | None = None
+        self.scheduler: VirtualScheduler = VirtualScheduler(
+            start_time=start_time if start_time is not None else time(),
+            name="virtual-fleet",
+        )
+        self.sink: FileSink | HistorySink | TimestampedMQTTSink
+        if history_path:
+            self.sink = HistorySink(
+                history_path, app_configs[0], clock=self.scheduler.time
+            )
+        elif output_path:
+            self.sink = FileSink(output_path, clock=self.scheduler.time)
+        else:
+            self.sink = TimestampedMQTTSink(
+                MQTTConnectionPool(app_config=app_configs[0]).clients[0],
+                clock=self.scheduler.time,
+            )
+        self.stations: list[StationSimulator] = [
+            StationSimulator(app_config=app_config, mqtt_client=self.sink)
+            for app_config in app_configs
+        ]
+        self.drain_timeout: float = app_configs[0].SINK_DRAIN_TIMEOUT_SECONDS
+
+    def run(self, duration: float, start_running: bool = True):
+        """
+        Simulate `duration` seconds of fleet operation and return when done.
+
+        Args:
+            duration (float): Simulated seconds to run for
+            start_running (bool, optional): Start power generation on every station
+                before the run, instead of waiting for control commands.
+                Defaults to True.
+        """
+        logger.info(
+            f"Simulating {duration}s for {len(self.stations)} stations in virtual time..."
+        )
+        self.sink.connect()
+        if not self.sink.wait_until_connected(timeout=10.0):
+            logger.error("Telemetry sink is not connected, readings will be buffered")
+        for station in self.stations:
+            # Set before startup, so the first (retained) status is already right
+            station.running = start_running
+            station.startup_sequence(
+                scheduler=self.scheduler, schedule_output=False, quiet=True
+            )
+
+        batches = build_output_batches(
+            self.stations,
+            1,
+            self.seed,
+            clock=self.scheduler.time,
+            trace_replay=self.trace_replay,
+            scenario=self.scenario,
+        )
+        if self.scenario:
+            self.engine = schedule_scenario(
+                self.scenario, batches, self.scheduler, clock=self.scheduler.time
+            )
+        for batch in batches:
+            batch.publish_manifest()
+            self.scheduler.schedule_periodic(batch.publish_outputs, batch.interval)
+
+        started = time()
+        self.scheduler.start()
+        self.scheduler.run_until(self.scheduler.now + duration)
+        elapsed = time() - started
+
+        for station in self.stations:
+            station.shutdown_sequence(quiet=True)
+        self.scheduler.stop()
+        # Disconnecting discards the messages still queued by the client
+        if not self.sink.wait_until_published(self.drain_timeout):
+            logger.warning(
+                f"Telemetry sink did not publish every message within {self.drain_timeout}s"
+            )
+        self.sink.disconnect()
+        logger.info(
+            f"Simulated {duration}s in {elapsed:.2f}s ({duration / max(elapsed, 1e-9):.0f}x real time)."
+        )
+        if self.engine is not None:
+            logger.info(
+                f"Applied {self.engine.applied} scenario events, {len(self.engine)} pending."
+            )
+        if any(batch.deadband.enabled for batch in batches):
+            reported = sum(batch.deadband.reported for batch in batches)
+            suppressed = sum(batch.deadband.suppressed for batch in batches)
+            logger.info(
+                f"Deadband published {reported} outputs and suppressed {suppressed}."
+            )
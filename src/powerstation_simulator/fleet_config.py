@@ -0,0 +1,329 @@
+import argparse
+import csv
+import tomllib
+from functools import cache
+from pathlib import Path
+from time import perf_counter
+from typing import Annotated, Any
+
+import numpy as np
+from pydantic import TypeAdapter
+
+from config import DERIVED_INTERVALS, AppConfig, load_power_station_configs
+from logger import getLogger
+
+logger = getLogger(__name__)
+
+STATION_ID_FIELD: str = "POWER_STATION_ID"
+PUBLISH_INTERVAL_FIELD: str = "PUBLISH_INTERVAL_SECONDS"
+
+# Cells falling back to the default of the station
+MISSING: tuple = (None, "")
+
+FIELD_DTYPES: dict[type, np.dtype] = {
+    int: np.dtype(np.int64),
+    float: np.dtype(np.float64),
+    bool: np.dtype(np.bool_),
+}
+
+
+@cache
+def field_adapter(name: str) -> TypeAdapter:
+    """
+    Return the validator of a whole column of an AppConfig field.
+
+    The field's type and constraints are applied to every item, so a column of
+    ten thousand values is validated by a single pydantic-core call.
+
+    Args:
+        name (str): Name of the AppConfig field
+
+    Returns:
+        TypeAdapter: Validator of a list of values of the field
+    """
+    field = AppConfig.model_fields.get(name)
+    if field is None:
+        raise ValueError(f"Unknown config field: {name}")
+    item = (
+        Annotated[field.annotation, *field.metadata]
+        if field.metadata
+        else field.annotation
+    )
+    return TypeAdapter(list[item])
+
+
+def validate_column(name: str, values: list[Any]) -> np.ndarray:
+    """
+    Validate the values of a field and pack them into an array.
+
+    Args:
+        name (str): Name of the AppConfig field
+        values (list[Any]): One value per station, strings are coerced
+
+    Returns:
+        np.ndarray: int64, float64 or bool array for numeric fields, object array
+            otherwise
+    """
+    values = field_adapter(name).validate_python(values)
+    dtype = FIELD_DTYPES.get(type(values[0]), object) if values else object
+    return np.array(values, dtype=dtype)
+
+
+class FleetTable:
+    """
+    A fleet validated once into shared defaults plus per-station columns.
+
+    Only the fields that differ between stations are stored per station, one
+    array each; everything else lives once in `defaults`. Intervals derived from
+    PUBLISH_INTERVAL_SECONDS (see DERIVED_INTERVALS) follow the publish interval
+    of every station, unless they were configured explicitly.
+
+    Attributes:
+        defaults (AppConfig): Settings shared by every station
+        columns (dict[str, np.ndarray]): Per-station values, one array per field
+    """
+
+    def __init__(self, defaults: AppConfig, columns: dict[str, np.ndarray]):
+        """
+        Initialize the table from validated data.
+
+        Args:
+            defaults (AppConfig): Settings shared by every station
+            columns (dict[str, np.ndarray]): Per-station values, must contain
+                POWER_STATION_ID
+        """
+        ids = columns.get(STATION_ID_FIELD)
+        if ids is None:
+            raise ValueError(f"A fleet config must list every {STATION_ID_FIELD}")
+        if len(np.unique(ids)) != len(ids):
+            raise ValueError(f"Duplicate {STATION_ID_FIELD} in fleet config")
+        for name, column in columns.items():
+            if len(column) != len(ids):
+                raise ValueError(
+                    f"{name} has {len(column)} values for {len(ids)} stations"
+                )
+
+        self.defaults: AppConfig = defaults
+        self.columns: dict[str, np.ndarray] = columns
+
+        if PUBLISH_INTERVAL_FIELD in columns:
+            for name, factor in DERIVED_INTERVALS.items():
+                if name not in columns and name not in defaults.model_fields_set:
+                    columns[name] = columns[PUBLISH_INTERVAL_FIELD] * factor
+
+    def __len__(self) -> int:
+        return len(self.columns[STATION_ID_FIELD])
+
+    @property
+    def station_ids(self) -> list[str]:
+        """
+        The POWER_STATION_ID of every station, in table order.
+        """
+        return self.columns[STATION_ID_FIELD].tolist()
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Return the value of a field for every station.
+
+        Args:
+            name (str): Name of the AppConfig field
+
+        Returns:
+            np.ndarray: The stored column, or the default repeated for every station
+        """
+        if name in self.columns:
+            return self.columns[name]
+        return validate_column(name, [getattr(self.defaults, name)] * len(self))
+
+    def app_configs(self) -> list[AppConfig]:
+        """
+        Materialize the AppConfig of every station.
+
+        The configs are shallow copies of `defaults` updated with one row of the
+        table, so no settings source is read and no value is validated again.
+
+        Returns:
+            list[AppConfig]: One configuration per station, in table order
+        """
+        names = list(self.columns)
+        rows = zip(*(self.columns[name].tolist() for name in names))
+        return [self.defaults.model_copy(update=dict(zip(names, row))) for row in rows]
+
+    @classmethod
+    def from_columns(
+        cls,
+        base: AppConfig,
+        defaults: dict[str, Any],
+        columns: dict[str, list[Any]],
+    ) -> "FleetTable":
+        """
+        Validate the defaults and the columns of station values into a table.
+
+        Args:
+            base (AppConfig): Config the defaults apply to
+            defaults (dict[str, Any]): Overrides shared by every station
+            columns (dict[str, list[Any]]): One list of values per field; None or
+                an empty string falls back to the default of the station
+
+        Returns:
+            FleetTable: The validated table
+        """
+        shared = base.model_copy(
+            update={
+                name: validate_column(name, [value]).tolist()[0]
+                for name, value in defaults.items()
+            }
+        ).derive_intervals()
+
+        # The publish interval goes first, derived intervals fall back to it
+        validated: dict[str, np.ndarray] = {}
+        for name in sorted(columns, key=lambda name: name != PUBLISH_INTERVAL_FIELD):
+            values = columns[name]
+            present = np.array([value not in MISSING for value in values], dtype=bool)
+            if present.all():
+                validated[name] = validate_column(name, values)
+                continue
+            if not present.any():
+                continue
+
+            publish = validated.get(PUBLISH_INTERVAL_FIELD)
+            if (
+                name in DERIVED_INTERVALS
+                and name not in shared.model_fields_set
+                and publish is not None
+            ):
+                column = publish * DERIVED_INTERVALS[name]
+            else:
+                column = validate_column(name, [getattr(shared, name)] * len(values))
+            column[present] = validate_column(
+                name, [value for value in values if value not in MISSING]
+            )
+            validated[name] = column
+
+        return cls(shared, validated)
+
+    @classmethod
+    def from_rows(
+        cls,
+        base: AppConfig,
+        defaults: dict[str, Any],
+        rows: list[dict[str, Any]],
+    ) -> "FleetTable":
+        """
+        Validate station rows, e.g. `[[stations]]` tables, into a table.
+
+        Args:
+            base (AppConfig): Config the defaults apply to
+            defaults (dict[str, Any]): Overrides shared by every station
+            rows (list[dict[str, Any]]): Overrides of every station
+
+        Returns:
+            FleetTable: The validated table
+        """
+        names = dict.fromkeys(name for row in rows for name in row)
+        return cls.from_columns(
+            base, defaults, {name: [row.get(name) for row in rows] for name in names}
+        )
+
+
+def load_fleet_table(path: str, base: AppConfig | None = None) -> FleetTable:
+    """
+    Load a fleet config file.
+
+    TOML files hold an optional `[defaults]` table and the stations, either as
+    `[[stations]]` tables (one per station) or as a columnar `[stations]` table
+    of equally long arrays. CSV files have a header row of field names and one
+    row per station; empty cells fall back to the defaults.
+
+    Example:
+        [defaults]
+        MQTT_HOST = "mosquitto"
+        PUBLISH_INTERVAL_SECONDS = 5
+
+        [stations]
+        POWER_STATION_ID = ["PS_001", "PS_002", "PS_003"]
+        CAPACITY_KW = [2600, 1200, 800]
+
+    Args:
+        path (str): Path of the .toml or .csv file
+        base (AppConfig, optional): Config the defaults apply to. Defaults to the
+            unprefixed environment config.
+
+    Returns:
+        FleetTable: The validated fleet
+    """
+    started = perf_counter()
+    base = base or load_power_station_configs()
+    suffix = Path(path).suffix.lower()
+
+    if suffix == ".toml":
+        with open(path, "rb") as toml_file:
+            document = tomllib.load(toml_file)
+        defaults = document.get("defaults", {})
+        stations = document.get("stations", [])
+        table = (
+            FleetTable.from_columns(base, defaults, stations)
+            if isinstance(stations, dict)
+            else FleetTable.from_rows(base, defaults, stations)
+        )
+    elif suffix == ".csv":
+        with open(path, newline="") as csv_file:
+            reader = csv.reader(csv_file)
+            header = next(reader, [])
+            table = FleetTable.from_columns(
+                base, {}, dict(zip(header, map(list, zip(*reader))))
+            )
+    else:
+        raise ValueError(f"Unsupported fleet config format: {path}")
+
+    logger.info(
+        f"Loaded {len(table)} stations from {path} in {perf_counter() - started:.3f}s"
+    )
+    return table
+
+
+def write_example(path: str, stations: int, seed: int = 0) -> None:
+    """
+    Write a columnar TOML fleet config of random stations, e.g. for benchmarks.
+
+    Args:
+        path (str): Path of the .toml file to create
+        stations (int): Number of stations
+        seed (int, optional): RNG seed. Defaults to 0.
+    """
+    rng = np.random.default_rng(seed)
+    ids = ", ".join(f'"PS_{index:05d}"' for index in range(stations))
+    capacities = ", ".join(map(str, rng.integers(100, 5000, stations).tolist()))
+    with open(path, "w") as toml_file:
+        toml_file.write(
+            "[defaults]\nPUBLISH_INTERVAL_SECONDS = 1\n\n"
+            f"[stations]\nPOWER_STATION_ID = [{ids}]\nCAPACITY_KW = [{capacities}]\n"
+        )
+
+
+if __name__ == "__main__":
+    """
+    Validate a fleet config file, or write an example one.
+
+    Example usage:
+        python fleet_config.py fleet.toml
+        python fleet_config.py fleet.toml --example 10000
+    """
+    parser = argparse.ArgumentParser(description="⚡ Validate a fleet config file")
+    parser.add_argument("path", help="The .toml or .csv fleet config")
+    parser.add_argument(
+        "--example",
+        type=int,
+        metavar="STATIONS",
+        help="Write an example config with this many stations instead",
+    )
+    args = parser.parse_args()
+
+    if args.example:
+        write_example(args.path, args.example)
+    else:
+        started = perf_counter()
+        configs = load_fleet_table(args.path).app_configs()
+        logger.info(
+            f"Materialized {len(configs)} configs in {perf_counter() - started:.3f}s"
+        )
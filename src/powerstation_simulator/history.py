@@ -0,0 +1,714 @@
+import argparse
+import json
+from datetime import datetime
+from math import isfinite
+from pathlib import Path
+from threading import RLock
+from time import sleep, time
+from typing import Any
+
+import numpy as np
+
+from config import AppConfig, load_power_station_configs
+from logger import getLogger
+from mqtt_client import MQTTClient, get_mqtt_client
+from telemetry_batch import decode_batch, decode_manifest
+
+logger = getLogger(__name__)
+
+# One reading per record
+RAW_DTYPE: np.dtype = np.dtype([("ts", "<f8"), ("station", "<u4"), ("value", "<i4")])
+INT32_MIN, INT32_MAX = int(np.iinfo(np.int32).min), int(np.iinfo(np.int32).max)
+# One bucket of one station per record; ts is the start of the bucket
+TIER_DTYPE: np.dtype = np.dtype(
+    [
+        ("ts", "<f8"),
+        ("station", "<u4"),
+        ("count", "<u4"),
+        ("sum", "<f8"),
+        ("min", "<i4"),
+        ("max", "<i4"),
+    ]
+)
+# Downsample tiers: name -> bucket width in seconds
+TIERS: dict[str, int] = {"1m": 60, "1h": 3600}
+
+SEGMENT_RECORDS: int = 1 << 20
+MANIFEST_FILE: str = "segments.json"
+STATIONS_FILE: str = "stations.txt"
+
+# Single readings buffered before they are appended as one chunk
+PENDING_READINGS: int = 4096
+
+
+class SegmentLog:
+    """
+    An append-only table stored column by column in fixed-size segment files.
+
+    Every segment holds up to `segment_records` records, with one memory-mapped
+    file per column, e.g. `000003.ts`. The manifest keeps the record count and
+    the time range of every segment, so a range query maps only the segments it
+    overlaps and, in segments whose timestamps never went backwards, only the
+    rows inside the range.
+
+    Records are durable once flush() has written the manifest; records appended
+    after the last flush are lost if the process dies.
+
+    Attributes:
+        directory (Path): Directory of the segment files
+        dtype (np.dtype): Structured dtype of a record, one column per field,
+            including a float64 "ts" field
+        segment_records (int): Capacity of a segment
+        segments (list[dict]): count, ts_min, ts_max and sorted of every segment
+    """
+
+    def __init__(
+        self, directory: Path, dtype: np.dtype, segment_records: int = SEGMENT_RECORDS
+    ):
+        """
+        Open the log, creating the directory if needed.
+
+        Args:
+            directory (Path): Directory of the segment files
+            dtype (np.dtype): Structured dtype of a record
+            segment_records (int, optional): Capacity of a new segment. Defaults
+                to SEGMENT_RECORDS.
+        """
+        self.directory: Path = directory
+        self.dtype: np.dtype = dtype
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        manifest = self.directory / MANIFEST_FILE
+        state = (
+            json.loads(manifest.read_text())
+            if manifest.exists()
+            else dict(segment_records=segment_records, segments=[])
+        )
+        self.segment_records: int = state["segment_records"]
+        self.segments: list[dict] = state["segments"]
+        self.__columns: dict[str, np.memmap] | None = None
+        if self.segments and self.segments[-1]["count"] < self.segment_records:
+            self.__columns = self.__map(len(self.segments) - 1, "r+")
+
+    def __len__(self) -> int:
+        return sum(segment["count"] for segment in self.segments)
+
+    def __path(self, segment: int, field: str) -> Path:
+        return self.directory / f"{segment:06d}.{field}"
+
+    def __map(self, segment: int, mode: str) -> dict[str, np.memmap]:
+        """
+        Map the column files of a segment.
+        """
+        return {
+            field: np.memmap(
+                self.__path(segment, field),
+                dtype=self.dtype[field],
+                mode=mode,
+                shape=(self.segment_records,),
+            )
+            for field in self.dtype.names
+        }
+
+    def append(self, records: np.ndarray):
+        """
+        Append records, opening new segments as the current one fills up.
+
+        Args:
+            records (np.ndarray): Records of dtype `dtype`
+        """
+        start = 0
+        while start < len(records):
+            if self.__columns is None:
+                self.segments.append(
+                    dict(count=0, ts_min=None, ts_max=None, sorted=True)
+                )
+                self.__columns = self.__map(len(self.segments) - 1, "w+")
+            segment = self.segments[-1]
+            count = segment["count"]
+            chunk = records[start : start + self.segment_records - count]
+            for field, column in self.__columns.items():
+                column[count : count + len(chunk)] = chunk[field]
+
+            ts = chunk["ts"]
+            first, low, high = float(ts[0]), float(ts.min()), float(ts.max())
+            if segment["ts_max"] is not None:
+                segment["sorted"] &= first >= segment["ts_max"]
+            segment["sorted"] &= bool(np.all(ts[1:] >= ts[:-1]))
+            segment["ts_min"] = (
+                low if segment["ts_min"] is None else min(segment["ts_min"], low)
+            )
+            segment["ts_max"] = (
+                high if segment["ts_max"] is None else max(segment["ts_max"], high)
+            )
+            segment["count"] = count + len(chunk)
+            start += len(chunk)
+
+            if segment["count"] == self.segment_records:
+                self.__seal()
+
+    def __seal(self):
+        """
+        Flush the full current segment and write the manifest.
+        """
+        for column in self.__columns.values():
+            column.flush()
+        self.__columns = None
+        self.__write_manifest()
+
+    def __write_manifest(self):
+        manifest = self.directory / MANIFEST_FILE
+        temporary = manifest.with_suffix(".tmp")
+        temporary.write_text(
+            json.dumps(
+                dict(segment_records=self.segment_records, segments=self.segments)
+            )
+        )
+        temporary.replace(manifest)
+
+    def flush(self):
+        """
+        Make every appended record durable.
+        """
+        if self.__columns is not None:
+            for column in self.__columns.values():
+                column.flush()
+        self.__write_manifest()
+
+    def read(self, start: float, end: float) -> np.ndarray:
+        """
+        Return the records with `start <= ts < end`.
+
+        Args:
+            start (float): Start of the range, unix time
+            end (float): End of the range (exclusive), unix time
+
+        Returns:
+            np.ndarray: Matching records of dtype `dtype`, in append order
+        """
+        parts = []
+        for index, segment in enumerate(self.segments):
+            count = segment["count"]
+            if not count or segment["ts_max"] < start or segment["ts_min"] >= end:
+                continue
+            is_current = index == len(self.segments) - 1 and self.__columns is not None
+            columns = self.__columns if is_current else self.__map(index, "r")
+
+            ts = columns["ts"][:count]
+            if segment["sorted"]:
+                rows = slice(*np.searchsorted(ts, [start, end], side="left"))
+            else:
+                rows = np.flatnonzero((ts >= start) & (ts < end))
+            part = np.empty(len(ts[rows]), dtype=self.dtype)
+            for field, column in columns.items():
+                part[field] = column[:count][rows]
+            parts.append(part)
+        return np.concatenate(parts) if parts else np.empty(0, dtype=self.dtype)
+
+
+class Downsampler:
+    """
+    Folds readings into fixed-width buckets of count, sum, min and max per station.
+
+    Only the open bucket is kept in memory, as one array per statistic indexed by
+    station; it is emitted to the tier's SegmentLog as soon as a reading of a
+    later bucket arrives. Readings older than the open bucket are folded into it.
+
+    Attributes:
+        width (int): Bucket width in seconds
+        log (SegmentLog): Where closed buckets are appended
+        bucket (float | None): Start of the open bucket
+    """
+
+    def __init__(self, width: int, log: SegmentLog):
+        """
+        Initialize the downsampler.
+
+        Args:
+            width (int): Bucket width in seconds
+            log (SegmentLog): Where closed buckets are appended
+        """
+        self.width: int = width
+        self.log: SegmentLog = log
+        self.bucket: float | None = None
+        self.__count = np.zeros(0, dtype=np.uint32)
+        self.__sum = np.zeros(0, dtype=np.float64)
+        self.__min = np.zeros(0, dtype=np.int32)
+        self.__max = np.zeros(0, dtype=np.int32)
+
+    def __reserve(self, stations: int):
+        missing = stations - len(self.__count)
+        if missing > 0:
+            size = max(stations, 2 * len(self.__count))
+            grow = size - len(self.__count)
+            self.__count = np.concatenate([self.__count, np.zeros(grow, np.uint32)])
+            self.__sum = np.concatenate([self.__sum, np.zeros(grow, np.float64)])
+            info = np.iinfo(np.int32)
+            self.__min = np.concatenate([self.__min, np.full(grow, info.max, np.int32)])
+            self.__max = np.concatenate([self.__max, np.full(grow, info.min, np.int32)])
+
+    def add(self, records: np.ndarray):
+        """
+        Fold raw records into the buckets, emitting the buckets they close.
+
+        Args:
+            records (np.ndarray): Records of dtype RAW_DTYPE
+        """
+        if not len(records):
+            return
+        self.__reserve(int(records["station"].max()) + 1)
+        buckets = np.floor(records["ts"] / self.width) * self.width
+        if self.bucket is None:
+            self.bucket = float(buckets[0])
+
+        # Split where a later bucket starts; usually the chunk is one bucket
+        later = np.flatnonzero(buckets > self.bucket)
+        start = 0
+        while len(later):
+            first = later[0]
+            self.__fold(records[start:first])
+            self.emit()
+            self.bucket = float(buckets[first])
+            start = first
+            later = later[buckets[later] > self.bucket]
+        self.__fold(records[start:])
+
+    def __fold(self, records: np.ndarray):
+        stations, values = records["station"], records["value"]
+        np.add.at(self.__count, stations, 1)
+        np.add.at(self.__sum, stations, values)
+        np.minimum.at(self.__min, stations, values)
+        np.maximum.at(self.__max, stations, values)
+
+    def emit(self):
+        """
+        Append the open bucket of every station that has readings, and reset it.
+        """
+        stations = np.flatnonzero(self.__count)
+        if not len(stations):
+            return
+        rows = np.empty(len(stations), dtype=TIER_DTYPE)
+        rows["ts"] = self.bucket
+        rows["station"] = stations
+        rows["count"] = self.__count[stations]
+        rows["sum"] = self.__sum[stations]
+        rows["min"] = self.__min[stations]
+        rows["max"] = self.__max[stations]
+        self.log.append(rows)
+
+        info = np.iinfo(np.int32)
+        self.__count[stations] = 0
+        self.__sum[stations] = 0
+        self.__min[stations] = info.max
+        self.__max[stations] = info.min
+
+
+class HistoryStore:
+    """
+    Local, append-only history of station readings with downsampled tiers.
+
+    Readings are appended to the raw SegmentLog (timestamp, station index, value)
+    and folded into the 1-minute and 1-hour tiers (TIERS) as they arrive, so
+    long-range trends never have to scan the raw readings. Station ids are
+    mapped to dense indices, kept in `stations.txt` in index order.
+
+    Single readings are buffered and appended in chunks of PENDING_READINGS; the
+    buffer is appended by flush(), by query() and by close(). The open bucket of
+    every tier is only written when it closes or on close(); after a restart a
+    bucket may therefore appear more than once, and its rows combine by adding
+    counts and sums and taking the extremes.
+
+    Attributes:
+        root (Path): Directory of the store
+        raw (SegmentLog): Every reading
+        tiers (dict[str, Downsampler]): The downsample tiers by name
+        station_ids (list[str]): The id of every station index
+    """
+
+    def __init__(self, root: str, segment_records: int = SEGMENT_RECORDS):
+        """
+        Open the store, creating it if needed.
+
+        Args:
+            root (str): Directory of the store
+            segment_records (int, optional): Records per raw segment of a new
+                store; tiers use a sixteenth of it. Defaults to SEGMENT_RECORDS.
+        """
+        self.root: Path = Path(root)
+        self.raw: SegmentLog = SegmentLog(self.root / "raw", RAW_DTYPE, segment_records)
+        self.tiers: dict[str, Downsampler] = {
+            name: Downsampler(
+                width,
+                SegmentLog(self.root / name, TIER_DTYPE, max(segment_records // 16, 1)),
+            )
+            for name, width in TIERS.items()
+        }
+
+        stations_file = self.root / STATIONS_FILE
+        self.station_ids: list[str] = (
+            stations_file.read_text().splitlines() if stations_file.exists() else []
+        )
+        self.__station_index: dict[str, int] = {
+            station_id: index for index, station_id in enumerate(self.station_ids)
+        }
+        self.__stations_file = open(stations_file, "a")
+        self.__pending: list[tuple[float, int, int]] = []
+        self.__lock = RLock()
+
+    def station_index(self, station_id: str) -> int:
+        """
+        Return the index of a station, registering it if it is new.
+
+        Args:
+            station_id (str): The POWER_STATION_ID of the station
+
+        Returns:
+            int: Its index in the station column
+        """
+        index = self.__station_index.get(station_id)
+        if index is None:
+            with self.__lock:
+                index = self.__station_index.setdefault(
+                    station_id, len(self.station_ids)
+                )
+                if index == len(self.station_ids):
+                    self.station_ids.append(station_id)
+                    self.__stations_file.write(station_id + "\n")
+        return index
+
+    def record(self, station_id: str, timestamp: float, value: int):
+        """
+        Buffer one reading.
+
+        Args:
+            station_id (str): The POWER_STATION_ID of the station
+            timestamp (float): Unix time of the reading
+            value (int): The reading
+        """
+        index = self.station_index(station_id)
+        with self.__lock:
+            self.__pending.append((timestamp, index, value))
+            if len(self.__pending) >= PENDING_READINGS:
+                self.__append_pending()
+
+    def append(
+        self,
+        timestamps: np.ndarray | float,
+        stations: np.ndarray,
+        values: np.ndarray,
+    ):
+        """
+        Append many readings at once, e.g. one tick of a whole fleet.
+
+        Args:
+            timestamps (np.ndarray | float): Unix time of every reading, or one
+                time for all of them
+            stations (np.ndarray): Station index of every reading, see
+                station_index()
+            values (np.ndarray): Every reading
+        """
+        records = np.empty(len(values), dtype=RAW_DTYPE)
+        records["ts"] = timestamps
+        records["station"] = stations
+        records["value"] = values
+        with self.__lock:
+            self.__append_pending()
+            self.__append(records)
+
+    def __append(self, records: np.ndarray):
+        self.raw.append(records)
+        for tier in self.tiers.values():
+            tier.add(records)
+
+    def __append_pending(self):
+        if self.__pending:
+            self.__append(np.array(self.__pending, dtype=RAW_DTYPE))
+            self.__pending.clear()
+
+    def flush(self):
+        """
+        Append the buffered readings and make everything appended durable.
+        """
+        with self.__lock:
+            self.__append_pending()
+            self.__stations_file.flush()
+            self.raw.flush()
+            for tier in self.tiers.values():
+                tier.log.flush()
+
+    def close(self):
+        """
+        Write the open buckets of every tier, flush and close the store.
+        """
+        with self.__lock:
+            self.__append_pending()
+            for tier in self.tiers.values():
+                tier.emit()
+            self.flush()
+            self.__stations_file.close()
+
+    def query(
+        self,
+        start: float,
+        end: float,
+        station_ids: list[str] | None = None,
+        tier: str = "raw",
+    ) -> np.ndarray:
+        """
+        Read the history of a time range.
+
+        Only the segments overlapping the range are mapped. Tiers only hold
+        closed buckets, so the latest minute or hour is found in "raw".
+
+        Args:
+            start (float): Start of the range, unix time
+            end (float): End of the range (exclusive), unix time
+            station_ids (list[str], optional): Restrict to these stations.
+                Defaults to every station.
+            tier (str, optional): "raw" or one of TIERS. Defaults to "raw".
+
+        Returns:
+            np.ndarray: Records of RAW_DTYPE, or TIER_DTYPE for a tier, in
+                append order
+        """
+        with self.__lock:
+            self.__append_pending()
+            log = self.raw if tier == "raw" else self.tiers[tier].log
+            records = log.read(start, end)
+        if station_ids is not None:
+            wanted = [
+                self.__station_index[station_id]
+                for station_id in station_ids
+                if station_id in self.__station_index
+            ]
+            records = records[np.isin(records["station"], wanted)]
+        return records
+
+
+class HistoryRecorder:
+    """
+    Feeds a HistoryStore from the MQTT telemetry stream.
+
+    Records the per-station output topics and the batched fleet telemetry;
+    enable only one of them on the fleet (ENABLE_STATION_TOPICS or
+    ENABLE_BATCH_TELEMETRY), or readings are recorded twice. Outputs stamped
+    by a TimestampedMQTTSink keep their simulated time; plain outputs are
+    stamped on arrival.
+
+    Attributes:
+        store (HistoryStore): The store receiving the readings
+        subscriptions (list[str]): The topic filters of the recorder
+    """
+
+    def __init__(
+        self,
+        store: HistoryStore,
+        app_config: AppConfig,
+        mqtt_client: MQTTClient | None = None,
+    ):
+        """
+        Initialize the recorder.
+
+        Args:
+            store (HistoryStore): The store receiving the readings
+            app_config (AppConfig): Configuration providing the broker settings
+                and MQTT_TOPIC_PREFIX
+            mqtt_client (MQTTClient, optional): A shared, externally managed client.
+                If None, the recorder creates and owns its own connection.
+        """
+        self.store: HistoryStore = store
+        self.owns_client: bool = mqtt_client is None
+        self.mqqt_client: MQTTClient = mqtt_client or get_mqtt_client(
+            app_config=app_config.model_copy(update={"POWER_STATION_ID": "history"})
+        )
+        self.__connect_timeout: float = app_config.MQTT_CONNECT_TIMEOUT_SECONDS
+        prefix = app_config.MQTT_TOPIC_PREFIX
+        self.__prefix: str = prefix + "/"
+        self.subscriptions: list[str] = [
+            f"{prefix}/+/output",
+            f"{prefix}/batch/+/manifest",
+            f"{prefix}/batch/+/telemetry",
+        ]
+        # batch id -> station index of every record index
+        self.__manifests: dict[str, np.ndarray] = {}
+
+    def start(self):
+        """
+        Connect, if the client is owned, and subscribe to the telemetry.
+        """
+        if self.owns_client:
+            self.mqqt_client.connect()
+            timeout = self.__connect_timeout
+            if not self.mqqt_client.wait_until_connected(timeout):
+                logger.warning(
+                    f"MQTT broker did not accept the connection within {timeout}s, "
+                    "retrying in the background"
+                )
+        for subscription in self.subscriptions:
+            self.mqqt_client.subscribe(
+                topic=subscription, qos=0, on_message=self.handle
+            )
+
+    def stop(self):
+        """
+        Unsubscribe, or disconnect an owned client, and flush the store.
+        """
+        if self.owns_client:
+            self.mqqt_client.disconnect()
+        else:
+            for subscription in self.subscriptions:
+                self.mqqt_client.unsubscribe(subscription)
+        self.store.flush()
+
+    def handle(self, client: Any, userdata: Any, message: Any):
+        """
+        Callback handler for the subscribed telemetry.
+
+        Args:
+            client: MQTT client instance (not used)
+            userdata: MQTT user data (not used)
+            message: The MQTT message
+        """
+        try:
+            self.ingest(message.topic, message.payload)
+        except (ValueError, KeyError, TypeError, OverflowError, IndexError) as error:
+            logger.warning(f"Invalid message on {message.topic}: {error}")
+
+    def ingest(self, topic: str, payload: bytes | str, received: float | None = None):
+        """
+        Record one message; messages on other topics are ignored.
+
+        Args:
+            topic (str): The topic of the message
+            payload (bytes | str): Its payload
+            received (float, optional): Time stamping unstamped outputs.
+                Defaults to now.
+        """
+        parts = topic[len(self.__prefix) :].split("/")
+        if parts[0] == "batch":
+            if parts[2] == "manifest":
+                self.__manifests[parts[1]] = np.array(
+                    [self.store.station_index(id_) for id_ in decode_manifest(payload)],
+                    dtype=np.uint32,
+                )
+            elif (manifest := self.__manifests.get(parts[1])) is not None:
+                timestamp, records = decode_batch(payload)
+                if len(records) and int(records["index"].max()) >= len(manifest):
+                    raise ValueError(f"Batch of {parts[1]} does not match its manifest")
+                self.store.append(
+                    timestamp + records["offset_ms"] / 1000,
+                    manifest[records["index"]],
+                    records["output"],
+                )
+            return
+
+        if len(parts) != 2 or parts[1] != "output":
+            return
+        timestamp = received if received is not None else time()
+        self.store.record(parts[0], *parse_reading(payload, timestamp))
+
+
+def parse_reading(payload: bytes | str, received: float) -> tuple[float, int]:
+    """
+    Parse and validate a station output reading.
+
+    Accepts both a bare number and the {"ts": ..., "value": ...} payload of a
+    TimestampedMQTTSink. Readings are range-checked here because one that does
+    not fit RAW_DTYPE would otherwise fail every later flush of a store.
+
+    Args:
+        payload (bytes | str): The payload of the output topic
+        received (float): Timestamp of a bare number
+
+    Returns:
+        tuple[float, int]: The timestamp and the value of the reading
+
+    Raises:
+        ValueError: If the payload is malformed, either field is not a finite
+            number, or the value does not fit an int32
+    """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    timestamp, value = received, payload
+    if payload.startswith(b"{"):
+        reading = json.loads(payload)
+        if not isinstance(reading, dict) or not {"ts", "value"} <= reading.keys():
+            raise ValueError(f"Reading must have a ts and a value: {reading!r}")
+        timestamp, value = reading["ts"], reading["value"]
+        if isinstance(timestamp, bool) or not isinstance(timestamp, (int, float)):
+            raise ValueError(f"Timestamp is not a number: {timestamp!r}")
+    if isinstance(value, bool) or not isinstance(value, (int, float, bytes)):
+        raise ValueError(f"Value is not a number: {value!r}")
+    timestamp, number = float(timestamp), float(value)
+    if not (isfinite(timestamp) and isfinite(number)):
+        raise ValueError(f"Reading is not finite: {timestamp!r}, {value!r}")
+    if not INT32_MIN <= number <= INT32_MAX:
+        raise ValueError(f"Reading is out of range: {value!r}")
+    return timestamp, int(number)
+
+
+def parse_time(value: str) -> float:
+    """
+    Parse a unix time or an ISO 8601 date.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+if __name__ == "__main__":
+    """
+    Record the MQTT telemetry into a history store, or query one.
+
+    Example usage:
+        python history.py record ./history -sp PS_001
+        python history.py query ./history --start 2025-01-01 --end 2025-01-02 \\
+            --tier 1h --station PS_001_00000
+    """
+    parser = argparse.ArgumentParser(description="⚡ Telemetry history store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="Record the MQTT telemetry")
+    record_parser.add_argument("root", help="Directory of the store")
+    record_parser.add_argument(
+        "-sp",
+        "--station-prefix",
+        type=str,
+        help="Prefix for power station-specific environment variables (e.g., PS_001)",
+    )
+    record_parser.add_argument(
+        "--flush-interval",
+        type=float,
+        default=5.0,
+        help="Seconds between flushes of the store (default: 5)",
+    )
+
+    query_parser = subparsers.add_parser("query", help="Print a time range as CSV")
+    query_parser.add_argument("root", help="Directory of the store")
+    query_parser.add_argument("--start", type=parse_time, default=0.0)
+    query_parser.add_argument("--end", type=parse_time, default=float("inf"))
+    query_parser.add_argument("--tier", choices=["raw", *TIERS], default="raw")
+    query_parser.add_argument("--station", action="append", dest="stations")
+    args = parser.parse_args()
+
+    store = HistoryStore(args.root)
+    if args.command == "record":
+        recorder = HistoryRecorder(
+            store, load_power_station_configs(station_prefix=args.station_prefix)
+        )
+        recorder.start()
+        try:
+            while True:
+                sleep(args.flush_interval)
+                store.flush()
+        except KeyboardInterrupt:
+            recorder.stop()
+    else:
+        records = store.query(args.start, args.end, args.stations, tier=args.tier)
+        names = [name for name in records.dtype.names if name != "station"]
+        print(",".join(["station", *names]))
+        for record in records:
+            station_id = store.station_ids[record["station"]]
+            print(",".join([station_id, *(str(record[name]) for name in names)]))
+    store.close()
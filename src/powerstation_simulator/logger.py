@@ -1,6 +1,13 @@
+import atexit
 import logging
 import sys
+from json import dumps
 from logging import Logger, LogRecord
+from logging.handlers import QueueHandler, QueueListener
+from os import getenv
+from queue import Full, Queue
+from threading import Lock
+from time import monotonic
 
 COLORS = {
     "DEBUG": "\033[34m",  # BLUE
@@ -11,13 +18,19 @@ COLORS = {
     "RESET": "\033[0m",  # RESET
 }
 
+TEXT_FORMAT = "%(asctime)s %(filename)s: %(levelname)s, %(message)s"
+
+# Records waiting for the writer thread; further records are dropped
+LOG_QUEUE_SIZE: int = 10_000
+
 
 class ColoredFormatter(logging.Formatter):
     """
     A custom logging formatter that adds color to log level names in terminal output.
 
     This formatter wraps the log level name with ANSI color codes based on the
-    severity level. Colors are defined in the COLORS dictionary.
+    severity level. Colors are defined in the COLORS dictionary. The record is
+    copied first, so other handlers still see the plain level name.
 
     Methods:
         format: Overrides the base Formatter's format method to add colors.
@@ -34,36 +47,263 @@ class ColoredFormatter(logging.Formatter):
         Returns:
             str: The formatted log message with colored level name.
         """
+        record = logging.makeLogRecord(record.__dict__)
         color = COLORS.get(record.levelname, COLORS["RESET"])
         record.levelname = f"{color}{record.levelname}{COLORS['RESET']}"
-        return super().format(record)
+        message = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            message += f" ({suppressed} similar messages suppressed)"
+        return message
+
 
+class JsonFormatter(logging.Formatter):
+    """
+    Formats every record as one JSON object per line.
 
-def setup_base_logger(level: int | str = logging.DEBUG) -> Logger:
+    Objects hold the unix time `ts`, `level`, `logger`, `file`, `line` and
+    `message`, plus `exception` and `suppressed` when present.
+    """
+
+    def format(self, record: LogRecord) -> str:
+        """
+        Format the specified record as a JSON line.
+
+        Args:
+            record: The record to format
+
+        Returns:
+            str: The JSON object, without trailing newline
+        """
+        entry = dict(
+            ts=round(record.created, 6),
+            level=record.levelname,
+            logger=record.name,
+            file=record.filename,
+            line=record.lineno,
+            message=record.getMessage(),
+        )
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        return dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `rate` records per second from every call site.
+
+    Each call site (logger, file and line) has a token bucket holding up to
+    `burst` records. Records beyond it are dropped; the number dropped is
+    attached as `suppressed` to the next record of that call site that passes.
+
+    Attributes:
+        rate (float): Records per second per call site
+        burst (float): Records a call site may emit at once
+        suppressed (int): Total number of records dropped so far
+    """
+
+    def __init__(self, rate: float, burst: float | None = None):
+        """
+        Initialize the filter.
+
+        Args:
+            rate (float): Records per second per call site
+            burst (float, optional): Bucket size. Defaults to `rate`.
+        """
+        super().__init__()
+        self.rate: float = rate
+        self.burst: float = max(burst or rate, 1.0)
+        self.suppressed: int = 0
+        # call site -> [tokens, last refill, records dropped since the last pass]
+        self.__buckets: dict[tuple[str, str, int], list] = {}
+        self.__lock = Lock()
+
+    def filter(self, record: LogRecord) -> bool:
+        """
+        Decide whether a record passes.
+
+        Args:
+            record: The record to check
+
+        Returns:
+            bool: True if the record is within the rate of its call site
+        """
+        key = (record.name, record.pathname, record.lineno)
+        now = monotonic()
+        with self.__lock:
+            bucket = self.__buckets.get(key)
+            if bucket is None:
+                bucket = self.__buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1.0:
+                bucket[2] += 1
+                self.suppressed += 1
+                return False
+            bucket[0] -= 1.0
+            if bucket[2]:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to a bounded queue, dropping them when the queue is full.
+
+    Only the message is rendered on the logging thread; timestamps, colors,
+    JSON encoding and the write itself happen on the QueueListener thread.
+
+    Attributes:
+        dropped (int): Number of records dropped because the queue was full
+    """
+
+    def __init__(self, queue: Queue):
+        super().__init__(queue)
+        self.dropped: int = 0
+
+    def prepare(self, record: LogRecord) -> LogRecord:
+        """
+        Freeze the message of a record before it is queued.
+
+        The record stays in this process, so unlike QueueHandler.prepare() the
+        exception info is kept for the formatter of the writer thread.
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: LogRecord) -> None:
+        """
+        Queue a record without ever blocking.
+        """
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+
+# The active queue listener and filters, replaced by configure_logging()
+_listener: QueueListener | None = None
+_queue_handler: NonBlockingQueueHandler | None = None
+_rate_limit: RateLimitFilter | None = None
+
+
+def log_stats() -> dict[str, int]:
+    """
+    Return the number of records lost by the logging pipeline.
+
+    Returns:
+        dict[str, int]: `dropped` by a full queue and `suppressed` by rate limiting
+    """
+    return dict(
+        dropped=_queue_handler.dropped if _queue_handler else 0,
+        suppressed=_rate_limit.suppressed if _rate_limit else 0,
+    )
+
+
+def stop_logging() -> None:
+    """
+    Flush the queued records and stop the writer thread, if any.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
+
+
+def configure_logging(
+    level: int | str | None = None,
+    log_format: str | None = None,
+    queue: bool | None = None,
+    rate_limit: float | None = None,
+) -> Logger:
+    """
+    (Re)configure the root logger, replacing its handlers.
+
+    Arguments left as None are read from environment variables, which also
+    reach the worker processes of the supervisor:
+
+        LOG_LEVEL       Level name or number (default: INFO)
+        LOG_FORMAT      "text" for colored lines, "json" for JSON lines
+        LOG_QUEUE       "1" writes records from a background thread
+        LOG_RATE_LIMIT  Records per second per call site, 0 disables (default: 0)
+
+    Args:
+        level: Level name or number. Defaults to LOG_LEVEL, else INFO.
+        log_format: "text" or "json". Defaults to LOG_FORMAT, else "text".
+        queue: Write records from a background thread. Defaults to LOG_QUEUE.
+        rate_limit: Records per second per call site, 0 disables rate limiting.
+            Defaults to LOG_RATE_LIMIT, else 0 (every record is kept).
+
+    Returns:
+        Logger: The configured root logger instance.
+    """
+    global _listener, _queue_handler, _rate_limit
+
+    level = level if level is not None else getenv("LOG_LEVEL", "INFO")
+    level = int(level) if str(level).isdigit() else str(level).upper()
+    log_format = log_format or getenv("LOG_FORMAT", "text")
+    if log_format not in ("text", "json"):
+        raise ValueError(f"Unknown log format: {log_format}")
+    queue = queue if queue is not None else getenv("LOG_QUEUE", "0") == "1"
+    rate_limit = (
+        rate_limit if rate_limit is not None else float(getenv("LOG_RATE_LIMIT", 0))
+    )
+
+    root_logger = logging.getLogger()
+    stop_logging()
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+        handler.close()
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(
+        JsonFormatter() if log_format == "json" else ColoredFormatter(TEXT_FORMAT)
+    )
+
+    _rate_limit = RateLimitFilter(rate_limit) if rate_limit > 0 else None
+    _queue_handler = None
+    if queue:
+        _queue_handler = NonBlockingQueueHandler(Queue(LOG_QUEUE_SIZE))
+        _listener = QueueListener(_queue_handler.queue, handler)
+        _listener.start()
+        handler = _queue_handler
+    if _rate_limit is not None:
+        # Filtered before queueing, so a flood never reaches the queue
+        handler.addFilter(_rate_limit)
+
+    root_logger.setLevel(level)
+    root_logger.addHandler(handler)
+    root_logger.propagate = False
+    return root_logger
+
+
+def setup_base_logger(level: int | str | None = None) -> Logger:
     """
     Configure and return the root logger with colored output.
 
-    This function sets up the root logger with a StreamHandler that outputs
-    to stdout and formats messages using the ColoredFormatter. If the root
-    logger already has handlers configured, this function does nothing.
+    This function configures the root logger from the LOG_* environment
+    variables (see configure_logging). If the root logger already has handlers
+    configured, this function does nothing.
 
     Args:
         level:
             The logging level to set for the root logger.
-            Default is logging.DEBUG.
+            Defaults to LOG_LEVEL, else INFO.
 
     Returns:
         Logger: The configured root logger instance.
     """
     root_logger = logging.getLogger()
     if not root_logger.hasHandlers():
-        root_logger.setLevel(level)
-        handler = logging.StreamHandler(sys.stdout)
-        handler.setFormatter(
-            ColoredFormatter("%(asctime)s %(filename)s: %(levelname)s, %(message)s")
-        )
-        root_logger.addHandler(handler)
-        root_logger.propagate = False
+        configure_logging(level)
     return root_logger
 
 
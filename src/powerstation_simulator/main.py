@@ -1,9 +1,20 @@
 import argparse
+import asyncio
+from datetime import datetime
+from random import randrange
 from time import sleep
 
-from config import AppConfig, load_power_station_configs
+from config import AppConfig, generate_fleet_configs, load_power_station_configs
+from fleet import AsyncFleetSimulator, FleetSimulator, VirtualFleetSimulator
+from fleet_config import load_fleet_table
 from logger import getLogger
+from metrics import MetricsPublisher, MetricsServer
+from scenario import load_scenario
+from scheduler import Scheduler
 from station_simulator import StationSimulator
+from supervisor import Supervisor
+from trace_replay import TraceReplay
+from zone_simulator import ZoneSimulator
 
 logger = getLogger(__name__)
 
@@ -30,6 +41,22 @@ def main() -> None:
     Command-line arguments:
         -sp, --station-prefix: Prefix for power station-specific environment variables
                               (e.g., PS_001)
+        -fs, --fleet-size: Number of stations to host in this process (fleet mode)
+        -fc, --fleet-config: TOML or CSV file listing the stations of the fleet
+        -w, --workers: Number of scheduler worker threads used in fleet mode
+        -c, --connections: Number of broker connections shared by the fleet
+        --seed: RNG seed making the outputs of a fleet reproducible
+        --asyncio: Drive the stations from a single asyncio event loop
+        --virtual: Simulate the given number of seconds in virtual time and exit
+        --virtual-start: Simulated start time of a virtual run (ISO 8601)
+        --output: CSV file receiving the telemetry of a virtual run
+        --history: History store directory receiving the readings of a virtual run
+        --trace: Replay recorded outputs from a trace file instead of random ones
+        --trace-speed: Replay speed multiplier of the trace
+        --no-trace-loop: Hold the last sample instead of restarting the trace
+        --scenario: Run a scenario of timed events against the fleet
+        --zones: Also simulate the demand of this many consumption zones
+        --demand-ratio: Peak demand of the zones relative to the fleet capacity
 
     Returns:
         None
@@ -50,6 +77,39 @@ Examples:
 
   # Load config with prefix TEST (looks for variables like TEST_*)
   python main.py -sp TEST
+
+  # Run 5000 stations derived from PS_001 in one process on 8 worker threads
+  python main.py -sp PS_001 --fleet-size 5000 --workers 8 --connections 4
+
+  # Run the stations listed in a fleet config, with the env config as defaults
+  python main.py -sp PS_001 --fleet-config fleet.toml --workers 8
+
+  # Run the same fleet on one asyncio event loop, without worker threads
+  python main.py -sp PS_001 --fleet-size 5000 --asyncio
+
+  # Generate 30 days of telemetry for 100 stations into a CSV file, as fast as possible
+  python main.py -sp PS_001 --fleet-size 100 --virtual 2592000 \
+      --virtual-start 2025-01-01T00:00:00 --output telemetry.csv
+
+  # Build a year of history with 1-minute and 1-hour tiers, then query it
+  python main.py -sp PS_001 --fleet-size 100 --virtual 31536000 \
+      --virtual-start 2025-01-01T00:00:00 --history ./history
+  python history.py query ./history --start 2025-06-01 --end 2025-07-01 --tier 1h
+
+  # Shard 20000 stations over one worker process per CPU core
+  python main.py -sp PS_001 --fleet-size 20000 --supervisor
+
+  # Replay a recorded incident at 10x speed, once
+  python main.py -sp PS_001 --fleet-size 2000 --trace incident.trace \
+      --trace-speed 10 --no-trace-loop
+
+  # Trip, ramp and derate stations as scripted, a day in virtual time
+  python main.py -sp PS_001 --fleet-size 10000 --scenario storm.toml \
+      --virtual 86400 --output telemetry.csv
+
+  # Load-test the grid: 5000 stations and 20000 consumption zones peaking at
+  # 90% of the fleet capacity
+  python main.py -sp PS_001 --fleet-size 5000 --zones 20000 --demand-ratio 0.9
 """,
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
@@ -59,6 +119,110 @@ Examples:
         type=str,
         help="Prefix for power station-specific environment variables (e.g., PS_001)",
     )
+    parser.add_argument(
+        "-fs",
+        "--fleet-size",
+        type=int,
+        default=0,
+        help="Number of stations to host in this process, derived from the loaded config",
+    )
+    parser.add_argument(
+        "-fc",
+        "--fleet-config",
+        type=str,
+        help="TOML or CSV file listing the stations of the fleet (see fleet_config.py)",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of scheduler worker threads used in fleet mode (default: 4)",
+    )
+    parser.add_argument(
+        "-c",
+        "--connections",
+        type=int,
+        default=1,
+        help="Number of broker connections shared by the fleet (default: 1)",
+    )
+    parser.add_argument(
+        "--supervisor",
+        action="store_true",
+        help="Shard the fleet over worker processes and restart crashed workers",
+    )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        help="Number of worker processes in supervisor mode (default: one per core)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="RNG seed making the generated outputs of a fleet reproducible",
+    )
+    parser.add_argument(
+        "--asyncio",
+        action="store_true",
+        help="Drive the stations from a single asyncio event loop",
+    )
+    parser.add_argument(
+        "--virtual",
+        type=float,
+        metavar="SECONDS",
+        help="Simulate the given number of seconds in virtual time, as fast as possible",
+    )
+    parser.add_argument(
+        "--virtual-start",
+        type=datetime.fromisoformat,
+        help="Simulated start time of a virtual run, ISO 8601 (default: now)",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="CSV file receiving the telemetry of a virtual run (default: MQTT)",
+    )
+    parser.add_argument(
+        "--history",
+        type=str,
+        metavar="DIR",
+        help="History store receiving the readings of a virtual run (see history.py)",
+    )
+
+    parser.add_argument(
+        "--trace",
+        type=str,
+        help="Replay recorded outputs from a trace file (see trace_replay.py)",
+    )
+    parser.add_argument(
+        "--trace-speed",
+        type=float,
+        default=1.0,
+        help="Replay speed multiplier of the trace (default: 1.0)",
+    )
+    parser.add_argument(
+        "--no-trace-loop",
+        action="store_true",
+        help="Hold the last sample instead of restarting the trace",
+    )
+    parser.add_argument(
+        "--scenario",
+        type=str,
+        help="Run a scenario of timed events against the fleet (see scenario.py)",
+    )
+    parser.add_argument(
+        "--zones",
+        type=int,
+        default=0,
+        help="Also simulate the demand of this many consumption zones",
+    )
+    parser.add_argument(
+        "--demand-ratio",
+        type=float,
+        default=0.8,
+        help="Summed peak demand of the zones relative to the fleet capacity (default: 0.8)",
+    )
 
     args = parser.parse_args()
 
@@ -68,12 +232,152 @@ Examples:
         station_prefix=args.station_prefix
     )
 
-    simulator: StationSimulator = StationSimulator(app_config=app_config)
+    if args.fleet_config and args.fleet_size > 0:
+        parser.error("--fleet-config and --fleet-size are mutually exclusive")
+    # Scenarios drive the stateful output models of fleet batches
+    fleet_mode = (
+        args.fleet_size > 0 or args.fleet_config is not None or bool(args.scenario)
+    )
+
+    if args.fleet_config:
+        fleet_configs = load_fleet_table(args.fleet_config, app_config).app_configs()
+    elif args.fleet_size > 0:
+        fleet_configs = generate_fleet_configs(app_config, args.fleet_size)
+    else:
+        fleet_configs = [app_config]
+
+    trace_replay = (
+        TraceReplay(args.trace, speed=args.trace_speed, loop=not args.no_trace_loop)
+        if args.trace
+        else None
+    )
+
+    scenario = load_scenario(args.scenario) if args.scenario else None
+    if scenario and trace_replay:
+        parser.error("--scenario and --trace are mutually exclusive")
+    if scenario and args.supervisor:
+        parser.error("--scenario is not supported with --supervisor")
+
+    if args.zones and (args.virtual or args.supervisor or args.asyncio):
+        parser.error(
+            "--zones is not supported with --virtual, --supervisor or --asyncio"
+        )
+
+    if app_config.METRICS_PORT:
+        MetricsServer(port=app_config.METRICS_PORT).start()
+
+    if args.virtual:
+        VirtualFleetSimulator(
+            app_configs=fleet_configs,
+            start_time=args.virtual_start.timestamp() if args.virtual_start else None,
+            output_path=args.output,
+            history_path=args.history,
+            seed=args.seed,
+            trace_replay=trace_replay,
+            scenario=scenario,
+        ).run(duration=args.virtual)
+        return
+
+    if args.supervisor:
+        if not fleet_mode:
+            parser.error("--supervisor requires --fleet-size or --fleet-config")
+        supervisor = Supervisor(
+            app_configs=fleet_configs,
+            processes=args.processes,
+            workers=args.workers,
+            connections=args.connections,
+            seed=args.seed,
+            trace_replay=trace_replay,
+        )
+        try:
+            supervisor.run_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.asyncio:
+        fleet = AsyncFleetSimulator(
+            app_configs=fleet_configs,
+            connections=args.connections,
+            seed=args.seed,
+            trace_replay=trace_replay,
+            scenario=scenario,
+        )
+        try:
+            asyncio.run(fleet.run_forever())
+        except KeyboardInterrupt:
+            pass
+        return
+
+    simulator: StationSimulator | FleetSimulator = (
+        FleetSimulator(
+            app_configs=fleet_configs,
+            workers=args.workers,
+            connections=args.connections,
+            seed=args.seed,
+            trace_replay=trace_replay,
+            scenario=scenario,
+        )
+        if fleet_mode
+        else StationSimulator(
+            app_config=app_config,
+            output_source=trace_replay.source_for(
+                [app_config.POWER_STATION_ID], app_config.PUBLISH_INTERVAL_SECONDS
+            )
+            if trace_replay
+            else None,
+        )
+    )
     simulator.startup_sequence()
+
+    zones = None
+    if args.zones:
+        # Seeded like the fleet, so --seed reproduces the demand as well
+        zone_seed = (
+            simulator.seed
+            if isinstance(simulator, FleetSimulator)
+            else args.seed
+            if args.seed is not None
+            else randrange(2**32)
+        )
+        zones = ZoneSimulator(
+            app_config=app_config,
+            zones=args.zones,
+            demand_kw=args.demand_ratio
+            * sum(config.CAPACITY_KW for config in fleet_configs),
+            mqtt_client=simulator.pool.clients[0]
+            if isinstance(simulator, FleetSimulator)
+            else simulator.mqqt_client,
+            # Zones share the regions of the stations, for per-region balance
+            regions=sorted({config.REGION for config in fleet_configs} - {""}),
+            seed=zone_seed,
+        )
+        zones.startup_sequence(
+            simulator.scheduler if isinstance(simulator, FleetSimulator) else None
+        )
+
+    metrics_scheduler = None
+    if app_config.METRICS_PUBLISH_INTERVAL_SECONDS:
+        publisher = MetricsPublisher(
+            mqtt_client=simulator.pool.clients[0]
+            if isinstance(simulator, FleetSimulator)
+            else simulator.mqqt_client,
+            topic=f"{app_config.MQTT_TOPIC_PREFIX}/$SYS/{app_config.POWER_STATION_ID}",
+        )
+        metrics_scheduler = Scheduler(workers=1, name="metrics")
+        metrics_scheduler.schedule_periodic(
+            publisher.publish, app_config.METRICS_PUBLISH_INTERVAL_SECONDS
+        )
+        metrics_scheduler.start()
+
     try:
         while True:
             sleep(1)
     except KeyboardInterrupt:
+        if metrics_scheduler is not None:
+            metrics_scheduler.stop()
+        if zones is not None:
+            zones.shutdown_sequence()
         simulator.shutdown_sequence()
 
 
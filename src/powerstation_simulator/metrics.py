@@ -0,0 +1,547 @@
+import os
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread, get_ident
+from typing import Any, Callable, Iterable
+
+from logger import getLogger, log_stats
+
+logger = getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS: tuple[float, ...] = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+
+Labels = tuple[str, ...]
+Sample = tuple[dict[str, str], float]
+
+
+def process_cpu_seconds(pid: int | None = None) -> float | None:
+    """
+    Return the user + system CPU time consumed by a process.
+
+    Args:
+        pid (int, optional): Process id to inspect. Defaults to the current process.
+
+    Returns:
+        float | None: CPU seconds, or None if the process cannot be inspected
+    """
+    if pid is None:
+        times = os.times()
+        return times.user + times.system
+    try:
+        with open(f"/proc/{pid}/stat") as stat_file:
+            # The command name may contain spaces, the counters follow its ')'
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def process_rss_bytes(pid: int | None = None) -> int | None:
+    """
+    Return the resident set size of a process.
+
+    Args:
+        pid (int, optional): Process id to inspect. Defaults to the current process.
+
+    Returns:
+        int | None: Resident memory in bytes, or None if the process cannot be inspected
+    """
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+
+class ShardedCells:
+    """
+    Preallocated numeric cells with one private copy per writing thread.
+
+    Every thread only ever increments its own shard, so updates need no lock
+    and are never lost; readers sum the shards. A shard is allocated, under a
+    lock, the first time a thread writes, never on the hot path afterwards.
+    """
+
+    __slots__ = ("size", "shards", "lock")
+
+    def __init__(self, size: int):
+        self.size: int = size
+        self.shards: dict[int, list[float]] = {}
+        self.lock: Lock = Lock()
+
+    def shard(self) -> list[float]:
+        """
+        Return the cells of the calling thread.
+        """
+        cells = self.shards.get(get_ident())
+        if cells is None:
+            with self.lock:
+                cells = self.shards[get_ident()] = [0] * self.size
+        return cells
+
+    def totals(self) -> list[float]:
+        """
+        Return the cells summed over all threads.
+        """
+        with self.lock:
+            shards = list(self.shards.values())
+        return [sum(values) for values in zip(*shards)] if shards else [0] * self.size
+
+
+class CounterChild:
+    """
+    One labelled series of a Counter.
+    """
+
+    __slots__ = ("cells",)
+
+    def __init__(self):
+        self.cells: ShardedCells = ShardedCells(1)
+
+    def inc(self, amount: float = 1) -> None:
+        """
+        Increase the counter.
+
+        Args:
+            amount (float, optional): Non-negative increment. Defaults to 1.
+        """
+        self.cells.shard()[0] += amount
+
+    @property
+    def value(self) -> float:
+        """
+        Current value of the counter.
+        """
+        return self.cells.totals()[0]
+
+
+class HistogramChild:
+    """
+    One labelled series of a Histogram.
+    """
+
+    __slots__ = ("buckets", "cells")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets: tuple[float, ...] = buckets
+        # One cell per bucket, one for +Inf, then the sum of the observations
+        self.cells: ShardedCells = ShardedCells(len(buckets) + 2)
+
+    def observe(self, value: float) -> None:
+        """
+        Record one observation.
+
+        Args:
+            value (float): The observed value, e.g. a latency in seconds
+        """
+        cells = self.cells.shard()
+        cells[bisect_left(self.buckets, value)] += 1
+        cells[-1] += value
+
+    def snapshot(self) -> tuple[list[float], float, float]:
+        """
+        Return the cumulative bucket counts, the sum and the count.
+        """
+        totals = self.cells.totals()
+        cumulative = []
+        running = 0
+        for count in totals[:-1]:
+            running += count
+            cumulative.append(running)
+        return cumulative, totals[-1], running
+
+
+class Metric:
+    """
+    Base class of a named metric family with optional labels.
+
+    Children are created once per label combination, typically when a station
+    or client is constructed, and kept by the instrumented object, so the hot
+    path only touches its own preallocated cells.
+
+    Attributes:
+        name (str): Metric name, e.g. "powerstation_messages_published_total"
+        help (str): One-line description
+        labelnames (Labels): Names of the labels of every series
+    """
+
+    kind: str = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Labels = ()):
+        self.name: str = name
+        self.help: str = help
+        self.labelnames: Labels = labelnames
+        self.children: dict[Labels, Any] = {}
+        self.__lock: Lock = Lock()
+
+    def new_child(self) -> Any:
+        raise NotImplementedError
+
+    def labels(self, *values: str) -> Any:
+        """
+        Return the series of a label combination, creating it on first use.
+
+        Args:
+            *values (str): One value per label name
+
+        Returns:
+            The child series
+        """
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        child = self.children.get(values)
+        if child is None:
+            with self.__lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    def remove(self, *values: str) -> None:
+        """
+        Drop the series of a label combination, e.g. of a stopped station.
+        """
+        with self.__lock:
+            self.children.pop(values, None)
+
+    def label_dict(self, values: Labels) -> dict[str, str]:
+        return dict(zip(self.labelnames, values))
+
+
+class Counter(Metric):
+    """
+    A monotonically increasing count, e.g. of published messages.
+    """
+
+    kind = "counter"
+
+    def new_child(self) -> CounterChild:
+        return CounterChild()
+
+    def inc(self, amount: float = 1) -> None:
+        """
+        Increase the unlabelled series.
+        """
+        self.labels().inc(amount)
+
+    def samples(self) -> Iterable[tuple[str, dict[str, str], float]]:
+        for values, child in list(self.children.items()):
+            yield self.name, self.label_dict(values), child.value
+
+
+class Histogram(Metric):
+    """
+    Observations counted in fixed buckets, e.g. latencies.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Labels = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets: tuple[float, ...] = tuple(sorted(buckets))
+
+    def new_child(self) -> HistogramChild:
+        return HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        """
+        Record one observation in the unlabelled series.
+        """
+        self.labels().observe(value)
+
+    def samples(self) -> Iterable[tuple[str, dict[str, str], float]]:
+        bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+        for values, child in list(self.children.items()):
+            labels = self.label_dict(values)
+            cumulative, total, count = child.snapshot()
+            for bound, value in zip(bounds, cumulative):
+                yield f"{self.name}_bucket", {**labels, "le": bound}, value
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class SampledMetric:
+    """
+    A metric whose samples are read from a callback at collection time.
+
+    Suited to values the application already tracks, such as scheduler
+    statistics, queue depths or the thread count: recording them costs nothing
+    on the hot path.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        kind: str,
+        collect: Callable[[], Iterable[Sample]],
+    ):
+        self.name: str = name
+        self.help: str = help
+        self.kind: str = kind
+        self.collect: Callable[[], Iterable[Sample]] = collect
+
+    def samples(self) -> Iterable[tuple[str, dict[str, str], float]]:
+        for labels, value in self.collect():
+            yield self.name, labels, value
+
+
+class MetricsRegistry:
+    """
+    The metric families of a process, rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.metrics: dict[str, Metric | SampledMetric] = {}
+        self.__lock: Lock = Lock()
+
+    def register(self, metric: Metric | SampledMetric) -> Any:
+        """
+        Add a metric family; registering a name twice returns the first family.
+        """
+        with self.__lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labelnames: Labels = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Labels = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def sampled(
+        self,
+        name: str,
+        help: str,
+        collect: Callable[[], Iterable[Sample]],
+        kind: str = "gauge",
+    ) -> SampledMetric:
+        return self.register(SampledMetric(name, help, kind, collect))
+
+    def collect(self) -> Iterable[tuple[Metric | SampledMetric, str, dict, float]]:
+        """
+        Yield every sample of every family with the family it belongs to.
+        """
+        with self.__lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            try:
+                for name, labels, value in metric.samples():
+                    yield metric, name, labels, value
+            except Exception as error:
+                logger.warning(f"Failed to collect metric {metric.name}: {error}")
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition, one sample per line
+        """
+        lines = []
+        current = None
+        for metric, name, labels, value in self.collect():
+            if metric is not current:
+                current = metric
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+            if labels:
+                rendered = ",".join(
+                    f'{key}="{escape_label(str(label))}"'
+                    for key, label in labels.items()
+                )
+                lines.append(f"{name}{{{rendered}}} {format_value(value)}")
+            else:
+                lines.append(f"{name} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def unlabelled(self) -> dict[str, float]:
+        """
+        Return the samples without labels, e.g. for publishing on MQTT.
+
+        Returns:
+            dict[str, float]: Sample names mapped to their values
+        """
+        return {name: value for _, name, labels, value in self.collect() if not labels}
+
+
+def format_value(value: float) -> str:
+    """
+    Format a sample value, keeping integers exact.
+    """
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape_label(value: str) -> str:
+    """
+    Escape a label value for the Prometheus text format.
+    """
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# The registry shared by every module of the process
+REGISTRY: MetricsRegistry = MetricsRegistry()
+
+REGISTRY.sampled(
+    "process_threads",
+    "Number of live Python threads",
+    lambda: [({}, threading.active_count())],
+)
+REGISTRY.sampled(
+    "process_cpu_seconds_total",
+    "User and system CPU time of the process",
+    lambda: [({}, process_cpu_seconds())],
+    kind="counter",
+)
+REGISTRY.sampled(
+    "process_resident_memory_bytes",
+    "Resident memory of the process",
+    lambda: [({}, process_rss_bytes() or 0)],
+)
+REGISTRY.sampled(
+    "log_records_dropped_total",
+    "Log records dropped because the log queue was full",
+    lambda: [({}, log_stats()["dropped"])],
+    kind="counter",
+)
+REGISTRY.sampled(
+    "log_records_suppressed_total",
+    "Log records suppressed by the per call site rate limit",
+    lambda: [({}, log_stats()["suppressed"])],
+    kind="counter",
+)
+
+
+class MetricsServer:
+    """
+    Serves a registry over HTTP at /metrics for Prometheus to scrape.
+
+    Attributes:
+        port (int): Listening port; the chosen port once started with port 0
+    """
+
+    def __init__(
+        self,
+        registry: MetricsRegistry = REGISTRY,
+        host: str = "0.0.0.0",
+        port: int = 9100,
+    ):
+        """
+        Initialize the server.
+
+        Args:
+            registry (MetricsRegistry, optional): The metrics to serve.
+                Defaults to REGISTRY.
+            host (str, optional): Interface to listen on. Defaults to "0.0.0.0".
+            port (int, optional): Port to listen on, 0 picks a free one.
+                Defaults to 9100.
+        """
+        self.registry: MetricsRegistry = registry
+        self.host: str = host
+        self.port: int = port
+        self.__server: ThreadingHTTPServer | None = None
+        self.__thread: Thread | None = None
+
+    def start(self) -> None:
+        """
+        Start serving on a background thread.
+        """
+        registry = self.registry
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logger.debug(f"Metrics request: {format % args}")
+
+        self.__server = ThreadingHTTPServer((self.host, self.port), MetricsHandler)
+        self.__server.daemon_threads = True
+        self.port = self.__server.server_address[1]
+        self.__thread = Thread(
+            target=self.__server.serve_forever, name="metrics-http", daemon=True
+        )
+        self.__thread.start()
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    def stop(self) -> None:
+        """
+        Stop serving.
+        """
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+
+
+class MetricsPublisher:
+    """
+    Publishes the unlabelled process metrics to a `$SYS`-style topic tree.
+
+    Every sample goes to its own subtopic, e.g.
+    `smartgrid/powerstation/$SYS/PS_001/process_threads`, like the broker
+    statistics mosquitto publishes below `$SYS/broker/`. Per-station series are
+    left to the HTTP endpoint to keep the message count independent of the
+    fleet size.
+    """
+
+    def __init__(
+        self, mqtt_client: Any, topic: str, registry: MetricsRegistry = REGISTRY
+    ):
+        """
+        Initialize the publisher.
+
+        Args:
+            mqtt_client (MQTTClient): Client used for publishing
+            topic (str): Base topic of the metrics
+            registry (MetricsRegistry, optional): The metrics to publish.
+                Defaults to REGISTRY.
+        """
+        self.mqqt_client = mqtt_client
+        self.topic: str = topic
+        self.registry: MetricsRegistry = registry
+
+    def publish(self) -> None:
+        """
+        Publish the current value of every unlabelled sample with QoS 0.
+
+        Only the latest value of a sample is kept while the broker cannot keep up.
+        """
+        for name, value in self.registry.unlabelled().items():
+            self.mqqt_client.publish(
+                f"{self.topic}/{name}", value, qos=0, policy="coalesce_latest"
+            )
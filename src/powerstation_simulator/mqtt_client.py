@@ -1,14 +1,105 @@
 from json import dumps
 from random import choices
 from string import ascii_letters, digits
-from typing import Any
+from threading import Condition, Event, Lock, Thread, get_ident
+from time import monotonic, sleep
+from typing import Any, Callable, Literal
+from weakref import WeakSet
 
 from config import AppConfig
 from logger import getLogger
+from metrics import REGISTRY
+from offline_buffer import BufferedMessage, OfflineBuffer
 from paho.mqtt import client as mqtt_client
 
 logger = getLogger(__name__)
 
+# Topics re-subscribed per SUBSCRIBE packet after a reconnect
+RESUBSCRIBE_CHUNK_SIZE: int = 500
+
+# Coalesced messages are released once the queue drains below this share of its limit
+BACKPRESSURE_RESUME_RATIO: float = 0.75
+
+# Longest wait of a blocking publish for room in the queue; it is queued anyway after
+BACKPRESSURE_BLOCK_TIMEOUT_SECONDS: float = 10.0
+
+# What publish() does with a message while the queue is over its limit
+BackpressurePolicy = Literal["block", "coalesce_latest"]
+
+PUBLISHED = REGISTRY.counter(
+    "mqtt_messages_published_total", "Messages handed to the network loop"
+).labels()
+PUBLISH_FAILURES = REGISTRY.counter(
+    "mqtt_publish_failures_total",
+    "Messages that could not be sent, including those kept in the offline buffer",
+).labels()
+PUBLISH_ACK_LATENCY = REGISTRY.histogram(
+    "mqtt_publish_ack_seconds", "Time from publishing a QoS 1/2 message to its ack"
+).labels()
+COALESCED = REGISTRY.counter(
+    "mqtt_messages_coalesced_total",
+    "Messages held back by backpressure, including those replaced by a newer value",
+).labels()
+PUBLISH_BLOCKED = REGISTRY.histogram(
+    "mqtt_publish_blocked_seconds",
+    "Time a blocking publish waited for room in the outgoing queue",
+).labels()
+
+# Every live client, read when the metrics are collected
+CLIENTS: WeakSet = WeakSet()
+REGISTRY.sampled(
+    "mqtt_inflight_messages",
+    "QoS 1/2 messages waiting for their ack",
+    lambda: [
+        (dict(client=client.client_id), len(client.inflight))
+        for client in list(CLIENTS)
+    ],
+)
+REGISTRY.sampled(
+    "mqtt_queued_messages",
+    "Messages handed to the network loop and not yet sent or acknowledged",
+    lambda: [
+        (dict(client=client.client_id), client.pending) for client in list(CLIENTS)
+    ],
+)
+REGISTRY.sampled(
+    "mqtt_coalesced_messages",
+    "Latest values waiting for room in the outgoing queue",
+    lambda: [
+        (dict(client=client.client_id), len(client.coalesced))
+        for client in list(CLIENTS)
+    ],
+)
+REGISTRY.sampled(
+    "mqtt_offline_buffer_messages",
+    "Messages waiting in the offline buffer",
+    lambda: [
+        (dict(client=client.client_id), len(client.offline_buffer))
+        for client in list(CLIENTS)
+        if client.offline_buffer is not None
+    ],
+)
+
+
+def encode_payload(payload: Any) -> bytes | str:
+    """
+    Encode a payload the way it is sent on the wire.
+
+    Args:
+        payload (Any): Dictionaries are JSON-encoded, numbers are sent as text,
+            None as an empty payload, and str/bytes are passed through
+
+    Returns:
+        bytes | str: The encoded payload
+    """
+    if isinstance(payload, dict):
+        return dumps(payload)
+    if isinstance(payload, (int, float)):
+        return str(payload)
+    if payload is None:
+        return b""
+    return payload
+
 
 class MQTTClient:
     """
@@ -16,6 +107,23 @@ class MQTTClient:
 
     This class provides methods to connect to an MQTT broker, publish messages,
     subscribe to topics, and handle connection events.
+
+    Lost connections are re-established by paho's network loop with exponential
+    backoff, and subscriptions are restored on every reconnect. With an
+    OfflineBuffer, messages published while disconnected are kept and replayed,
+    rate-limited, once the broker is reachable again.
+
+    With a `will_topic`, the broker publishes a retained "offline" to that topic
+    when the connection is lost without a clean disconnect. Callables added to
+    `on_connected` run after every successful (re)connect, e.g. to publish the
+    retained state the will may have overwritten.
+
+    Messages not yet sent (QoS 0) or acknowledged (QoS 1/2) are counted. Once
+    `max_queued` of them are pending, publish() applies the policy of the message:
+    "coalesce_latest" holds the message back, keeping only the latest value per
+    topic until the queue drains, and "block" waits for room in the queue. The
+    network thread can never wait for itself, so its blocking publishes are
+    queued right away, over the limit.
     """
 
     def __init__(
@@ -26,6 +134,13 @@ class MQTTClient:
         username: str,
         password: str,
         enable_websocket: bool,
+        unique_suffix: bool = True,
+        offline_buffer: OfflineBuffer | None = None,
+        replay_rate: float = 500.0,
+        reconnect_min_delay: int = 1,
+        reconnect_max_delay: int = 60,
+        will_topic: str | None = None,
+        max_queued: int = 10_000,
     ):
         """
         Initialize an MQTT client.
@@ -37,34 +152,120 @@ class MQTTClient:
             username (str): Authentication username
             password (str): Authentication password
             enable_websocket (bool): Use websockets instead of TCP if True
+            unique_suffix (bool, optional): Append a random suffix to the client id
+                so restarted processes never collide. Defaults to True.
+            offline_buffer (OfflineBuffer, optional): Buffer for messages published
+                while disconnected. If None, such messages are dropped.
+            replay_rate (float, optional): Maximum buffered messages replayed per
+                second after a reconnect. Defaults to 500.0.
+            reconnect_min_delay (int, optional): First reconnect backoff in seconds.
+                Defaults to 1.
+            reconnect_max_delay (int, optional): Upper bound of the reconnect backoff
+                in seconds. Defaults to 60.
+            will_topic (str, optional): Topic receiving a retained "offline" Last
+                Will. Defaults to no will.
+            max_queued (int, optional): Pending messages before backpressure
+                applies. Defaults to 10_000.
         """
         self.host: str = host
         self.port: int = port
         self.connected: bool = False
+        self.offline_buffer: OfflineBuffer | None = offline_buffer
+        self.replay_rate: float = replay_rate
+        self.reconnect_min_delay: int = reconnect_min_delay
+        self.reconnect_max_delay: int = reconnect_max_delay
+        self.replaying: bool = False
+        self.subscriptions: dict[str, int] = {}
+        self.will_topic: str | None = will_topic
+        self.on_connected: list[Callable[[], None]] = []
+        # Message id -> monotonic publish time of every message awaiting its ack
+        self.inflight: dict[int, float] = {}
+        # The same for QoS 0 messages not yet written to the socket
+        self.unsent: dict[int, float] = {}
+        self.max_queued: int = max_queued
+        # Topic -> latest message held back by backpressure
+        self.coalesced: dict[str, BufferedMessage] = {}
+        self.__coalesced_lock: Lock = Lock()
+        self.__capacity: Condition = Condition()
+        self.__blocked: int = 0
+        self.__network_thread: int | None = None
+        self.__replay_thread: Thread | None = None
+        self.__connected_event: Event = Event()
+
+        if unique_suffix:
+            client_id = f"{client_id}_{''.join(choices(ascii_letters + digits, k=6))}"
+        self.client_id: str = client_id
 
         self.client: mqtt_client.Client = mqtt_client.Client(
-            client_id=f"{client_id}_".join(choices(ascii_letters + digits, k=6)),
+            client_id=client_id,
             transport="websockets" if enable_websocket else "tcp",
         )
         if username and password:
             self.client.username_pw_set(username, password)
+        self.client.reconnect_delay_set(reconnect_min_delay, reconnect_max_delay)
+        if will_topic:
+            self.client.will_set(will_topic, "offline", qos=1, retain=True)
 
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
+        self.client.on_publish = self.on_publish
+        CLIENTS.add(self)
 
     def connect(self):
         """
         Connect to the MQTT broker and start the network loop.
+
+        The connection is established by the network loop, which keeps retrying
+        with exponential backoff while the broker is unreachable.
         """
-        self.client.connect(self.host, self.port)
+        self.client.connect_async(self.host, self.port)
         self.client.loop_start()
 
     def disconnect(self):
         """
         Disconnect from the MQTT broker and stop the network loop.
         """
-        self.client.loop_stop()
         self.client.disconnect()
+        self.client.loop_stop()
+
+    def wait_until_connected(self, timeout: float | None = None) -> bool:
+        """
+        Block until the broker has accepted the connection (CONNACK received).
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Defaults to no limit.
+
+        Returns:
+            bool: True if connected, False if the timeout expired
+        """
+        return self.__connected_event.wait(timeout)
+
+    def wait_until_published(self, timeout: float | None = None) -> bool:
+        """
+        Block until every message has been sent (QoS 0) or acknowledged (QoS 1/2).
+
+        Messages held back by backpressure or kept in the offline buffer count as
+        unpublished. Call it before disconnect(), which discards paho's queue.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Defaults to no limit.
+
+        Returns:
+            bool: True if everything was published, False if the timeout expired
+        """
+        deadline = monotonic() + timeout if timeout is not None else None
+        while self.pending or self.coalesced or self.replaying or self.offline_buffer:
+            remaining = deadline - monotonic() if deadline is not None else 1.0
+            if remaining <= 0:
+                return False
+            # Acks notify the waiters of the queue; the replay does not, so poll too
+            with self.__capacity:
+                self.__blocked += 1
+                try:
+                    self.__capacity.wait(min(remaining, 0.1))
+                finally:
+                    self.__blocked -= 1
+        return True
 
     def on_connect(
         self, client: mqtt_client.Client, userdata: Any, flags: dict, rc: int
@@ -78,11 +279,27 @@ class MQTTClient:
             flags: Response flags sent by the broker
             rc (int): Connection result code
         """
-        if rc == 0:
-            self.connected = True
-            logger.info(f"Connected to MQTT broker at {self.host}:{self.port}")
-        else:
+        if rc != 0:
             logger.error(f"Failed to connect, return code {rc}")
+            return
+
+        self.__network_thread = get_ident()
+        # Keep new messages behind the backlog until it has been replayed
+        self.replaying = bool(self.offline_buffer)
+        self.connected = True
+        self.__connected_event.set()
+        logger.info(f"Connected to MQTT broker at {self.host}:{self.port}")
+
+        topics = list(self.subscriptions.items())
+        for start in range(0, len(topics), RESUBSCRIBE_CHUNK_SIZE):
+            self.client.subscribe(topics[start : start + RESUBSCRIBE_CHUNK_SIZE])
+
+        if self.replaying:
+            logger.info(f"Replaying {len(self.offline_buffer)} buffered messages...")
+            self.replay_offline_buffer()
+
+        for callback in self.on_connected:
+            callback()
 
     def on_disconnect(self, client: mqtt_client.Client, userdata: Any, rc: int) -> None:
         """
@@ -94,9 +311,105 @@ class MQTTClient:
             rc (int): Disconnection result code
         """
         self.connected = False
+        self.__connected_event.clear()
+        # paho drops its unsent QoS 0 packets, but resends every QoS 1/2 message
+        # after reconnecting, so their acks are still to come
+        self.unsent.clear()
+        self.__notify_capacity()
         logger.info("Disconnected from MQTT broker")
 
-    def publish(self, topic: str, payload: Any, qos: int = 1) -> bool:
+    def on_publish(self, client: mqtt_client.Client, userdata: Any, mid: int) -> None:
+        """
+        Callback for when a message has been sent (QoS 0) or acknowledged (QoS 1/2).
+
+        Args:
+            client: The client instance
+            userdata: User data of any type
+            mid (int): Message id of the message
+        """
+        sent = self.inflight.pop(mid, None)
+        if sent is not None:
+            PUBLISH_ACK_LATENCY.observe(monotonic() - sent)
+        else:
+            self.unsent.pop(mid, None)
+        if self.__blocked:
+            self.__notify_capacity()
+        if self.coalesced:
+            self.release_coalesced()
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of messages handed to the network loop and not yet sent or acknowledged.
+        """
+        return len(self.inflight) + len(self.unsent)
+
+    def release_coalesced(self) -> None:
+        """
+        Publish held back messages, oldest topic first, while the queue has room.
+        """
+        if self.pending > self.max_queued * BACKPRESSURE_RESUME_RATIO:
+            return
+        while self.pending < self.max_queued and self.connected:
+            with self.__coalesced_lock:
+                if not self.coalesced:
+                    return
+                message = self.coalesced.pop(next(iter(self.coalesced)))
+            sent = monotonic()
+            self.track(self.client.publish(*message), message.qos, sent)
+
+    def __notify_capacity(self) -> None:
+        with self.__capacity:
+            self.__capacity.notify_all()
+
+    def __wait_for_capacity(self) -> None:
+        """
+        Block until the queue has room, the client disconnects or the wait times out.
+        """
+        if get_ident() == self.__network_thread:
+            return
+        started = monotonic()
+        with self.__capacity:
+            self.__blocked += 1
+            try:
+                self.__capacity.wait_for(
+                    lambda: self.pending < self.max_queued or not self.connected,
+                    BACKPRESSURE_BLOCK_TIMEOUT_SECONDS,
+                )
+            finally:
+                self.__blocked -= 1
+        PUBLISH_BLOCKED.observe(monotonic() - started)
+
+    def track(self, result: mqtt_client.MQTTMessageInfo, qos: int, sent: float) -> None:
+        """
+        Record a message handed to the network loop, or kept by paho for after a
+        reconnect, for the publish metrics and the backpressure bound.
+
+        Args:
+            result (MQTTMessageInfo): Result of paho's publish()
+            qos (int): QoS level of the message
+            sent (float): Monotonic time at which publishing started
+        """
+        if result.rc:
+            PUBLISH_FAILURES.inc()
+            if not kept_by_paho(result, qos):
+                return
+        else:
+            PUBLISHED.inc()
+        pending = self.inflight if qos else self.unsent
+        pending[result.mid] = sent
+        # The network thread may have sent or acknowledged it in the meantime
+        if result.is_published():
+            pending.pop(result.mid, None)
+
+    def publish(
+        self,
+        topic: str,
+        payload: Any,
+        qos: int = 1,
+        retain: bool = False,
+        policy: BackpressurePolicy = "block",
+    ) -> bool:
         """
         Publish a message to a topic.
 
@@ -104,26 +417,101 @@ class MQTTClient:
             topic (str): The topic to publish to
             payload (Any): The message to publish (dictionaries will be JSON-encoded)
             qos (int, optional): Quality of Service level. Defaults to 1.
+            retain (bool, optional): Ask the broker to retain the message for late
+                subscribers. Defaults to False.
+            policy (BackpressurePolicy, optional): What to do while the outgoing
+                queue is full: "block" until there is room, or "coalesce_latest"
+                for readings where only the latest value matters. Defaults to
+                "block".
 
         Returns:
             bool: True if the message was published successfully, False otherwise
+                (including when it was kept for after a reconnect or held back)
         """
-        if not self.connected:
-            logger.warning("MQTT client not connected. Cannot publish.")
+        payload = encode_payload(payload)
+        if not self.connected or self.replaying:
+            PUBLISH_FAILURES.inc()
+            if self.offline_buffer is None:
+                logger.warning("MQTT client not connected. Cannot publish.")
+                return False
+            self.offline_buffer.put(BufferedMessage(topic, payload, qos, retain))
             return False
 
+        if self.coalesced:
+            self.release_coalesced()
+        if policy == "coalesce_latest":
+            # An older held back value of the topic must not overtake this one
+            if self.pending >= self.max_queued or topic in self.coalesced:
+                with self.__coalesced_lock:
+                    self.coalesced[topic] = BufferedMessage(topic, payload, qos, retain)
+                COALESCED.inc()
+                return False
+        elif self.pending >= self.max_queued:
+            self.__wait_for_capacity()
+
+        sent = monotonic()
         result = self.client.publish(
-            topic=topic,
-            payload=dumps(payload) if isinstance(payload, dict) else payload,
-            qos=qos,
+            topic=topic, payload=payload, qos=qos, retain=retain
         )
+        self.track(result, qos, sent)
 
         if not result.rc:
-            logger.debug(f"Published to topic {topic}: {payload}")
+            # Lazy arguments, the payload is only rendered when DEBUG is enabled
+            logger.debug("Published to topic %s: %s", topic, payload)
             return True
+        if kept_by_paho(result, qos):
+            logger.warning(f"Not connected, {topic} is sent after reconnecting")
+            return False
+        if self.offline_buffer is not None:
+            self.offline_buffer.put(BufferedMessage(topic, payload, qos, retain))
         logger.error(f"Failed to publish to topic {topic}")
         return False
 
+    def replay_offline_buffer(self):
+        """
+        Start replaying the offline buffer on a background thread.
+        """
+        if self.__replay_thread is None or not self.__replay_thread.is_alive():
+            self.__replay_thread = Thread(
+                target=self.__replay_loop, name=f"{self.client_id}-replay", daemon=True
+            )
+            self.__replay_thread.start()
+
+    def __replay_loop(self):
+        """
+        Publish buffered messages at `replay_rate`, backing off while publishing fails.
+
+        New messages are buffered behind the backlog until it is empty, which
+        keeps the original publish order.
+        """
+        delay = 1 / self.replay_rate
+        backoff = delay
+        while self.connected:
+            message = self.offline_buffer.pop()
+            if message is None:
+                self.replaying = False
+                # A message may have been buffered just before the flag was cleared
+                if not self.offline_buffer:
+                    logger.info(
+                        f"Offline buffer replay COMPLETED: {self.offline_buffer.stats()}"
+                    )
+                    return
+                self.replaying = True
+                continue
+
+            sent = monotonic()
+            result = self.client.publish(*message)
+            self.track(result, message.qos, sent)
+            if result.rc:
+                if not kept_by_paho(result, message.qos):
+                    self.offline_buffer.requeue(message)
+                backoff = min(backoff * 2, self.reconnect_max_delay)
+                sleep(backoff)
+                continue
+
+            backoff = delay
+            sleep(delay)
+
     def subscribe(
         self, topic: str, qos: int = 1, on_message: Any | None = None
     ) -> None:
@@ -133,18 +521,77 @@ class MQTTClient:
         Args:
             topic (str): The topic to subscribe to
             qos (int, optional): Quality of Service level. Defaults to 1.
-            on_message (callable, optional): Callback for when a message is received.
-                If None, a default handler will be used.
+            on_message (callable, optional): Callback for messages on this topic,
+                which may contain wildcards. If None, the messages are logged.
         """
 
         def __on_message(client, userdata, msg):
             logger.info(f"Received message on {msg.topic}: {msg.payload.decode()}")
 
+        # Remembered so the subscription is restored after a reconnect
+        self.subscriptions[topic] = qos
+        # Route per topic so one connection can serve many subscribers; the
+        # client-wide on_message is never replaced, as that would silence them
+        self.client.message_callback_add(topic, on_message or __on_message)
         self.client.subscribe(topic, qos=qos)
-        self.client.on_message = on_message or __on_message
+
+    def unsubscribe(self, topic: str) -> None:
+        """
+        Unsubscribe from a topic and remove its message callback.
+
+        Args:
+            topic (str): The topic to unsubscribe from
+        """
+        self.subscriptions.pop(topic, None)
+        self.client.message_callback_remove(topic)
+        self.client.unsubscribe(topic)
+
+
+def kept_by_paho(result: mqtt_client.MQTTMessageInfo, qos: int) -> bool:
+    """
+    Tell whether paho kept a message it could not send.
+
+    paho queues QoS 1/2 messages published without a connection and sends them
+    after the next reconnect, unless its own queue is full. QoS 0 messages are
+    dropped, so only those must go to the offline buffer.
+
+    Args:
+        result (MQTTMessageInfo): Result of paho's publish(), with rc != 0
+        qos (int): QoS level of the message
+
+    Returns:
+        bool: True if paho will send the message after reconnecting
+    """
+    return qos > 0 and result.rc != mqtt_client.MQTT_ERR_QUEUE_SIZE
+
+
+def get_resilience_options(app_config: AppConfig) -> dict:
+    """
+    Build the offline-buffering and reconnect options of a client from the settings.
+
+    Args:
+        app_config (AppConfig): Application configuration
+
+    Returns:
+        dict: Keyword arguments accepted by MQTTClient and its subclasses
+    """
+    return dict(
+        offline_buffer=OfflineBuffer(
+            max_bytes=app_config.OFFLINE_BUFFER_MAX_BYTES,
+            max_messages=app_config.OFFLINE_BUFFER_MAX_MESSAGES,
+            policy=app_config.OFFLINE_BUFFER_POLICY,
+        )
+        if app_config.ENABLE_OFFLINE_BUFFER
+        else None,
+        replay_rate=app_config.OFFLINE_REPLAY_RATE,
+        reconnect_min_delay=app_config.MQTT_RECONNECT_MIN_DELAY_SECONDS,
+        reconnect_max_delay=app_config.MQTT_RECONNECT_MAX_DELAY_SECONDS,
+    )
 
 
-def get_mqtt_client(app_config: AppConfig) -> MQTTClient:
+def get_mqtt_client(
+    app_config: AppConfig, unique_suffix: bool = True, will_topic: str | None = None
+) -> MQTTClient:
     """
     Create and return an MQTT client using configuration from the application settings.
 
@@ -153,6 +600,10 @@ def get_mqtt_client(app_config: AppConfig) -> MQTTClient:
 
     Args:
         app_config (AppConfig): Application configuration containing MQTT connection settings
+        unique_suffix (bool, optional): Append a random suffix to the client id.
+            Defaults to True.
+        will_topic (str, optional): Topic receiving a retained "offline" Last Will.
+            Defaults to no will.
 
     Returns:
         MQTTClient: A configured MQTT client instance ready for connection
@@ -164,4 +615,8 @@ def get_mqtt_client(app_config: AppConfig) -> MQTTClient:
         username=app_config.MQTT_USERNAME,
         password=app_config.MQTT_PASSWORD,
         enable_websocket=app_config.ENABLE_WEBSOCKET,
+        unique_suffix=unique_suffix,
+        will_topic=will_topic,
+        max_queued=app_config.MQTT_MAX_QUEUED_MESSAGES,
+        **get_resilience_options(app_config),
     )
@@ -0,0 +1,172 @@
+from collections import OrderedDict, deque
+from threading import Lock
+from typing import Literal, NamedTuple
+
+from logger import getLogger
+
+logger = getLogger(__name__)
+
+BufferPolicy = Literal["drop_oldest", "coalesce_latest"]
+
+
+class BufferedMessage(NamedTuple):
+    """
+    A message waiting to be published once the broker is reachable again.
+    """
+
+    topic: str
+    payload: bytes | str
+    qos: int
+    retain: bool
+
+    @property
+    def size(self) -> int:
+        """
+        Approximate memory footprint of the message in bytes.
+        """
+        return len(self.topic) + len(self.payload)
+
+
+class OfflineBuffer:
+    """
+    A bounded, memory-capped buffer of messages that could not be published.
+
+    Two policies are supported when the buffer is full or a topic repeats:
+
+    - "drop_oldest": keep every message in order and evict the oldest ones
+      once the byte or message cap is exceeded.
+    - "coalesce_latest": keep only the latest message per topic, so a long
+      outage costs at most one message per topic; the oldest topics are
+      evicted if the caps are still exceeded.
+
+    Attributes:
+        policy (BufferPolicy): The buffering policy
+        max_bytes (int): Upper bound of the buffered topic + payload bytes
+        max_messages (int): Upper bound of the number of buffered messages
+        buffered (int): Messages accepted into the buffer
+        replayed (int): Messages taken out of the buffer for publishing
+        dropped (int): Messages evicted because a cap was exceeded
+        coalesced (int): Messages replaced by a newer one on the same topic
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 8 * 1024 * 1024,
+        max_messages: int = 100_000,
+        policy: BufferPolicy = "drop_oldest",
+    ):
+        """
+        Initialize the buffer.
+
+        Args:
+            max_bytes (int, optional): Upper bound of the buffered bytes. Defaults to 8 MiB.
+            max_messages (int, optional): Upper bound of the buffered messages.
+                Defaults to 100_000.
+            policy (BufferPolicy, optional): "drop_oldest" or "coalesce_latest".
+                Defaults to "drop_oldest".
+        """
+        if policy not in ("drop_oldest", "coalesce_latest"):
+            raise ValueError(f"Unknown offline buffer policy: {policy}")
+
+        self.policy: BufferPolicy = policy
+        self.max_bytes: int = max_bytes
+        self.max_messages: int = max_messages
+        self.size_bytes: int = 0
+
+        self.buffered: int = 0
+        self.replayed: int = 0
+        self.dropped: int = 0
+        self.coalesced: int = 0
+
+        self.__lock: Lock = Lock()
+        self.__queue: deque[BufferedMessage] = deque()
+        self.__latest: OrderedDict[str, BufferedMessage] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.__queue) + len(self.__latest)
+
+    def put(self, message: BufferedMessage) -> None:
+        """
+        Add a message, evicting or coalescing older ones as the policy requires.
+
+        Args:
+            message (BufferedMessage): The message to buffer
+        """
+        with self.__lock:
+            self.buffered += 1
+            self.size_bytes += message.size
+
+            if self.policy == "coalesce_latest":
+                previous = self.__latest.pop(message.topic, None)
+                if previous is not None:
+                    self.coalesced += 1
+                    self.size_bytes -= previous.size
+                self.__latest[message.topic] = message
+            else:
+                self.__queue.append(message)
+
+            while len(self) > 1 and (
+                self.size_bytes > self.max_bytes or len(self) > self.max_messages
+            ):
+                evicted = (
+                    self.__latest.popitem(last=False)[1]
+                    if self.__latest
+                    else self.__queue.popleft()
+                )
+                self.size_bytes -= evicted.size
+                self.dropped += 1
+
+    def pop(self) -> BufferedMessage | None:
+        """
+        Take the oldest message out of the buffer.
+
+        Returns:
+            BufferedMessage | None: The message, or None if the buffer is empty
+        """
+        with self.__lock:
+            if self.__latest:
+                message = self.__latest.popitem(last=False)[1]
+            elif self.__queue:
+                message = self.__queue.popleft()
+            else:
+                return None
+            self.size_bytes -= message.size
+            self.replayed += 1
+            return message
+
+    def requeue(self, message: BufferedMessage) -> None:
+        """
+        Put a message that failed to replay back at the front of the buffer.
+
+        Args:
+            message (BufferedMessage): The message returned by pop()
+        """
+        with self.__lock:
+            self.replayed -= 1
+            self.size_bytes += message.size
+            if self.policy == "coalesce_latest":
+                if message.topic in self.__latest:
+                    # A newer value arrived meanwhile, the replayed one is stale
+                    self.size_bytes -= message.size
+                    self.coalesced += 1
+                    return
+                self.__latest[message.topic] = message
+                self.__latest.move_to_end(message.topic, last=False)
+            else:
+                self.__queue.appendleft(message)
+
+    def stats(self) -> dict:
+        """
+        Return the buffer counters as a plain dictionary.
+
+        Returns:
+            dict: Counter names mapped to their current values
+        """
+        return dict(
+            pending=len(self),
+            pending_bytes=self.size_bytes,
+            buffered=self.buffered,
+            replayed=self.replayed,
+            dropped=self.dropped,
+            coalesced=self.coalesced,
+        )
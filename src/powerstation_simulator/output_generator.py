@@ -0,0 +1,240 @@
+from zlib import crc32
+
+import numpy as np
+
+from logger import getLogger
+
+logger = getLogger(__name__)
+
+# splitmix64 constants, see Steele et al., "Fast splittable pseudorandom number generators"
+GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+MIX_MULTIPLIER_1 = np.uint64(0xBF58476D1CE4E5B9)
+MIX_MULTIPLIER_2 = np.uint64(0x94D049BB133111EB)
+
+
+def station_seeds(station_ids: list[str], seed: int = 0) -> np.ndarray:
+    """
+    Derive one RNG seed per station from its id and a fleet-wide seed.
+
+    The seed of a station only depends on its own id, so its output stream stays
+    the same when stations are added to or removed from the fleet.
+
+    Args:
+        station_ids (list[str]): The POWER_STATION_ID of every station
+        seed (int, optional): Fleet-wide seed. Defaults to 0.
+
+    Returns:
+        np.ndarray: uint64 seeds, one per station
+    """
+    seeds = np.fromiter(
+        (crc32(station_id.encode()) for station_id in station_ids),
+        dtype=np.uint64,
+        count=len(station_ids),
+    )
+    return seeds ^ (np.uint64(seed & 0xFFFFFFFF) << np.uint64(32))
+
+
+class FleetOutputGenerator:
+    """
+    Generates the power output of a whole fleet for one tick in a few array operations.
+
+    Produces the same distribution as StationSimulator.simulate_output(): a value
+    between 80% and 120% of the capacity of every running station, 0 otherwise.
+    Random numbers come from a counter-based generator (splitmix64 of the station
+    seed and the tick number), so each station has its own reproducible stream
+    that does not depend on the other stations or on the order of evaluation.
+
+    Attributes:
+        capacities (np.ndarray): Capacity of every station in kilowatts
+        seeds (np.ndarray): uint64 RNG seed of every station
+        tick (int): Number of ticks generated so far
+    """
+
+    def __init__(self, capacities: np.ndarray, seeds: np.ndarray):
+        """
+        Initialize the generator.
+
+        Args:
+            capacities (np.ndarray): Capacity of every station in kilowatts
+            seeds (np.ndarray): RNG seed of every station, e.g. from station_seeds()
+        """
+        self.capacities: np.ndarray = np.asarray(capacities, dtype=np.float64)
+        self.seeds: np.ndarray = np.asarray(seeds, dtype=np.uint64)
+        if self.capacities.shape != self.seeds.shape:
+            raise ValueError("capacities and seeds must have the same shape")
+        self.tick: int = 0
+
+        # Preallocated work buffers, reused on every tick
+        self.__state: np.ndarray = np.empty_like(self.seeds)
+        self.__shifted: np.ndarray = np.empty_like(self.seeds)
+        self.__uniform: np.ndarray = np.empty_like(self.capacities)
+        self.__outputs: np.ndarray = np.empty(self.capacities.shape, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.capacities)
+
+    def uniform(self) -> np.ndarray:
+        """
+        Draw one uniform [0, 1) sample per station for the current tick.
+
+        Returns:
+            np.ndarray: float64 samples; the buffer is reused by the next call
+        """
+        state, shifted = self.__state, self.__shifted
+        np.multiply(GOLDEN_GAMMA, np.uint64(self.tick + 1), out=state)
+        np.add(state, self.seeds, out=state)
+
+        np.right_shift(state, np.uint64(30), out=shifted)
+        np.bitwise_xor(state, shifted, out=state)
+        np.multiply(state, MIX_MULTIPLIER_1, out=state)
+        np.right_shift(state, np.uint64(27), out=shifted)
+        np.bitwise_xor(state, shifted, out=state)
+        np.multiply(state, MIX_MULTIPLIER_2, out=state)
+        np.right_shift(state, np.uint64(31), out=shifted)
+        np.bitwise_xor(state, shifted, out=state)
+
+        # Keep the top 53 bits, the precision of a float64 mantissa
+        np.right_shift(state, np.uint64(11), out=state)
+        np.multiply(state, 2.0**-53, out=self.__uniform)
+        self.tick += 1
+        return self.__uniform
+
+    def generate(self, running: np.ndarray) -> np.ndarray:
+        """
+        Generate the output of every station for the next tick.
+
+        Args:
+            running (np.ndarray): Boolean running flag of every station
+
+        Returns:
+            np.ndarray: int64 output in kilowatts; the buffer is reused by the next call
+        """
+        uniform = self.uniform()
+        # capacity * 0.8 + capacity * 0.4 * u == capacity * (0.8 + 0.4 * u)
+        np.multiply(uniform, 0.4, out=uniform)
+        np.add(uniform, 0.8, out=uniform)
+        np.multiply(uniform, self.capacities, out=uniform)
+        np.multiply(uniform, running, out=uniform)
+        np.floor(uniform, out=uniform)
+        self.__outputs[:] = uniform
+        return self.__outputs
+
+
+class StatefulOutputModel:
+    """
+    Generates fleet outputs that follow ramp rates and autocorrelated noise.
+
+    Unlike FleetOutputGenerator, every station has a state that carries over
+    from tick to tick: its output level moves towards a target by at most
+    `ramp_rate` kW per second, and the noise follows an AR(1) process,
+    noise = correlation * noise + sqrt(1 - correlation²) * noise_level * N(0, 1),
+    so readings drift smoothly instead of jumping around independently.
+
+    The target of a running station is its capacity times `derate`, capped at
+    `limit`; a stopped station's target is 0. A scenario engine changes these
+    arrays, and `level` for instantaneous trips, between ticks.
+
+    Attributes:
+        capacities (np.ndarray): Capacity of every station in kilowatts
+        interval (float): Seconds between two ticks
+        ramp_rate (np.ndarray): Maximum change of every level, in kW per second
+        derate (np.ndarray): Available fraction of every capacity, e.g. by weather
+        limit (np.ndarray): Output limit of every station in kW, inf for none
+        level (np.ndarray): Output level of every station before noise
+        noise_level (float): Standard deviation of the relative noise
+        correlation (float): Correlation of the noise between two ticks
+    """
+
+    def __init__(
+        self,
+        capacities: np.ndarray,
+        seed: int,
+        interval: float,
+        ramp_rate: np.ndarray | float,
+        noise_level: float = 0.03,
+        correlation: float = 0.9,
+    ):
+        """
+        Initialize the model; levels start at the target on the first tick.
+
+        Args:
+            capacities (np.ndarray): Capacity of every station in kilowatts
+            seed (int): RNG seed of the noise
+            interval (float): Seconds between two ticks
+            ramp_rate (np.ndarray | float): Maximum change of every level, in kW
+                per second
+            noise_level (float, optional): Standard deviation of the relative
+                noise. Defaults to 0.03.
+            correlation (float, optional): Correlation of the noise between two
+                ticks, 0 for independent noise. Defaults to 0.9.
+        """
+        if not 0 <= correlation < 1:
+            raise ValueError("correlation must be in [0, 1)")
+        self.capacities: np.ndarray = np.asarray(capacities, dtype=np.float64)
+        size = len(self.capacities)
+        self.interval: float = interval
+        self.ramp_rate: np.ndarray = np.array(
+            np.broadcast_to(ramp_rate, size), dtype=np.float64
+        )
+        self.derate: np.ndarray = np.ones(size, dtype=np.float64)
+        self.limit: np.ndarray = np.full(size, np.inf)
+        self.level: np.ndarray = np.zeros(size, dtype=np.float64)
+        self.noise_level: float = noise_level
+        self.correlation: float = correlation
+        self.tick: int = 0
+
+        self.__rng = np.random.default_rng(seed)
+        # Drawn from the stationary distribution, so no warm-up is needed
+        self.__noise: np.ndarray = self.__rng.standard_normal(size) * noise_level
+        # Preallocated work buffers, reused on every tick
+        self.__target: np.ndarray = np.empty(size, dtype=np.float64)
+        self.__step: np.ndarray = np.empty(size, dtype=np.float64)
+        self.__normal: np.ndarray = np.empty(size, dtype=np.float64)
+        self.__outputs: np.ndarray = np.empty(size, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.capacities)
+
+    def generate(self, running: np.ndarray) -> np.ndarray:
+        """
+        Advance every station by one tick and return its output.
+
+        Args:
+            running (np.ndarray): Boolean running flag of every station
+
+        Returns:
+            np.ndarray: int64 output in kilowatts; the buffer is reused by the next call
+        """
+        target, step = self.__target, self.__step
+        np.multiply(self.capacities, self.derate, out=target)
+        np.minimum(target, self.limit, out=target)
+        np.multiply(target, running, out=target)
+        if self.tick == 0:
+            self.level[:] = target
+
+        # level += clip(target - level, -step, step)
+        np.multiply(self.ramp_rate, self.interval, out=step)
+        np.subtract(target, self.level, out=target)
+        np.clip(target, -step, step, out=target)
+        np.add(self.level, target, out=self.level)
+        # Stopped stations drop out at once and ramp up again from 0
+        np.multiply(self.level, running, out=self.level)
+
+        normal = self.__normal
+        self.__rng.standard_normal(out=normal)
+        np.multiply(
+            normal,
+            self.noise_level * np.sqrt(1 - self.correlation**2),
+            out=normal,
+        )
+        np.multiply(self.__noise, self.correlation, out=self.__noise)
+        np.add(self.__noise, normal, out=self.__noise)
+
+        # output = max(level * (1 + noise), 0)
+        np.add(self.__noise, 1.0, out=normal)
+        np.multiply(normal, self.level, out=normal)
+        np.maximum(normal, 0.0, out=normal)
+        np.floor(normal, out=normal)
+        self.__outputs[:] = normal
+        self.tick += 1
+        return self.__outputs
@@ -0,0 +1,502 @@
+import argparse
+import json
+import tomllib
+from heapq import heapify, heappop, heappush
+from pathlib import Path
+from threading import Lock
+from time import perf_counter
+from typing import Any, NamedTuple
+
+import numpy as np
+
+from logger import getLogger
+from metrics import REGISTRY
+from output_generator import StatefulOutputModel, station_seeds
+from station_simulator import ControlCommand, StationSimulator
+
+logger = getLogger(__name__)
+
+SCENARIO_EVENTS = REGISTRY.counter(
+    "scenario_events_applied_total",
+    "Scenario events applied, by action",
+    ("action",),
+)
+
+# Action -> parameters it requires
+ACTIONS: dict[str, tuple[str, ...]] = dict(
+    trip=(),
+    restore=(),
+    ramp=(),
+    derate=("factor",),
+    cascade=("steps", "delay", "spread"),
+)
+# Keys of an event that are not parameters of its action
+EVENT_KEYS: tuple[str, ...] = ("at", "action", "stations", "region", "tag")
+
+STOP: ControlCommand = ControlCommand(running=False)
+START: ControlCommand = ControlCommand(running=True)
+
+
+class ScenarioEvent(NamedTuple):
+    """
+    One timed event of a scenario.
+
+    The event applies to the listed `stations`, else to the stations of `region`,
+    else to those with `tag`, else to every station; a `fraction` parameter picks
+    that share of them at random when the event fires.
+
+    Actions and their parameters:
+        trip: stop the stations; their output drops to 0 at once
+        restore: start the stations; their output ramps up from its level
+        ramp: move the output towards `target_percent` of the capacity (or
+            `target_kw`), at `rate_percent_per_minute` if given, else at the
+            current ramp rate; without a target the limit is lifted
+        derate: make only `factor` of the capacity available, e.g. for weather,
+            for `duration` seconds if given
+        cascade: trip the stations, then `steps` times, every `delay` seconds,
+            trip `spread` more running stations of the same regions
+
+    Attributes:
+        at (float): Seconds after the start of the scenario
+        action (str): One of ACTIONS
+        stations (tuple[str, ...]): Ids of the addressed stations
+        region (str): Region of the addressed stations
+        tag (str): Tag of the addressed stations
+        params (dict[str, float]): Parameters of the action
+    """
+
+    at: float
+    action: str
+    stations: tuple[str, ...] = ()
+    region: str = ""
+    tag: str = ""
+    params: dict[str, float] = {}
+
+
+def parse_event(entry: dict[str, Any]) -> ScenarioEvent:
+    """
+    Validate one event of a scenario file.
+
+    Args:
+        entry (dict[str, Any]): The event, e.g. one `[[events]]` table
+
+    Returns:
+        ScenarioEvent: The validated event
+
+    Raises:
+        ValueError: If the event is incomplete or unknown
+    """
+    action = entry.get("action")
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown scenario action {action!r} in {entry}")
+    at = float(entry.get("at", -1))
+    if at < 0:
+        raise ValueError(f"Scenario event needs a time 'at' >= 0: {entry}")
+    params = {
+        key: float(value) for key, value in entry.items() if key not in EVENT_KEYS
+    }
+    missing = [name for name in ACTIONS[action] if name not in params]
+    if missing:
+        raise ValueError(f"Scenario {action} event misses {missing}: {entry}")
+    if not 0 < params.get("fraction", 1) <= 1:
+        raise ValueError(f"Scenario event fraction must be in (0, 1]: {entry}")
+    return ScenarioEvent(
+        at=at,
+        action=action,
+        stations=tuple(entry.get("stations", ())),
+        region=entry.get("region", ""),
+        tag=entry.get("tag", ""),
+        params=params,
+    )
+
+
+class Scenario:
+    """
+    A script of timed events plus the settings of the stateful output model.
+
+    Attributes:
+        events (list[ScenarioEvent]): The events, in any order
+        ramp_percent_per_minute (float): Default ramp rate, in percent of the
+            capacity per minute
+        noise_percent (float): Standard deviation of the output noise, in percent
+        noise_correlation (float): Correlation of the noise between two ticks
+        seed (int): RNG seed of the noise and of random station picks
+    """
+
+    def __init__(
+        self,
+        events: list[ScenarioEvent],
+        ramp_percent_per_minute: float = 10.0,
+        noise_percent: float = 3.0,
+        noise_correlation: float = 0.9,
+        seed: int = 0,
+    ):
+        self.events: list[ScenarioEvent] = events
+        self.ramp_percent_per_minute: float = ramp_percent_per_minute
+        self.noise_percent: float = noise_percent
+        self.noise_correlation: float = noise_correlation
+        self.seed: int = seed
+
+    def output_model(
+        self, stations: list[StationSimulator], interval: float
+    ) -> StatefulOutputModel:
+        """
+        Create the output model of a group of stations.
+
+        Args:
+            stations (list[StationSimulator]): The stations, in output order
+            interval (float): Seconds between two ticks of the group
+
+        Returns:
+            StatefulOutputModel: The model, seeded from the scenario and the
+                first station of the group
+        """
+        capacities = np.array(
+            [station.app_config.CAPACITY_KW for station in stations], dtype=np.float64
+        )
+        return StatefulOutputModel(
+            capacities,
+            seed=int(
+                station_seeds([stations[0].app_config.POWER_STATION_ID], self.seed)[0]
+            ),
+            interval=interval,
+            ramp_rate=capacities * self.ramp_percent_per_minute / 100 / 60,
+            noise_level=self.noise_percent / 100,
+            correlation=self.noise_correlation,
+        )
+
+
+def load_scenario(path: str) -> Scenario:
+    """
+    Load a scenario file.
+
+    TOML files hold an optional `[model]` table with the settings of Scenario
+    and one `[[events]]` table per event; JSON files hold the same structure.
+
+    Example:
+        [model]
+        ramp_percent_per_minute = 20
+        noise_percent = 3
+
+        [[events]]
+        at = 600
+        action = "derate"
+        region = "north"
+        factor = 0.6
+        duration = 1800
+
+        [[events]]
+        at = 900
+        action = "cascade"
+        stations = ["PS_001_00042"]
+        steps = 3
+        delay = 30
+        spread = 5
+
+    Args:
+        path (str): Path of the .toml or .json file
+
+    Returns:
+        Scenario: The validated scenario
+    """
+    started = perf_counter()
+    suffix = Path(path).suffix.lower()
+    if suffix == ".toml":
+        with open(path, "rb") as toml_file:
+            document = tomllib.load(toml_file)
+    elif suffix == ".json":
+        with open(path) as json_file:
+            document = json.load(json_file)
+    else:
+        raise ValueError(f"Unsupported scenario format: {path}")
+
+    scenario = Scenario(
+        [parse_event(entry) for entry in document.get("events", [])],
+        **document.get("model", {}),
+    )
+    logger.info(
+        f"Loaded {len(scenario.events)} scenario events from {path} "
+        f"in {perf_counter() - started:.3f}s"
+    )
+    return scenario
+
+
+class ScenarioEngine:
+    """
+    Applies the events of a scenario to a fleet at their time.
+
+    Events wait in a priority queue keyed by their due time, so advance() costs
+    a single comparison on ticks without due events, and O(log n) per applied
+    event. Follow-up events, such as the end of a derating or the next step of
+    a cascade, are pushed onto the same queue.
+
+    Stations are addressed through flat arrays of (model, index in model), and
+    the positions of every selector are resolved once and cached, so applying an
+    event costs a few array operations per output model it touches, plus one
+    ControlCommand per station whose running state changes.
+
+    Attributes:
+        applied (int): Number of events applied so far
+        start_time (float): Time the scenario started at
+        lock (Lock): Held while events are applied; hold it while generating
+            outputs with the models of the engine
+    """
+
+    def __init__(
+        self,
+        scenario: Scenario,
+        groups: list[tuple[list[StationSimulator], StatefulOutputModel]],
+        start_time: float,
+    ):
+        """
+        Initialize the engine.
+
+        Args:
+            scenario (Scenario): The scenario to run
+            groups (list[tuple[list[StationSimulator], StatefulOutputModel]]): The
+                stations of the fleet with the output model generating them
+            start_time (float): Time the scenario starts at, e.g. the current
+                time of the scheduler
+        """
+        self.applied: int = 0
+        self.start_time: float = start_time
+        self.__rng = np.random.default_rng(scenario.seed)
+        self.__models: list[StatefulOutputModel] = [model for _, model in groups]
+        self.__stations: list[StationSimulator] = [
+            station for stations, _ in groups for station in stations
+        ]
+        self.__model_of: np.ndarray = np.concatenate(
+            [
+                np.full(len(stations), number)
+                for number, (stations, _) in enumerate(groups)
+            ]
+        ).astype(np.intp)
+        self.__index_of: np.ndarray = np.concatenate(
+            [np.arange(len(stations)) for stations, _ in groups]
+        ).astype(np.intp)
+        self.__position: dict[str, int] = {
+            station.app_config.POWER_STATION_ID: position
+            for position, station in enumerate(self.__stations)
+        }
+        self.__selections: dict[tuple, np.ndarray] = {}
+
+        # (due time, tie breaker, event, resolved positions of follow-up events)
+        self.__queue: list[tuple[float, int, ScenarioEvent, np.ndarray | None]] = [
+            (start_time + event.at, sequence, event, None)
+            for sequence, event in enumerate(scenario.events)
+        ]
+        heapify(self.__queue)
+        self.__sequence: int = len(self.__queue)
+        self.lock: Lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.__queue)
+
+    def advance(self, now: float):
+        """
+        Apply every event due by `now`.
+
+        Args:
+            now (float): The current time
+        """
+        queue = self.__queue
+        if not queue or queue[0][0] > now:
+            return
+        with self.lock:
+            while queue and queue[0][0] <= now:
+                due, _, event, positions = heappop(queue)
+                self.__apply(event, due, positions)
+
+    def __push(self, due: float, event: ScenarioEvent, positions: np.ndarray):
+        heappush(self.__queue, (due, self.__sequence, event, positions))
+        self.__sequence += 1
+
+    def __select(self, event: ScenarioEvent) -> np.ndarray:
+        """
+        Return the positions of the stations an event addresses.
+        """
+        key = (event.stations, event.region, event.tag)
+        positions = self.__selections.get(key)
+        if positions is None:
+            if event.stations:
+                selected = [
+                    self.__position[station_id]
+                    for station_id in event.stations
+                    if station_id in self.__position
+                ]
+            else:
+                selected = [
+                    position
+                    for position, station in enumerate(self.__stations)
+                    if (not event.region or station.app_config.REGION == event.region)
+                    and (
+                        not event.tag or event.tag in station.app_config.TAGS.split(",")
+                    )
+                ]
+            positions = self.__selections[key] = np.array(selected, dtype=np.intp)
+
+        fraction = event.params.get("fraction")
+        if fraction is not None and len(positions):
+            picked = max(round(len(positions) * fraction), 1)
+            positions = self.__rng.choice(positions, size=picked, replace=False)
+        return positions
+
+    def __by_model(self, positions: np.ndarray):
+        """
+        Yield (model, indices in the model) for every model of the positions.
+        """
+        models = self.__model_of[positions]
+        for number in np.unique(models).tolist():
+            yield self.__models[number], self.__index_of[positions[models == number]]
+
+    def __set_running(self, positions: np.ndarray, running: bool):
+        command = START if running else STOP
+        for position in positions.tolist():
+            self.__stations[position].apply_command(command)
+
+    def __apply(self, event: ScenarioEvent, now: float, positions: np.ndarray | None):
+        if positions is None:
+            positions = self.__select(event)
+        params = event.params
+        action = event.action
+
+        if action in ("trip", "cascade"):
+            self.__set_running(positions, False)
+        elif action == "restore":
+            self.__set_running(positions, True)
+        elif action == "ramp":
+            for model, indices in self.__by_model(positions):
+                capacities = model.capacities[indices]
+                if "target_kw" in params:
+                    model.limit[indices] = params["target_kw"]
+                elif "target_percent" in params:
+                    model.limit[indices] = capacities * params["target_percent"] / 100
+                else:
+                    model.limit[indices] = np.inf
+                if "rate_percent_per_minute" in params:
+                    model.ramp_rate[indices] = (
+                        capacities * params["rate_percent_per_minute"] / 100 / 60
+                    )
+        elif action == "derate":
+            for model, indices in self.__by_model(positions):
+                model.derate[indices] = params["factor"]
+            if "duration" in params:
+                self.__push(
+                    now + params["duration"],
+                    ScenarioEvent(
+                        at=event.at + params["duration"],
+                        action="derate",
+                        params=dict(factor=1.0),
+                    ),
+                    positions,
+                )
+
+        if action == "cascade":
+            self.__spread(event, positions, now)
+        self.applied += 1
+        SCENARIO_EVENTS.labels(action).inc()
+
+    def __spread(self, event: ScenarioEvent, positions: np.ndarray, now: float):
+        """
+        Schedule the follow-up trips of a cascade.
+
+        The stations to trip are drawn now, from the running stations sharing a
+        region with the tripped ones, or from the whole fleet without regions.
+        """
+        regions = {
+            self.__stations[position].app_config.REGION
+            for position in positions.tolist()
+        }
+        tripped = set(positions.tolist())
+        candidates = np.array(
+            [
+                position
+                for position, station in enumerate(self.__stations)
+                if station.running
+                and position not in tripped
+                and (regions == {""} or station.app_config.REGION in regions)
+            ],
+            dtype=np.intp,
+        )
+        order = self.__rng.permutation(candidates)
+        spread = int(event.params["spread"])
+        for step in range(int(event.params["steps"])):
+            chunk = order[step * spread : (step + 1) * spread]
+            if not len(chunk):
+                break
+            delay = (step + 1) * event.params["delay"]
+            self.__push(
+                now + delay,
+                ScenarioEvent(at=event.at + delay, action="trip"),
+                chunk,
+            )
+
+
+def write_example(
+    path: str, station_ids: list[str], events: int, duration: float, seed: int = 0
+) -> None:
+    """
+    Write a JSON scenario of random events, e.g. for benchmarks.
+
+    Args:
+        path (str): Path of the .json file to create
+        station_ids (list[str]): Stations the events address
+        events (int): Number of events
+        duration (float): Seconds the events are spread over
+        seed (int, optional): RNG seed. Defaults to 0.
+    """
+    rng = np.random.default_rng(seed)
+    times = np.sort(rng.uniform(0, duration, events)).round(3).tolist()
+    actions = rng.choice(["trip", "restore", "ramp", "derate"], size=events).tolist()
+    targets = rng.choice(station_ids, size=(events, 3)).tolist()
+    entries = []
+    for at, action, stations in zip(times, actions, targets):
+        entry = dict(at=at, action=action, stations=stations)
+        if action == "ramp":
+            entry.update(target_percent=float(rng.integers(20, 101)))
+        elif action == "derate":
+            entry.update(factor=round(float(rng.uniform(0.3, 1.0)), 2), duration=600)
+        entries.append(entry)
+    with open(path, "w") as json_file:
+        json.dump(dict(model=dict(seed=seed), events=entries), json_file)
+
+
+if __name__ == "__main__":
+    """
+    Validate a scenario file, or write an example one.
+
+    Example usage:
+        python scenario.py scenario.toml
+        python scenario.py scenario.json --example 100000 --stations 10000
+    """
+    parser = argparse.ArgumentParser(description="⚡ Validate a scenario file")
+    parser.add_argument("path", help="The .toml or .json scenario")
+    parser.add_argument(
+        "--example",
+        type=int,
+        metavar="EVENTS",
+        help="Write an example scenario with this many events instead",
+    )
+    parser.add_argument(
+        "--stations",
+        type=int,
+        default=1000,
+        help="Stations of the example, named like a --fleet-size fleet of PS_001",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=86400,
+        help="Seconds the example events are spread over (default: 86400)",
+    )
+    args = parser.parse_args()
+
+    if args.example:
+        write_example(
+            args.path,
+            [f"PS_001_{index:05d}" for index in range(args.stations)],
+            args.example,
+            args.duration,
+        )
+    else:
+        load_scenario(args.path)
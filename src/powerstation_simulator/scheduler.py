@@ -0,0 +1,554 @@
+from asyncio import AbstractEventLoop, TimerHandle, get_running_loop
+from concurrent.futures import Future, ThreadPoolExecutor
+from heapq import heappop, heappush
+from itertools import count
+from threading import Condition, Thread
+from time import monotonic
+from typing import Callable
+from weakref import WeakSet
+
+from logger import getLogger
+from metrics import REGISTRY
+
+logger = getLogger(__name__)
+
+# Every live scheduler, read when the metrics are collected
+SCHEDULERS: WeakSet = WeakSet()
+
+
+def scheduler_samples(field: str) -> list[tuple[dict[str, str], float]]:
+    """
+    Read one SchedulerStats field of every live scheduler.
+    """
+    return [
+        (dict(scheduler=scheduler.name), getattr(scheduler.stats, field))
+        for scheduler in list(SCHEDULERS)
+    ]
+
+
+for field, kind, help in (
+    ("dispatched", "counter", "Callbacks dispatched"),
+    (
+        "overruns",
+        "counter",
+        "Ticks skipped because the previous run was still executing",
+    ),
+    ("missed", "counter", "Ticks skipped because the dispatcher fell behind"),
+    ("jitter_max", "gauge", "Largest dispatch lateness in seconds"),
+    ("jitter_mean", "gauge", "Mean dispatch lateness in seconds"),
+):
+    REGISTRY.sampled(
+        f"scheduler_{field}{'_total' if kind == 'counter' else '_seconds'}",
+        help,
+        lambda field=field: scheduler_samples(field),
+        kind=kind,
+    )
+
+
+class SchedulerStats:
+    """
+    Counters describing how well a Scheduler keeps its deadlines.
+
+    All counters are written by the dispatcher thread only.
+
+    Attributes:
+        dispatched (int): Number of callbacks handed to the worker pool
+        overruns (int): Ticks skipped because the previous run was still executing
+        missed (int): Ticks skipped because the dispatcher fell behind by a full interval
+        jitter_max (float): Largest observed dispatch lateness in seconds
+        jitter_total (float): Sum of the dispatch lateness of all dispatched ticks
+    """
+
+    __slots__ = ("dispatched", "overruns", "missed", "jitter_max", "jitter_total")
+
+    def __init__(self):
+        self.dispatched: int = 0
+        self.overruns: int = 0
+        self.missed: int = 0
+        self.jitter_max: float = 0.0
+        self.jitter_total: float = 0.0
+
+    @property
+    def jitter_mean(self) -> float:
+        """
+        Mean dispatch lateness in seconds.
+        """
+        return self.jitter_total / self.dispatched if self.dispatched else 0.0
+
+    def as_dict(self) -> dict:
+        """
+        Return the counters as a plain dictionary, e.g. for logging or publishing.
+
+        Returns:
+            dict: Counter names mapped to their current values
+        """
+        return dict(
+            dispatched=self.dispatched,
+            overruns=self.overruns,
+            missed=self.missed,
+            jitter_max=self.jitter_max,
+            jitter_mean=self.jitter_mean,
+        )
+
+
+class PeriodicTask:
+    """
+    A callback registered with a Scheduler to run at a fixed interval.
+
+    Deadlines are absolute: each tick is armed at `previous deadline + interval`,
+    so the time spent inside the callback does not accumulate as drift.
+
+    Attributes:
+        callback (Callable[[], None]): The function invoked on every tick
+        interval (float): Seconds between two consecutive ticks
+        deadline (float): Monotonic time of the next tick
+        cancelled (bool): True once the task has been cancelled
+        running (bool): True while the callback is executing on a worker
+        overruns (int): Ticks of this task skipped because it was still running
+    """
+
+    __slots__ = ("callback", "interval", "deadline", "cancelled", "running", "overruns")
+
+    def __init__(self, callback: Callable[[], None], interval: float, deadline: float):
+        """
+        Initialize a periodic task.
+
+        Args:
+            callback (Callable[[], None]): The function invoked on every tick
+            interval (float): Seconds between two consecutive ticks
+            deadline (float): Monotonic time of the first tick
+        """
+        self.callback: Callable[[], None] = callback
+        self.interval: float = interval
+        self.deadline: float = deadline
+        self.cancelled: bool = False
+        self.running: bool = False
+        self.overruns: int = 0
+
+
+class Scheduler:
+    """
+    Runs many periodic tasks from a single dispatcher thread and a fixed worker pool.
+
+    Tasks are kept in a heap ordered by their next deadline on the monotonic clock.
+    The dispatcher thread sleeps until the earliest deadline, hands due tasks to the
+    worker pool and re-arms them, so the number of OS threads does not grow with the
+    number of tasks. The sleep is a condition wait, so stop() takes effect immediately.
+
+    Attributes:
+        stats (SchedulerStats): Jitter, overrun and missed-tick counters
+    """
+
+    def __init__(self, workers: int = 4, name: str = "scheduler"):
+        """
+        Initialize the scheduler.
+
+        Args:
+            workers (int, optional): Number of worker threads executing callbacks.
+                Defaults to 4.
+            name (str, optional): Prefix used for the dispatcher and worker thread names.
+                Defaults to "scheduler".
+        """
+        self.name: str = name
+        self.running: bool = False
+        self.stats: SchedulerStats = SchedulerStats()
+        SCHEDULERS.add(self)
+        self.__heap: list[tuple[float, int, PeriodicTask]] = []
+        self.__sequence = count()
+        self.__condition: Condition = Condition()
+        self.__executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=f"{name}-worker"
+        )
+        self.__dispatcher: Thread | None = None
+        # Callbacks submitted to the worker pool and not finished yet
+        self.__busy: int = 0
+
+    def start(self) -> None:
+        """
+        Start the dispatcher thread.
+        """
+        if self.running:
+            return
+        self.running = True
+        self.__dispatcher = Thread(
+            target=self.__dispatch_loop, name=f"{self.name}-dispatcher", daemon=True
+        )
+        self.__dispatcher.start()
+        logger.info(f"Scheduler '{self.name}' started.")
+
+    def stop(self, wait: bool = True, timeout: float | None = None) -> bool:
+        """
+        Stop the dispatcher and the worker pool.
+
+        Args:
+            wait (bool, optional): Block until running callbacks have finished.
+                Defaults to True.
+            timeout (float, optional): Maximum seconds to wait for them; callbacks
+                still running past it are left to finish on their own. Defaults
+                to no limit.
+
+        Returns:
+            bool: False if callbacks were still running when the timeout expired
+        """
+        with self.__condition:
+            self.running = False
+            self.__heap.clear()
+            self.__condition.notify_all()
+        if timeout is None:
+            if self.__dispatcher is not None and wait:
+                self.__dispatcher.join()
+            self.__executor.shutdown(wait=wait, cancel_futures=True)
+            logger.info(f"Scheduler '{self.name}' stopped.")
+            return True
+
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+        with self.__condition:
+            idle = not wait or self.__condition.wait_for(
+                lambda: not self.__busy, timeout
+            )
+        if not idle:
+            logger.warning(
+                f"Scheduler '{self.name}' stopped with {self.__busy} callbacks still running."
+            )
+        else:
+            logger.info(f"Scheduler '{self.name}' stopped.")
+        return idle
+
+    def schedule_periodic(
+        self, callback: Callable[[], None], interval: float, delay: float = 0.0
+    ) -> PeriodicTask:
+        """
+        Register a callback to run every `interval` seconds.
+
+        Args:
+            callback (Callable[[], None]): The function to invoke
+            interval (float): Seconds between two consecutive runs
+            delay (float, optional): Seconds before the first run. Defaults to 0.0.
+
+        Returns:
+            PeriodicTask: Handle that can be passed to cancel()
+        """
+        task = PeriodicTask(callback, interval, monotonic() + delay)
+        with self.__condition:
+            self.__push(task)
+            self.__condition.notify()
+        return task
+
+    def cancel(self, task: PeriodicTask) -> None:
+        """
+        Cancel a periodic task. The task is dropped the next time it becomes due.
+
+        Args:
+            task (PeriodicTask): The handle returned by schedule_periodic()
+        """
+        task.cancelled = True
+
+    def __push(self, task: PeriodicTask) -> None:
+        heappush(self.__heap, (task.deadline, next(self.__sequence), task))
+
+    def __dispatch_loop(self) -> None:
+        """
+        Wait for the earliest deadline, submit due tasks and re-arm them.
+        """
+        with self.__condition:
+            while self.running:
+                if not self.__heap:
+                    self.__condition.wait()
+                    continue
+
+                deadline, _, task = self.__heap[0]
+                timeout = deadline - monotonic()
+                if timeout > 0:
+                    self.__condition.wait(timeout)
+                    continue
+
+                heappop(self.__heap)
+                if task.cancelled:
+                    continue
+
+                lateness = -timeout
+                if task.running:
+                    task.overruns += 1
+                    self.stats.overruns += 1
+                else:
+                    task.running = True
+                    self.stats.dispatched += 1
+                    self.stats.jitter_total += lateness
+                    if lateness > self.stats.jitter_max:
+                        self.stats.jitter_max = lateness
+                    self.__busy += 1
+                    self.__executor.submit(self.__run, task).add_done_callback(
+                        self.__done
+                    )
+
+                # Skip whole intervals the dispatcher fell behind on instead of bursting
+                missed = int(lateness // task.interval) if task.interval > 0 else 0
+                self.stats.missed += missed
+                task.deadline += task.interval * (missed + 1)
+                self.__push(task)
+
+    def __run(self, task: PeriodicTask) -> None:
+        """
+        Execute a task callback on a worker thread.
+
+        Args:
+            task (PeriodicTask): The task to execute
+        """
+        try:
+            task.callback()
+        except Exception:
+            logger.exception(f"Scheduled task {task.callback!r} failed")
+        finally:
+            task.running = False
+
+    def __done(self, future: Future) -> None:
+        """
+        Count a callback as finished, also when stop() cancelled it unstarted.
+        """
+        with self.__condition:
+            self.__busy -= 1
+            if not self.running and not self.__busy:
+                self.__condition.notify_all()
+
+
+class AsyncScheduler:
+    """
+    Runs periodic tasks on an asyncio event loop instead of worker threads.
+
+    Offers the same schedule_periodic()/cancel()/start()/stop() surface as
+    Scheduler, so a StationSimulator can be driven by either. Callbacks run
+    directly on the loop and must therefore be non-blocking, e.g. publishing
+    through an AsyncMQTTClient.
+
+    Attributes:
+        stats (SchedulerStats): Jitter, overrun and missed-tick counters
+    """
+
+    def __init__(self, name: str = "async-scheduler"):
+        """
+        Initialize the scheduler.
+
+        Args:
+            name (str, optional): Name used in log messages. Defaults to "async-scheduler".
+        """
+        self.name: str = name
+        self.running: bool = False
+        self.stats: SchedulerStats = SchedulerStats()
+        SCHEDULERS.add(self)
+        self.__loop: AbstractEventLoop | None = None
+        self.__handles: dict[PeriodicTask, TimerHandle | None] = {}
+
+    def start(self) -> None:
+        """
+        Bind the scheduler to the running event loop and arm the pending tasks.
+        """
+        if self.running:
+            return
+        self.__loop = get_running_loop()
+        self.running = True
+        for task in list(self.__handles):
+            self.__arm(task)
+        logger.info(f"Scheduler '{self.name}' started.")
+
+    def stop(self, wait: bool = True, timeout: float | None = None) -> bool:
+        """
+        Cancel every pending timer.
+
+        Args:
+            wait (bool, optional): Accepted for compatibility with Scheduler.stop();
+                callbacks run on the loop, so there is never anything to wait for.
+            timeout (float, optional): Accepted for compatibility with
+                Scheduler.stop().
+
+        Returns:
+            bool: Always True
+        """
+        self.running = False
+        for handle in self.__handles.values():
+            if handle is not None:
+                handle.cancel()
+        self.__handles.clear()
+        logger.info(f"Scheduler '{self.name}' stopped.")
+        return True
+
+    def schedule_periodic(
+        self, callback: Callable[[], None], interval: float, delay: float = 0.0
+    ) -> PeriodicTask:
+        """
+        Register a callback to run every `interval` seconds.
+
+        Args:
+            callback (Callable[[], None]): The non-blocking function to invoke
+            interval (float): Seconds between two consecutive runs
+            delay (float, optional): Seconds before the first run. Defaults to 0.0.
+
+        Returns:
+            PeriodicTask: Handle that can be passed to cancel()
+        """
+        task = PeriodicTask(callback, interval, monotonic() + delay)
+        self.__handles[task] = None
+        if self.running:
+            self.__arm(task)
+        return task
+
+    def cancel(self, task: PeriodicTask) -> None:
+        """
+        Cancel a periodic task.
+
+        Args:
+            task (PeriodicTask): The handle returned by schedule_periodic()
+        """
+        task.cancelled = True
+        handle = self.__handles.pop(task, None)
+        if handle is not None:
+            handle.cancel()
+
+    def __arm(self, task: PeriodicTask) -> None:
+        # loop.time() is monotonic() on every supported platform
+        self.__handles[task] = self.__loop.call_at(task.deadline, self.__fire, task)
+
+    def __fire(self, task: PeriodicTask) -> None:
+        """
+        Run a due task on the loop and re-arm it at its next absolute deadline.
+
+        Args:
+            task (PeriodicTask): The due task
+        """
+        if task.cancelled or not self.running:
+            return
+
+        lateness = self.__loop.time() - task.deadline
+        self.stats.dispatched += 1
+        self.stats.jitter_total += lateness
+        if lateness > self.stats.jitter_max:
+            self.stats.jitter_max = lateness
+
+        try:
+            task.callback()
+        except Exception:
+            logger.exception(f"Scheduled task {task.callback!r} failed")
+
+        missed = int(lateness // task.interval) if task.interval > 0 else 0
+        self.stats.missed += missed
+        task.deadline += task.interval * (missed + 1)
+        self.__arm(task)
+
+
+class VirtualScheduler:
+    """
+    Runs periodic tasks on a simulated clock, as fast as the CPU allows.
+
+    Offers the same schedule_periodic()/cancel()/start()/stop() surface as
+    Scheduler. Instead of sleeping, run_until() pops tasks in deadline order and
+    jumps the clock straight to each deadline, so hours of simulated time pass in
+    seconds. Callbacks can read the simulated time through time().
+
+    Attributes:
+        now (float): The current simulated time in unix seconds
+        stats (SchedulerStats): Dispatch counters (jitter is always zero)
+    """
+
+    def __init__(self, start_time: float, name: str = "virtual-scheduler"):
+        """
+        Initialize the scheduler.
+
+        Args:
+            start_time (float): Simulated unix time at which the clock starts
+            name (str, optional): Name used in log messages. Defaults to "virtual-scheduler".
+        """
+        self.name: str = name
+        self.now: float = start_time
+        self.running: bool = False
+        self.stats: SchedulerStats = SchedulerStats()
+        SCHEDULERS.add(self)
+        self.__heap: list[tuple[float, int, PeriodicTask]] = []
+        self.__sequence = count()
+
+    def time(self) -> float:
+        """
+        Return the current simulated time, a drop-in replacement for time.time().
+
+        Returns:
+            float: Simulated unix time in seconds
+        """
+        return self.now
+
+    def start(self) -> None:
+        """
+        Allow run_until() to execute tasks.
+        """
+        self.running = True
+        logger.info(f"Scheduler '{self.name}' started.")
+
+    def stop(self, wait: bool = True, timeout: float | None = None) -> bool:
+        """
+        Stop executing tasks and drop every pending one.
+
+        Args:
+            wait (bool, optional): Accepted for compatibility with Scheduler.stop().
+            timeout (float, optional): Accepted for compatibility with
+                Scheduler.stop().
+
+        Returns:
+            bool: Always True
+        """
+        self.running = False
+        self.__heap.clear()
+        logger.info(f"Scheduler '{self.name}' stopped.")
+        return True
+
+    def schedule_periodic(
+        self, callback: Callable[[], None], interval: float, delay: float = 0.0
+    ) -> PeriodicTask:
+        """
+        Register a callback to run every `interval` simulated seconds.
+
+        Args:
+            callback (Callable[[], None]): The function to invoke
+            interval (float): Simulated seconds between two consecutive runs
+            delay (float, optional): Simulated seconds before the first run.
+                Defaults to 0.0.
+
+        Returns:
+            PeriodicTask: Handle that can be passed to cancel()
+        """
+        if interval <= 0:
+            raise ValueError("A virtual periodic task needs a positive interval")
+        task = PeriodicTask(callback, interval, self.now + delay)
+        heappush(self.__heap, (task.deadline, next(self.__sequence), task))
+        return task
+
+    def cancel(self, task: PeriodicTask) -> None:
+        """
+        Cancel a periodic task.
+
+        Args:
+            task (PeriodicTask): The handle returned by schedule_periodic()
+        """
+        task.cancelled = True
+
+    def run_until(self, end_time: float) -> None:
+        """
+        Execute every task due up to `end_time` and advance the clock to it.
+
+        Args:
+            end_time (float): Simulated unix time to run to
+        """
+        heap = self.__heap
+        while self.running and heap and heap[0][0] <= end_time:
+            _, _, task = heappop(heap)
+            if task.cancelled:
+                continue
+
+            self.now = task.deadline
+            self.stats.dispatched += 1
+            try:
+                task.callback()
+            except Exception:
+                logger.exception(f"Scheduled task {task.callback!r} failed")
+
+            task.deadline += task.interval
+            heappush(heap, (task.deadline, next(self.__sequence), task))
+
+        if self.running:
+            self.now = max(self.now, end_time)
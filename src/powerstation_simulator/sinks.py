@@ -0,0 +1,348 @@
+import csv
+from base64 import b64encode
+from time import time
+from typing import Any, Callable
+
+from config import AppConfig
+from history import HistoryRecorder, HistoryStore
+from logger import getLogger
+from mqtt_client import BackpressurePolicy, MQTTClient, encode_payload
+
+logger = getLogger(__name__)
+
+
+class FileSink:
+    """
+    Writes published messages to a local CSV file instead of a broker.
+
+    Implements the publishing surface of MQTTClient, so StationSimulator and the
+    fleet output batches can write to it unchanged. Every row holds the time
+    returned by `clock`, the topic and the encoded payload; binary payloads such
+    as batched telemetry are base64-encoded.
+
+    Attributes:
+        path (str): Path of the CSV file
+        connected (bool): True while the file is open
+        written (int): Number of rows written so far
+    """
+
+    def __init__(self, path: str, clock: Callable[[], float] = time):
+        """
+        Initialize the sink.
+
+        Args:
+            path (str): Path of the CSV file, truncated on connect()
+            clock (Callable[[], float], optional): Source of the row timestamps,
+                e.g. VirtualScheduler.time. Defaults to time.time.
+        """
+        self.path: str = path
+        self.clock: Callable[[], float] = clock
+        self.connected: bool = False
+        self.written: int = 0
+        self.__file = None
+        self.__writer = None
+
+    def connect(self):
+        """
+        Open the file and write the CSV header.
+        """
+        self.__file = open(self.path, "w", newline="", buffering=1024 * 1024)
+        self.__writer = csv.writer(self.__file)
+        self.__writer.writerow(("timestamp", "topic", "payload"))
+        self.connected = True
+        logger.info(f"Writing telemetry to {self.path}")
+
+    def wait_until_connected(self, timeout: float | None = None) -> bool:
+        """
+        Return whether the file is open; a file never has to wait for a broker.
+        """
+        return self.connected
+
+    def wait_until_published(self, timeout: float | None = None) -> bool:
+        """
+        Return True; rows are written when published.
+        """
+        return True
+
+    def disconnect(self):
+        """
+        Flush and close the file.
+        """
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+        self.connected = False
+        logger.info(f"Wrote {self.written} rows to {self.path}")
+
+    def publish(
+        self,
+        topic: str,
+        payload: Any,
+        qos: int = 1,
+        retain: bool = False,
+        policy: BackpressurePolicy = "block",
+    ) -> bool:
+        """
+        Write a message as one CSV row.
+
+        Args:
+            topic (str): The topic the message would be published to
+            payload (Any): The message (encoded like MQTTClient.publish does)
+            qos (int, optional): Ignored. Defaults to 1.
+            retain (bool, optional): Ignored. Defaults to False.
+            policy (BackpressurePolicy, optional): Ignored. Defaults to "block".
+
+        Returns:
+            bool: True if the row was written, False if the sink is closed
+        """
+        if not self.connected:
+            return False
+
+        payload = encode_payload(payload)
+        if isinstance(payload, bytes):
+            payload = b64encode(payload).decode()
+        self.__writer.writerow((f"{self.clock():.3f}", topic, payload))
+        self.written += 1
+        return True
+
+    def subscribe(
+        self, topic: str, qos: int = 1, on_message: Any | None = None
+    ) -> None:
+        """
+        Accept a subscription; a file never delivers messages.
+        """
+
+    def unsubscribe(self, topic: str) -> None:
+        """
+        Accept an unsubscription; a file never delivers messages.
+        """
+
+
+class HistorySink:
+    """
+    Writes the readings of published messages to a HistoryStore instead of a broker.
+
+    Implements the publishing surface of MQTTClient like FileSink, but keeps only
+    what a HistoryRecorder would record from the broker: station outputs and
+    batched telemetry, stamped with the time returned by `clock`.
+
+    Attributes:
+        path (str): Directory of the history store
+        store (HistoryStore | None): The open store, None when disconnected
+        connected (bool): True while the store is open
+    """
+
+    def __init__(
+        self, path: str, app_config: AppConfig, clock: Callable[[], float] = time
+    ):
+        """
+        Initialize the sink.
+
+        Args:
+            path (str): Directory of the history store, created if needed
+            app_config (AppConfig): Configuration providing MQTT_TOPIC_PREFIX
+            clock (Callable[[], float], optional): Source of the reading
+                timestamps, e.g. VirtualScheduler.time. Defaults to time.time.
+        """
+        self.path: str = path
+        self.app_config: AppConfig = app_config
+        self.clock: Callable[[], float] = clock
+        self.connected: bool = False
+        self.store: HistoryStore | None = None
+        self.__recorder: HistoryRecorder | None = None
+
+    def connect(self):
+        """
+        Open the history store.
+        """
+        self.store = HistoryStore(self.path)
+        self.__recorder = HistoryRecorder(self.store, self.app_config, mqtt_client=self)
+        self.connected = True
+        logger.info(f"Writing telemetry history to {self.path}")
+
+    def wait_until_connected(self, timeout: float | None = None) -> bool:
+        """
+        Return whether the store is open; a store never has to wait for a broker.
+        """
+        return self.connected
+
+    def wait_until_published(self, timeout: float | None = None) -> bool:
+        """
+        Return True; readings are recorded when published.
+        """
+        return True
+
+    def disconnect(self):
+        """
+        Write the open downsample buckets and close the store.
+        """
+        if self.store is not None:
+            self.store.close()
+            logger.info(f"Wrote {len(self.store.raw)} readings to {self.path}")
+            self.store = None
+        self.connected = False
+
+    def publish(
+        self,
+        topic: str,
+        payload: Any,
+        qos: int = 1,
+        retain: bool = False,
+        policy: BackpressurePolicy = "block",
+    ) -> bool:
+        """
+        Record the reading of a message, if it carries one.
+
+        Args:
+            topic (str): The topic the message would be published to
+            payload (Any): The message (encoded like MQTTClient.publish does)
+            qos (int, optional): Ignored. Defaults to 1.
+            retain (bool, optional): Ignored. Defaults to False.
+            policy (BackpressurePolicy, optional): Ignored. Defaults to "block".
+
+        Returns:
+            bool: True if the message was handled, False if the sink is closed
+        """
+        if not self.connected:
+            return False
+        self.__recorder.ingest(topic, encode_payload(payload), received=self.clock())
+        return True
+
+    def subscribe(
+        self, topic: str, qos: int = 1, on_message: Any | None = None
+    ) -> None:
+        """
+        Accept a subscription; a store never delivers messages.
+        """
+
+    def unsubscribe(self, topic: str) -> None:
+        """
+        Accept an unsubscription; a store never delivers messages.
+        """
+
+
+class TimestampedMQTTSink:
+    """
+    Publishes through an MQTTClient, stamping every payload with the time of `clock`.
+
+    Payloads are wrapped as {"ts": <unix seconds>, "value": <payload>}, so
+    consumers see the simulated time of a reading rather than its arrival time.
+    Binary payloads already carry their own timestamp, and retained messages
+    describe state rather than readings, so both are passed through unchanged.
+    Every message is published with the "block" policy: stamped readings are
+    distinct samples, so coalescing would silently drop history.
+
+    Attributes:
+        mqqt_client (MQTTClient): The client the stamped messages are published with
+    """
+
+    def __init__(self, mqtt_client: MQTTClient, clock: Callable[[], float] = time):
+        """
+        Initialize the sink.
+
+        Args:
+            mqtt_client (MQTTClient): The client used for publishing
+            clock (Callable[[], float], optional): Source of the timestamps.
+                Defaults to time.time.
+        """
+        self.mqqt_client: MQTTClient = mqtt_client
+        self.clock: Callable[[], float] = clock
+
+    @property
+    def connected(self) -> bool:
+        """
+        True while the wrapped client is connected.
+        """
+        return self.mqqt_client.connected
+
+    @property
+    def client_id(self) -> str:
+        """
+        The client id of the wrapped client.
+        """
+        return self.mqqt_client.client_id
+
+    @property
+    def on_connected(self) -> list[Callable[[], None]]:
+        """
+        The callbacks run after every (re)connect of the wrapped client.
+        """
+        return self.mqqt_client.on_connected
+
+    def connect(self):
+        """
+        Connect the wrapped client.
+        """
+        self.mqqt_client.connect()
+
+    def wait_until_connected(self, timeout: float | None = None) -> bool:
+        """
+        Block until the wrapped client is connected.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Defaults to no limit.
+
+        Returns:
+            bool: True if connected, False if the timeout expired
+        """
+        return self.mqqt_client.wait_until_connected(timeout)
+
+    def wait_until_published(self, timeout: float | None = None) -> bool:
+        """
+        Block until the wrapped client has published every message.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Defaults to no limit.
+
+        Returns:
+            bool: True if everything was published, False if the timeout expired
+        """
+        return self.mqqt_client.wait_until_published(timeout)
+
+    def disconnect(self):
+        """
+        Disconnect the wrapped client.
+        """
+        self.mqqt_client.disconnect()
+
+    def publish(
+        self,
+        topic: str,
+        payload: Any,
+        qos: int = 1,
+        retain: bool = False,
+        policy: BackpressurePolicy = "block",
+    ) -> bool:
+        """
+        Publish a message with the current time of the clock.
+
+        Args:
+            topic (str): The topic to publish to
+            payload (Any): The message to publish
+            qos (int, optional): Quality of Service level. Defaults to 1.
+            retain (bool, optional): Retain the message. Defaults to False.
+            policy (BackpressurePolicy, optional): Ignored, the wrapped client
+                always blocks. Defaults to "block".
+
+        Returns:
+            bool: The result of MQTTClient.publish()
+        """
+        if not (retain or isinstance(payload, bytes)):
+            payload = dict(ts=self.clock(), value=payload)
+        return self.mqqt_client.publish(
+            topic, payload, qos=qos, retain=retain, policy="block"
+        )
+
+    def subscribe(
+        self, topic: str, qos: int = 1, on_message: Any | None = None
+    ) -> None:
+        """
+        Subscribe through the wrapped client.
+        """
+        self.mqqt_client.subscribe(topic=topic, qos=qos, on_message=on_message)
+
+    def unsubscribe(self, topic: str) -> None:
+        """
+        Unsubscribe through the wrapped client.
+        """
+        self.mqqt_client.unsubscribe(topic)
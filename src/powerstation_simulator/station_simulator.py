@@ -1,14 +1,175 @@
+from json import loads
+from math import isfinite
 from random import random
-from threading import Thread
-from time import sleep
-from typing import Any
+from time import perf_counter, time
+from typing import Any, NamedTuple
+
+import numpy as np
 
 from config import AppConfig
+from deadband import Deadband
 from logger import getLogger
-from mqtt_client import MQTTClient, get_mqtt_client
+from metrics import REGISTRY
+from mqtt_client import BackpressurePolicy, MQTTClient, get_mqtt_client
+from scheduler import AsyncScheduler, PeriodicTask, Scheduler, VirtualScheduler
+from trace_replay import TraceOutputSource
 
 logger = getLogger(__name__)
 
+STATION_MESSAGES = REGISTRY.counter(
+    "powerstation_messages_published_total",
+    "Messages published per station",
+    ("station",),
+)
+STATION_CONTROL_MESSAGES = REGISTRY.counter(
+    "powerstation_control_messages_total",
+    "Control commands received per station",
+    ("station",),
+)
+CONTROL_HANDLING = REGISTRY.histogram(
+    "powerstation_control_handling_seconds",
+    "Time spent handling one control message",
+).labels()
+COMMAND_LATENCY = REGISTRY.histogram(
+    "powerstation_command_latency_seconds",
+    "Time from sending a control command (its ts) to its effect on a station",
+).labels()
+
+# Command words accepted besides "1" and "0"
+START_COMMANDS: tuple[str, ...] = ("1", "start")
+STOP_COMMANDS: tuple[str, ...] = ("0", "stop")
+
+
+class ControlCommand(NamedTuple):
+    """
+    One parsed control command.
+
+    Attributes:
+        station_id (str | None): The station to apply it to, None for every
+            station addressed by the topic
+        running (bool | None): Start or stop generation, None to keep the state
+        set_setpoint (bool): Whether the command changes the setpoint
+        setpoint_kw (float | None): Output limit in kW, None to remove the limit
+        sent (float | None): Unix time the command was sent, if given
+    """
+
+    station_id: str | None = None
+    running: bool | None = None
+    set_setpoint: bool = False
+    setpoint_kw: float | None = None
+    sent: float | None = None
+
+
+def parse_running(value: Any) -> bool | None:
+    """
+    Parse the running state of a command: a bool, "1"/"start" or "0"/"stop".
+
+    Args:
+        value (Any): The value, None if the command does not change the state
+
+    Returns:
+        bool | None: The requested running state
+    """
+    if value is None or isinstance(value, bool):
+        return value
+    if not isinstance(value, (str, int)):
+        raise ValueError(f"Unknown control command: {value!r}")
+    command = str(value).strip().lower()
+    if command in START_COMMANDS:
+        return True
+    if command in STOP_COMMANDS:
+        return False
+    raise ValueError(f"Unknown control command: {value!r}")
+
+
+def parse_number(value: Any, name: str) -> float:
+    """
+    Parse a finite number of a control command.
+
+    Args:
+        value (Any): The JSON value
+        name (str): Name of the field, for the error message
+
+    Returns:
+        float: The number
+
+    Raises:
+        ValueError: If the value is not a finite number
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"Control field {name!r} must be a number: {value!r}")
+    number = float(value)
+    if not isfinite(number):
+        raise ValueError(f"Control field {name!r} must be finite: {value!r}")
+    return number
+
+
+def parse_control_payload(payload: str) -> list[ControlCommand]:
+    """
+    Parse a control message into commands.
+
+    Accepts the plain "1"/"0" commands, or a JSON object with an optional
+    "running" (or "command": "start"/"stop"), "setpoint_kw" (null removes the
+    limit), "ts" (unix send time) and "id" or "ids" restricting the command to
+    some of the addressed stations. A JSON object with a "commands" list holds
+    one such object per station, e.g. individual setpoints, sharing the outer
+    "ts".
+
+    Args:
+        payload (str): The decoded message
+
+    Returns:
+        list[ControlCommand]: The commands of the message
+
+    Raises:
+        ValueError: If the payload is not a valid control message, including
+            fields of the wrong type
+    """
+    payload = payload.strip()
+    if not payload.startswith("{"):
+        return [ControlCommand(running=parse_running(payload))]
+
+    message = loads(payload)
+    sent = message.get("ts")
+    if sent is not None:
+        sent = parse_number(sent, "ts")
+
+    def commands_of(entry: Any) -> list[ControlCommand]:
+        if not isinstance(entry, dict):
+            raise ValueError(f"Control command must be an object: {entry!r}")
+        running = parse_running(entry.get("running", entry.get("command")))
+        setpoint = entry.get("setpoint_kw")
+        command = ControlCommand(
+            running=running,
+            set_setpoint="setpoint_kw" in entry,
+            setpoint_kw=parse_number(setpoint, "setpoint_kw")
+            if setpoint is not None
+            else None,
+            sent=parse_number(entry["ts"], "ts") if "ts" in entry else sent,
+        )
+        if command.running is None and not command.set_setpoint:
+            raise ValueError(f"Control command changes nothing: {entry}")
+        if "id" in entry:
+            if not isinstance(entry["id"], str):
+                raise ValueError(f"Control field 'id' must be a string: {entry}")
+            return [command._replace(station_id=entry["id"])]
+        if "ids" in entry:
+            ids = entry["ids"]
+            if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+                raise ValueError(
+                    f"Control field 'ids' must be a list of strings: {entry}"
+                )
+            return [command._replace(station_id=station_id) for station_id in ids]
+        return [command]
+
+    if "commands" in message:
+        if not isinstance(message["commands"], list):
+            raise ValueError(f"Control field 'commands' must be a list: {payload}")
+        return [
+            command for entry in message["commands"] for command in commands_of(entry)
+        ]
+    return commands_of(message)
+
 
 class StationSimulator:
     """
@@ -21,79 +182,211 @@ class StationSimulator:
     The class handles MQTT communication, publishes information on regular intervals,
     and responds to control commands to start or stop power generation.
 
+    With ENABLE_RETAINED_STATE, metadata and status are published as retained
+    messages once and then only when they change, and the status becomes
+    "offline" on shutdown. A station owning its client also sets it as Last
+    Will; stations on a shared connection rely on the presence topic of that
+    connection, named in their metadata.
+
     Attributes:
         metadata_topic (str): Topic for publishing station metadata
         output_topic (str): Topic for publishing power output
         status_topic (str): Topic for publishing operational status
         control_topic (str): Topic for receiving control commands
+        control_ack_topic (str): Topic for acknowledging control commands
     """
 
     metadata_topic: str = "metadata"
     output_topic: str = "output"
     status_topic: str = "status"
     control_topic: str = "control"
-
-    def __init__(self, app_config: AppConfig):
+    control_ack_topic: str = "control/ack"
+
+    def __init__(
+        self,
+        app_config: AppConfig,
+        mqtt_client: MQTTClient | None = None,
+        output_source: TraceOutputSource | None = None,
+    ):
         """
         Initialize the station simulator.
 
         Args:
             app_config (AppConfig): Configuration object containing MQTT settings,
                                     power station details, and publishing intervals
+            mqtt_client (MQTTClient, optional): A shared, externally managed client.
+                If None, the station creates and owns its own connection.
+            output_source (TraceOutputSource, optional): Replays recorded outputs
+                instead of simulating random ones.
         """
         self.online: bool = False
         self.running: bool = False
         self.app_config: AppConfig = app_config
-        self.mqqt_client: MQTTClient = get_mqtt_client(app_config=app_config)
+        self.owns_client: bool = mqtt_client is None
+        self.retained_state: bool = app_config.ENABLE_RETAINED_STATE
+        self.mqqt_client: MQTTClient = mqtt_client or get_mqtt_client(
+            app_config=app_config,
+            will_topic=self.status_topic_path if self.retained_state else None,
+        )
+        self.output_source: TraceOutputSource | None = output_source
+        # Output limit set by control commands, None for no limit
+        self.setpoint_kw: float | None = None
+        self.deadband: Deadband = Deadband.from_configs([app_config])
+        self.__published = STATION_MESSAGES.labels(app_config.POWER_STATION_ID)
+        self.__controls = STATION_CONTROL_MESSAGES.labels(app_config.POWER_STATION_ID)
+        self.__scheduler: Scheduler | AsyncScheduler | VirtualScheduler | None = None
+        self.__owns_scheduler: bool = False
+        self.__output_policy: BackpressurePolicy = "coalesce_latest"
+        self.__tasks: list[PeriodicTask] = []
+        self.__subscribed: bool = False
+
+    @property
+    def control_topic_path(self) -> str:
+        """
+        The full topic this station listens on for control commands.
+        """
+        return f"{self.app_config.MQTT_TOPIC_PREFIX}/{self.app_config.POWER_STATION_ID}/{self.control_topic}"
 
-    def startup_sequence(self):
+    @property
+    def status_topic_path(self) -> str:
+        """
+        The full topic this station publishes its status to.
+        """
+        return f"{self.app_config.MQTT_TOPIC_PREFIX}/{self.app_config.POWER_STATION_ID}/{self.status_topic}"
+
+    def startup_sequence(
+        self,
+        scheduler: Scheduler | AsyncScheduler | VirtualScheduler | None = None,
+        delay: float = 0.0,
+        schedule_output: bool = True,
+        subscribe_control: bool = True,
+        quiet: bool = False,
+    ):
         """
         Start the station simulator and initialize all communication threads.
 
-        Connects to MQTT broker, subscribes to control topic, and starts
-        threads for publishing metadata, status, and power output.
+        Connects to MQTT broker, subscribes to control topic, and registers
+        metadata, status, and power output publishers as periodic tasks. When no
+        shared scheduler is given, the station starts and owns a private one.
+
+        To run on an asyncio event loop, construct the station with an
+        AsyncMQTTClient and pass an AsyncScheduler bound to the same loop.
+
+        Args:
+            scheduler (Scheduler | AsyncScheduler | VirtualScheduler, optional):
+                Shared scheduler driving the publishers.
+            delay (float, optional): Seconds before the first scheduled publish, used
+                to spread the load of many stations. Defaults to 0.0.
+            schedule_output (bool, optional): Register the output publisher. Set to
+                False when the caller publishes outputs in batches, e.g. a fleet
+                using a FleetOutputGenerator. Defaults to True.
+            subscribe_control (bool, optional): Subscribe to the control topic of
+                the station. Set to False when a ControlRouter dispatches the
+                commands of many stations. Defaults to True.
+            quiet (bool, optional): Skip the per-station log lines, e.g. when a
+                fleet starts thousands of stations. Defaults to False.
         """
-        logger.info("Initializing StationSimulator startup-sequence...")
-        self.mqqt_client.connect()
-        sleep(0.01)
+        if not quiet:
+            logger.info("Initializing StationSimulator startup-sequence...")
         self.online = True
+        if self.owns_client:
+            if self.retained_state:
+                # Also restores the status overwritten by the will after a reconnect
+                self.mqqt_client.on_connected.append(self.publish_state)
+            self.mqqt_client.connect()
+            timeout = self.app_config.MQTT_CONNECT_TIMEOUT_SECONDS
+            if not self.mqqt_client.wait_until_connected(timeout):
+                logger.warning(
+                    f"MQTT broker did not accept the connection within {timeout}s, "
+                    "retrying in the background"
+                )
+        elif self.retained_state:
+            self.publish_state()
 
         # Subscribe to control channel
-        self.mqqt_client.subscribe(
-            topic=f"{self.app_config.MQTT_TOPIC_PREFIX}/{self.app_config.POWER_STATION_ID}/{self.control_topic}",
-            on_message=self.__handle_control,
+        self.__subscribed = subscribe_control
+        if subscribe_control:
+            self.mqqt_client.subscribe(
+                topic=self.control_topic_path,
+                on_message=self.__handle_control,
+            )
+
+        self.__owns_scheduler = scheduler is None
+        self.__scheduler = scheduler or Scheduler(
+            workers=2, name=self.app_config.POWER_STATION_ID
+        )
+        # In virtual time every reading is a distinct sample, none may be coalesced
+        self.__output_policy = (
+            "block"
+            if isinstance(self.__scheduler, VirtualScheduler)
+            else "coalesce_latest"
         )
 
-        # Start metadata + status loops
-        self.__status_thread: Thread = Thread(target=self.__publish_status_loop)
-        self.__metadata_thread: Thread = Thread(target=self.__publish_metadata_loop)
-        self.__output_thread: Thread = Thread(target=self.__publish_output_loop)
-        self.__status_thread.start()
-        self.__metadata_thread.start()
-        self.__output_thread.start()
-
-        logger.info("StationSimulator startup-sequence COMPLETED.")
-
-    def shutdown_sequence(self):
+        # Register metadata + status + output publishers
+        self.__tasks = (
+            []
+            if self.retained_state
+            else [
+                self.__scheduler.schedule_periodic(
+                    self.publish_status,
+                    self.app_config.STATUS_PUBLISH_INTERVAL_SECONDS,
+                    delay,
+                ),
+                self.__scheduler.schedule_periodic(
+                    self.publish_metadata,
+                    self.app_config.METADATA_PUBLISH_INTERVAL_SECONDS,
+                    delay,
+                ),
+            ]
+        )
+        if schedule_output:
+            self.__tasks.append(
+                self.__scheduler.schedule_periodic(
+                    self.report_output,
+                    self.app_config.PUBLISH_INTERVAL_SECONDS,
+                    delay,
+                )
+            )
+        if self.__owns_scheduler:
+            self.__scheduler.start()
+
+        if not quiet:
+            logger.info("StationSimulator startup-sequence COMPLETED.")
+
+    def shutdown_sequence(self, quiet: bool = False):
         """
         Safely shut down the station simulator.
 
-        Sets the station to offline state, waits for all publisher threads to complete,
-        and disconnects from MQTT broker.
+        Sets the station to offline state, cancels its publishers (stopping and
+        joining its private scheduler, if any), and disconnects from MQTT broker.
+
+        Args:
+            quiet (bool, optional): Skip the per-station log lines, e.g. when a
+                fleet stops thousands of stations. Defaults to False.
         """
-        logger.info("Initializing StationSimulator shutdown-sequence...")
-        logger.info("!!!...PLEASE DO NOT REPEATEDLY PRESS 'Ctrl+C' ...!!!")
+        if not quiet:
+            logger.info("Initializing StationSimulator shutdown-sequence...")
+            logger.info("!!!...PLEASE DO NOT REPEATEDLY PRESS 'Ctrl+C' ...!!!")
         self.online = False
         self.running = False
-        if hasattr(self, "__status_thread") and self.__status_thread.is_alive():
-            self.__status_thread.join()
-        if hasattr(self, "__metadata_thread") and self.__metadata_thread.is_alive():
-            self.__metadata_thread.join()
-        if hasattr(self, "__output_thread") and self.__output_thread.is_alive():
-            self.__output_thread.join()
-
-        self.mqqt_client.disconnect()
-        logger.info("StationSimulator shutdown-sequence COMPLETED.")
+        if self.retained_state:
+            self.publish_status()
+        if self.__scheduler is not None:
+            for task in self.__tasks:
+                self.__scheduler.cancel(task)
+            self.__tasks.clear()
+            if self.__owns_scheduler:
+                logger.info(f"Scheduler stats: {self.__scheduler.stats.as_dict()}")
+                self.__scheduler.stop()
+
+        if self.owns_client:
+            if self.retained_state:
+                self.mqqt_client.on_connected.remove(self.publish_state)
+            self.mqqt_client.disconnect()
+        elif self.__subscribed:
+            self.mqqt_client.unsubscribe(self.control_topic_path)
+        if not quiet:
+            logger.info("StationSimulator shutdown-sequence COMPLETED.")
 
     def simulate_output(self) -> int:
         """
@@ -101,100 +394,145 @@ class StationSimulator:
 
         Returns:
             int: Simulated power output in kilowatts, a random value between
-                 80% and 120% of the configured capacity
+                 80% and 120% of the configured capacity, or the recorded value
+                 when replaying a trace, capped at the setpoint
         """
-        return int(
-            self.app_config.CAPACITY_KW * 0.8
-            + (self.app_config.CAPACITY_KW * 0.4 * random())
-        )
+        if self.output_source is not None:
+            output = int(self.output_source.generate(np.ones(1, dtype=np.bool_))[0])
+        else:
+            output = int(
+                self.app_config.CAPACITY_KW * 0.8
+                + (self.app_config.CAPACITY_KW * 0.4 * random())
+            )
+        if self.setpoint_kw is not None:
+            output = min(output, int(self.setpoint_kw))
+        return output
+
+    def publish_state(self):
+        """
+        Publish the metadata and the status of the power station.
+        """
+        self.publish_metadata()
+        self.publish_status()
 
     def publish_metadata(self):
         """
         Publish the power station's metadata to MQTT.
 
-        Publishes location and capacity information to the metadata topic.
+        Publishes location and capacity information to the metadata topic. With
+        retained state on a shared connection, the metadata also names the
+        connection whose presence topic tells whether the station is reachable.
         """
+        metadata = dict(
+            location=self.app_config.LOCATION,
+            capacity_kw=self.app_config.CAPACITY_KW,
+        )
+        if self.app_config.REGION:
+            metadata["region"] = self.app_config.REGION
+        if self.app_config.TAGS:
+            metadata["tags"] = self.app_config.TAGS
+        if self.retained_state and not self.owns_client:
+            connection = getattr(self.mqqt_client, "client_id", None)
+            if connection is not None:
+                metadata["connection"] = connection
+
         self.mqqt_client.publish(
             topic=f"{self.app_config.MQTT_TOPIC_PREFIX}/{self.metadata_topic}/{self.app_config.POWER_STATION_ID}",
-            payload=dict(
-                location=self.app_config.LOCATION,
-                capacity_kw=self.app_config.CAPACITY_KW,
-            ),
+            payload=metadata,
+            retain=self.retained_state,
         )
+        self.__published.inc()
 
     def publish_status(self):
         """
         Publish the power station's current status to MQTT.
 
-        Status will be either "running" (if generating power) or "online" (if not generating).
+        Status will be either "running" (if generating power), "online" (if not
+        generating) or "offline" (after shutdown).
         """
         self.mqqt_client.publish(
-            topic=f"{self.app_config.MQTT_TOPIC_PREFIX}/{self.app_config.POWER_STATION_ID}/{self.status_topic}",
-            payload="running" if self.running else "online",
+            topic=self.status_topic_path,
+            payload="running"
+            if self.running
+            else "online"
+            if self.online
+            else "offline",
+            retain=self.retained_state,
         )
+        self.__published.inc()
 
-    def publish_output(self):
+    def publish_output(self, output: int | None = None):
         """
         Publish the current power output to MQTT.
 
         If the station is running, publishes a simulated output value; otherwise, publishes 0.
+
+        Args:
+            output (int, optional): A precomputed output value, e.g. generated for the
+                whole fleet at once. If None, the value is simulated here.
         """
+        if output is None:
+            output = self.simulate_output() if self.running else 0
+
+        # Live, only the latest reading matters when the broker cannot keep up
         self.mqqt_client.publish(
             topic=f"{self.app_config.MQTT_TOPIC_PREFIX}/{self.app_config.POWER_STATION_ID}/{self.output_topic}",
-            payload=self.simulate_output() if self.running else 0,
+            payload=output,
+            policy=self.__output_policy,
         )
+        self.__published.inc()
 
-    def __publish_metadata_loop(self):
-        """
-        Background loop that publishes metadata at regular intervals.
-
-        Runs continuously while the station is online.
+    def report_output(self):
         """
-        while self.online:
-            self.publish_metadata()
-            sleep(self.app_config.METADATA_PUBLISH_INTERVAL_SECONDS)
+        Publish the current power output if the deadband lets it through.
 
-    def __publish_status_loop(self):
+        Used as the periodic output publisher; see Deadband for when a reading
+        is published and when it is withheld.
         """
-        Background loop that publishes status at regular intervals.
-
-        Runs continuously while the station is online.
-        """
-        while self.online:
-            self.publish_status()
-            sleep(self.app_config.STATUS_PUBLISH_INTERVAL_SECONDS)
-
-    def __publish_output_loop(self):
-        """
-        Background loop that publishes power output at regular intervals.
-
-        Runs continuously while the station is online.
-        """
-        while self.online:
-            self.publish_output()
-            sleep(self.app_config.PUBLISH_INTERVAL_SECONDS)
+        output = self.simulate_output() if self.running else 0
+        if self.deadband.select(np.array([output]))[0]:
+            self.publish_output(output)
 
     def __handle_control(self, client: Any, userdata: Any, message: Any):
         """
         Callback handler for MQTT control messages.
 
-        Parses control commands and changes the station's running state accordingly.
+        Parses control commands (see parse_control_payload), applies the ones
+        addressed to this station and acknowledges the message.
+        Acknowledgements are never coalesced: they wait for room in the
+        outgoing queue.
 
         Args:
             client: MQTT client instance (not used)
             userdata: MQTT user data (not used)
             message: MQTT message containing the control command
         """
-        payload = message.payload.decode()
+        started = perf_counter()
+        payload = message.payload.decode(errors="replace")
         logger.info(f"Control message received: {payload}")
 
-        normalized_command = str(payload).strip()
+        try:
+            commands = parse_control_payload(payload)
+            accepted = True
+        except ValueError as error:
+            logger.warning(f"Invalid control message: {error}")
+            commands, accepted = [], False
+        try:
+            for command in commands:
+                if command.station_id in (None, self.app_config.POWER_STATION_ID):
+                    self.apply_command(command)
+        except Exception:
+            # Never let the network thread of the connection die
+            logger.exception(f"Failed to apply control message: {payload}")
+            accepted = False
 
-        if normalized_command not in ("0", "1"):
-            logger.warning(f"Unknown control command (expected '0' or '1'): {payload}")
-            return
-
-        self.control(is_start=normalized_command == "1")
+        self.mqqt_client.publish(
+            topic=f"{self.app_config.MQTT_TOPIC_PREFIX}/{self.app_config.POWER_STATION_ID}/{self.control_ack_topic}",
+            payload=dict(command=payload, accepted=accepted, running=self.running),
+            policy="block",
+        )
+        self.__published.inc()
+        CONTROL_HANDLING.observe(perf_counter() - started)
 
     def control(self, is_start: bool):
         """
@@ -204,5 +542,31 @@ class StationSimulator:
             is_start (bool): True to start power generation, False to stop
         """
         logger.info(f"StationSimulator is {'starting' if is_start else 'stopping'}...")
+        changed = self.running != is_start
         self.running = is_start
+        if changed and self.retained_state and self.online:
+            self.publish_status()
         logger.info(f"StationSimulator {'started' if is_start else 'stopped'}.")
+
+    def apply_command(self, command: ControlCommand):
+        """
+        Apply one control command to the station, without logging.
+
+        Used for every command, including those dispatched in bulk to thousands
+        of stations by a ControlRouter. The time from the command's `sent`
+        timestamp to its effect is recorded in COMMAND_LATENCY.
+
+        Args:
+            command (ControlCommand): The command to apply
+        """
+        self.__controls.inc()
+        changed = False
+        if command.running is not None and command.running != self.running:
+            self.running = command.running
+            changed = True
+        if command.set_setpoint:
+            self.setpoint_kw = command.setpoint_kw
+        if changed and self.retained_state and self.online:
+            self.publish_status()
+        if command.sent is not None:
+            COMMAND_LATENCY.observe(max(time() - command.sent, 0.0))
@@ -0,0 +1,434 @@
+import os
+import signal
+from multiprocessing import get_context
+from multiprocessing.process import BaseProcess
+from queue import Empty
+from random import randrange
+from threading import Event
+from time import monotonic
+from typing import Any
+from zlib import crc32
+
+from config import AppConfig
+from fleet import FleetSimulator
+from logger import getLogger
+from metrics import REGISTRY
+from trace_replay import TraceReplay
+
+logger = getLogger(__name__)
+
+# Upper bound of the delay before a crash-looping worker is restarted
+MAX_RESTART_DELAY_SECONDS: float = 30.0
+
+# A worker that ran this long is considered healthy again after a crash
+STABLE_UPTIME_SECONDS: float = 60.0
+
+
+def shard_of(station_id: str, shards: int) -> int:
+    """
+    Return the shard a station is assigned to.
+
+    The assignment only depends on the station id, so a station always lands on
+    the same worker process, across restarts and independent of its position in
+    the fleet.
+
+    Args:
+        station_id (str): The POWER_STATION_ID of the station
+        shards (int): Number of worker processes
+
+    Returns:
+        int: Shard index in [0, shards)
+    """
+    return crc32(station_id.encode()) % shards
+
+
+def partition(app_configs: list[AppConfig], shards: int) -> list[list[AppConfig]]:
+    """
+    Split the station configs of a fleet into one list per shard.
+
+    Args:
+        app_configs (list[AppConfig]): One configuration per station
+        shards (int): Number of worker processes
+
+    Returns:
+        list[list[AppConfig]]: The configs of every shard, possibly empty
+    """
+    partitions: list[list[AppConfig]] = [[] for _ in range(shards)]
+    for app_config in app_configs:
+        partitions[shard_of(app_config.POWER_STATION_ID, shards)].append(app_config)
+    return partitions
+
+
+def run_worker(
+    shard: int,
+    app_configs: list[AppConfig],
+    options: dict[str, Any],
+    heartbeats: Any,
+    heartbeat_interval: float,
+) -> None:
+    """
+    Entry point of a worker process: run one shard of the fleet until SIGTERM.
+
+    Control commands reach the right process without any routing in the
+    supervisor: every worker subscribes to the control topics of its own
+    stations only, so the broker delivers each command to the shard hosting the
+    station.
+
+    Args:
+        shard (int): Index of the shard
+        app_configs (list[AppConfig]): Configs of the stations of this shard
+        options (dict[str, Any]): workers, connections, seed and the trace settings
+        heartbeats (Queue): Receives a health report every `heartbeat_interval`
+        heartbeat_interval (float): Seconds between two health reports
+    """
+    # Ctrl-C reaches the whole process group; only the supervisor handles it.
+    # A shared multiprocessing.Event would deadlock once a waiter is killed, so
+    # the supervisor requests a clean shutdown with SIGTERM instead.
+    stop = Event()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    # Exit without waiting for the supervisor to read the last reports
+    heartbeats.cancel_join_thread()
+
+    trace = options.get("trace")
+    fleet = FleetSimulator(
+        app_configs=app_configs,
+        workers=options["workers"],
+        connections=options["connections"],
+        seed=options["seed"],
+        trace_replay=TraceReplay(**trace) if trace else None,
+    )
+    fleet.startup_sequence()
+    started = monotonic()
+    try:
+        while not stop.wait(heartbeat_interval):
+            heartbeats.put(
+                dict(
+                    shard=shard,
+                    pid=os.getpid(),
+                    stations=len(fleet.stations),
+                    running=sum(station.running for station in fleet.stations),
+                    connected=sum(client.connected for client in fleet.pool.clients),
+                    connections=len(fleet.pool),
+                    startup_seconds=fleet.startup_seconds,
+                    uptime=monotonic() - started,
+                    metrics=REGISTRY.unlabelled(),
+                )
+            )
+    finally:
+        fleet.shutdown_sequence()
+
+
+class WorkerHandle:
+    """
+    Supervisor-side state of one worker process.
+
+    Attributes:
+        shard (int): Index of the shard
+        app_configs (list[AppConfig]): Configs of the stations of the shard
+        process (BaseProcess | None): The current process, None before the first start
+        restarts (int): Number of times the worker was restarted
+        heartbeat (dict): The latest health report of the worker
+        last_seen (float): Monotonic time of the latest health report
+        restart_at (float): Monotonic time of the next scheduled restart
+    """
+
+    def __init__(self, shard: int, app_configs: list[AppConfig]):
+        self.shard: int = shard
+        self.app_configs: list[AppConfig] = app_configs
+        self.process: BaseProcess | None = None
+        self.restarts: int = 0
+        self.crashes: int = 0
+        self.heartbeat: dict = {}
+        self.started: float = 0.0
+        self.last_seen: float = 0.0
+        self.restart_at: float = 0.0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+
+class Supervisor:
+    """
+    Runs a fleet as several worker processes, one shard of the stations each.
+
+    A single CPython process is bound by the GIL for payload encoding and paho's
+    packet handling; sharding the fleet spreads that work over the CPU cores.
+    Stations are assigned to shards by a stable hash of their id. Each worker
+    runs a FleetSimulator with its own broker connections and reports its health
+    over a queue. Workers that exit unexpectedly or stop reporting are restarted
+    with exponential backoff, and the reports are exposed as `worker_*` metrics
+    labelled by shard next to the supervisor's own `supervisor_*` metrics.
+
+    Attributes:
+        workers (list[WorkerHandle]): One handle per shard
+    """
+
+    def __init__(
+        self,
+        app_configs: list[AppConfig],
+        processes: int | None = None,
+        workers: int = 4,
+        connections: int = 1,
+        seed: int | None = None,
+        trace_replay: TraceReplay | None = None,
+        heartbeat_interval: float = 2.0,
+    ):
+        """
+        Initialize the supervisor.
+
+        Args:
+            app_configs (list[AppConfig]): One configuration per station
+            processes (int, optional): Number of worker processes. Defaults to the
+                number of CPU cores.
+            workers (int, optional): Scheduler threads per process. Defaults to 4.
+            connections (int, optional): Broker connections per process. Defaults to 1.
+            seed (int, optional): RNG seed shared by every shard, so the outputs do
+                not depend on the number of processes. Defaults to a random seed.
+            trace_replay (TraceReplay, optional): Replay settings, reopened by every
+                worker. Defaults to None.
+            heartbeat_interval (float, optional): Seconds between two health reports
+                of a worker. Defaults to 2.0.
+        """
+        processes = processes or os.cpu_count() or 1
+        processes = min(processes, len(app_configs))
+        if processes < 1:
+            raise ValueError("A supervised fleet needs at least one station config")
+
+        self.heartbeat_interval: float = heartbeat_interval
+        self.options: dict[str, Any] = dict(
+            workers=workers,
+            connections=connections,
+            seed=seed if seed is not None else randrange(2**32),
+            trace=dict(
+                path=trace_replay.trace.path,
+                speed=trace_replay.speed,
+                loop=trace_replay.loop,
+            )
+            if trace_replay
+            else None,
+        )
+        # A shard can be empty for small fleets, it then gets no process
+        self.workers: list[WorkerHandle] = [
+            WorkerHandle(shard, shard_configs)
+            for shard, shard_configs in enumerate(partition(app_configs, processes))
+            if shard_configs
+        ]
+        self.__by_shard: dict[int, WorkerHandle] = {
+            worker.shard: worker for worker in self.workers
+        }
+
+        # Spawned workers do not inherit the supervisor's threads and sockets
+        self.__context = get_context("spawn")
+        self.__heartbeats = self.__context.Queue()
+        self.__exported: set[str] = set()
+        self.__register_metrics()
+
+    def health(self) -> dict:
+        """
+        Return the aggregated health of the fleet.
+
+        Returns:
+            dict: Totals over all shards and the state of every worker
+        """
+        now = monotonic()
+        shards = [
+            dict(
+                shard=worker.shard,
+                alive=worker.alive,
+                pid=worker.process.pid if worker.process else None,
+                stations=len(worker.app_configs),
+                restarts=worker.restarts,
+                heartbeat_age=round(now - worker.last_seen, 3)
+                if worker.last_seen
+                else None,
+                running=worker.heartbeat.get("running"),
+                connected=worker.heartbeat.get("connected"),
+                startup_seconds=worker.heartbeat.get("startup_seconds"),
+            )
+            for worker in self.workers
+        ]
+        return dict(
+            processes=len(self.workers),
+            alive=sum(shard["alive"] for shard in shards),
+            stations=sum(shard["stations"] for shard in shards),
+            running=sum(shard["running"] or 0 for shard in shards),
+            restarts=sum(shard["restarts"] for shard in shards),
+            shards=shards,
+        )
+
+    def start(self) -> None:
+        """
+        Start one worker process per shard.
+        """
+        logger.info(
+            f"Starting {len(self.workers)} worker processes for "
+            f"{sum(len(worker.app_configs) for worker in self.workers)} stations..."
+        )
+        for worker in self.workers:
+            self.__start_worker(worker)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        Ask every worker to shut down cleanly, terminating those that do not.
+
+        Args:
+            timeout (float, optional): Seconds to wait for all workers. Defaults to 10.0.
+        """
+        logger.info("Stopping worker processes...")
+        for worker in self.workers:
+            if worker.alive:
+                worker.process.terminate()
+        deadline = monotonic() + timeout
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            worker.process.join(max(0.0, deadline - monotonic()))
+            if worker.process.is_alive():
+                logger.warning(f"Worker {worker.shard} did not stop, killing it")
+                worker.process.kill()
+                worker.process.join()
+        logger.info(f"Worker processes stopped: {self.health()}")
+
+    def run_forever(self, report_interval: float = 30.0) -> None:
+        """
+        Supervise the workers until interrupted.
+
+        Args:
+            report_interval (float, optional): Seconds between two health log
+                lines. Defaults to 30.0.
+        """
+        self.start()
+        next_report = monotonic() + report_interval
+        try:
+            while True:
+                self.poll(timeout=1.0)
+                if monotonic() >= next_report:
+                    health = self.health()
+                    logger.info(
+                        f"Fleet health: {health['alive']}/{health['processes']} workers, "
+                        f"{health['running']}/{health['stations']} stations running, "
+                        f"{health['restarts']} restarts"
+                    )
+                    next_report += report_interval
+        finally:
+            self.stop()
+
+    def poll(self, timeout: float = 1.0) -> None:
+        """
+        Collect health reports and restart dead or unresponsive workers.
+
+        Args:
+            timeout (float, optional): Seconds to wait for the first report.
+                Defaults to 1.0.
+        """
+        try:
+            heartbeat = self.__heartbeats.get(timeout=timeout)
+            while True:
+                worker = self.__by_shard[heartbeat["shard"]]
+                if (
+                    worker.process is not None
+                    and heartbeat["pid"] == worker.process.pid
+                ):
+                    worker.heartbeat = heartbeat
+                    worker.last_seen = monotonic()
+                    self.__export_worker_metrics(heartbeat["metrics"])
+                heartbeat = self.__heartbeats.get_nowait()
+        except Empty:
+            pass
+
+        now = monotonic()
+        for worker in self.workers:
+            if worker.restart_at:
+                if now >= worker.restart_at:
+                    worker.restart_at = 0.0
+                    worker.restarts += 1
+                    self.__start_worker(worker)
+                continue
+
+            if not worker.alive:
+                reason = f"exited with code {worker.process.exitcode}"
+            elif now - worker.last_seen > 5 * self.heartbeat_interval + 10.0:
+                # The grace period covers the startup of large shards
+                reason = "stopped reporting"
+                worker.process.kill()
+                worker.process.join()
+            else:
+                continue
+
+            worker.crashes = (
+                1
+                if now - worker.started > STABLE_UPTIME_SECONDS
+                else worker.crashes + 1
+            )
+            delay = min(2.0 ** (worker.crashes - 1), MAX_RESTART_DELAY_SECONDS)
+            worker.restart_at = now + delay
+            logger.error(f"Worker {worker.shard} {reason}, restarting in {delay:.0f}s")
+
+    def __start_worker(self, worker: WorkerHandle) -> None:
+        worker.process = self.__context.Process(
+            target=run_worker,
+            args=(
+                worker.shard,
+                worker.app_configs,
+                self.options,
+                self.__heartbeats,
+                self.heartbeat_interval,
+            ),
+            name=f"fleet-shard-{worker.shard}",
+            daemon=True,
+        )
+        worker.process.start()
+        worker.started = worker.last_seen = monotonic()
+        worker.heartbeat = {}
+        logger.info(
+            f"Worker {worker.shard} started with pid {worker.process.pid} "
+            f"for {len(worker.app_configs)} stations"
+        )
+
+    def __register_metrics(self) -> None:
+        def per_worker(read) -> list[tuple[dict[str, str], float]]:
+            return [
+                (dict(shard=str(worker.shard)), read(worker)) for worker in self.workers
+            ]
+
+        REGISTRY.sampled(
+            "supervisor_worker_up",
+            "1 if the worker process is alive",
+            lambda: per_worker(lambda worker: int(worker.alive)),
+        )
+        REGISTRY.sampled(
+            "supervisor_worker_restarts_total",
+            "Number of times the worker process was restarted",
+            lambda: per_worker(lambda worker: worker.restarts),
+            kind="counter",
+        )
+        REGISTRY.sampled(
+            "supervisor_worker_stations",
+            "Stations assigned to the worker process",
+            lambda: per_worker(lambda worker: len(worker.app_configs)),
+        )
+        REGISTRY.sampled(
+            "supervisor_worker_heartbeat_age_seconds",
+            "Seconds since the latest health report of the worker",
+            lambda: per_worker(lambda worker: monotonic() - worker.last_seen),
+        )
+
+    def __export_worker_metrics(self, names: Any) -> None:
+        """
+        Expose the unlabelled metrics of the workers as `worker_<name>{shard=...}`.
+        """
+        for name in names:
+            if name in self.__exported:
+                continue
+            self.__exported.add(name)
+            REGISTRY.sampled(
+                f"worker_{name}",
+                f"{name} reported by every worker process",
+                lambda name=name: [
+                    (dict(shard=str(worker.shard)), worker.heartbeat["metrics"][name])
+                    for worker in self.workers
+                    if name in worker.heartbeat.get("metrics", {})
+                ],
+            )
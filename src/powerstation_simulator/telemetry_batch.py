@@ -0,0 +1,144 @@
+from json import dumps, loads
+from struct import Struct
+
+import numpy as np
+
+from logger import getLogger
+
+logger = getLogger(__name__)
+
+SCHEMA_VERSION: int = 1
+MAGIC: bytes = b"SGTB"
+
+# magic, schema version, flags, record count, batch timestamp (unix seconds)
+HEADER: Struct = Struct("<4sBBId")
+
+# One fixed-size, little-endian record per station reading
+RECORD_DTYPE: np.dtype = np.dtype(
+    [
+        ("index", "<u4"),  # position of the station in the batch manifest
+        ("output", "<i4"),  # power output in kilowatts
+        ("status", "u1"),  # one of the STATUS_* codes below
+        ("offset_ms", "<u2"),  # reading time relative to the batch timestamp
+    ]
+)
+
+STATUS_OFFLINE: int = 0
+STATUS_ONLINE: int = 1
+STATUS_RUNNING: int = 2
+
+
+def encode_manifest(station_ids: list[str]) -> str:
+    """
+    Encode the manifest mapping record indices of a batch to station ids.
+
+    The manifest is published once, retained, next to the batched telemetry topic.
+
+    Args:
+        station_ids (list[str]): The POWER_STATION_ID of every station of the batch
+
+    Returns:
+        str: JSON-encoded manifest
+    """
+    return dumps(dict(schema=SCHEMA_VERSION, stations=station_ids))
+
+
+def decode_manifest(payload: bytes | str) -> list[str]:
+    """
+    Decode a batch manifest.
+
+    Args:
+        payload (bytes | str): The manifest payload
+
+    Returns:
+        list[str]: Station ids in record-index order
+    """
+    manifest = loads(payload)
+    if manifest.get("schema") != SCHEMA_VERSION:
+        raise ValueError(f"Unsupported batch manifest schema: {manifest.get('schema')}")
+    return manifest["stations"]
+
+
+def encode_batch(timestamp: float, records: np.ndarray) -> bytes:
+    """
+    Encode many station readings into one compact binary message.
+
+    Args:
+        timestamp (float): Batch timestamp in unix seconds
+        records (np.ndarray): Readings with dtype RECORD_DTYPE
+
+    Returns:
+        bytes: Header followed by the packed records
+    """
+    return (
+        HEADER.pack(MAGIC, SCHEMA_VERSION, 0, len(records), timestamp)
+        + records.tobytes()
+    )
+
+
+def decode_batch(payload: bytes) -> tuple[float, np.ndarray]:
+    """
+    Decode a binary batch produced by encode_batch().
+
+    Args:
+        payload (bytes): The message payload
+
+    Returns:
+        tuple[float, np.ndarray]: The batch timestamp and a read-only view of the
+            records with dtype RECORD_DTYPE
+    """
+    magic, version, _, count, timestamp = HEADER.unpack_from(payload)
+    if magic != MAGIC:
+        raise ValueError("Payload is not a smart grid telemetry batch")
+    if version != SCHEMA_VERSION:
+        raise ValueError(f"Unsupported telemetry batch schema: {version}")
+
+    records = np.frombuffer(
+        payload, dtype=RECORD_DTYPE, count=count, offset=HEADER.size
+    )
+    return timestamp, records
+
+
+class BatchEncoder:
+    """
+    Encodes the readings of a fixed set of stations, reusing one record buffer.
+
+    Attributes:
+        records (np.ndarray): Preallocated records, one per station, with the
+            `index` column already filled in
+    """
+
+    def __init__(self, size: int):
+        """
+        Initialize the encoder.
+
+        Args:
+            size (int): Number of stations in the batch
+        """
+        self.records: np.ndarray = np.zeros(size, dtype=RECORD_DTYPE)
+        self.records["index"] = np.arange(size, dtype=np.uint32)
+
+    def encode(
+        self,
+        timestamp: float,
+        outputs: np.ndarray,
+        statuses: np.ndarray,
+        offsets_ms: np.ndarray | int = 0,
+    ) -> bytes:
+        """
+        Encode one reading per station.
+
+        Args:
+            timestamp (float): Batch timestamp in unix seconds
+            outputs (np.ndarray): Output of every station in kilowatts
+            statuses (np.ndarray): STATUS_* code of every station
+            offsets_ms (np.ndarray | int, optional): Reading time of every station
+                relative to the batch timestamp. Defaults to 0.
+
+        Returns:
+            bytes: The encoded batch
+        """
+        self.records["output"] = outputs
+        self.records["status"] = statuses
+        self.records["offset_ms"] = offsets_ms
+        return encode_batch(timestamp, self.records)
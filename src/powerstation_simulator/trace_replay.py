@@ -0,0 +1,368 @@
+import argparse
+import csv
+from json import loads
+from struct import Struct
+
+import numpy as np
+
+from logger import getLogger
+
+logger = getLogger(__name__)
+
+TRACE_MAGIC: bytes = b"SGTR"
+TRACE_VERSION: int = 1
+
+# magic, version, reserved, interval, start time, station count, sample count, ids length
+TRACE_HEADER: Struct = Struct("<4sHHddIQI")
+
+# Samples start on a page boundary so every row can be mapped directly
+TRACE_ALIGNMENT: int = 4096
+
+TRACE_DTYPE: np.dtype = np.dtype("<f4")
+
+
+def data_offset(ids_length: int) -> int:
+    """
+    Return the file offset of the first sample.
+
+    Args:
+        ids_length (int): Length in bytes of the encoded station ids
+
+    Returns:
+        int: Offset rounded up to TRACE_ALIGNMENT
+    """
+    end = TRACE_HEADER.size + ids_length
+    return -(-end // TRACE_ALIGNMENT) * TRACE_ALIGNMENT
+
+
+class TraceWriter:
+    """
+    Writes a trace file sample row by sample row, without holding it in memory.
+
+    A trace file is a header, the newline-separated station ids and a row-major
+    float32 matrix with one row per sample and one column per station, so one
+    tick of the whole fleet is a single contiguous read.
+    """
+
+    def __init__(
+        self, path: str, station_ids: list[str], interval: float, start_time: float
+    ):
+        """
+        Create the file and write its header.
+
+        Args:
+            path (str): Path of the trace file
+            station_ids (list[str]): The POWER_STATION_ID of every column
+            interval (float): Seconds between two consecutive samples
+            start_time (float): Unix time of the first sample
+        """
+        self.path: str = path
+        self.station_ids: list[str] = station_ids
+        self.interval: float = interval
+        self.start_time: float = start_time
+        self.samples: int = 0
+
+        self.__ids: bytes = "\n".join(station_ids).encode()
+        self.__file = open(path, "wb")
+        self.__write_header()
+        self.__file.seek(data_offset(len(self.__ids)))
+
+    def __write_header(self) -> None:
+        self.__file.seek(0)
+        self.__file.write(
+            TRACE_HEADER.pack(
+                TRACE_MAGIC,
+                TRACE_VERSION,
+                0,
+                self.interval,
+                self.start_time,
+                len(self.station_ids),
+                self.samples,
+                len(self.__ids),
+            )
+        )
+        self.__file.write(self.__ids)
+
+    def write(self, rows: np.ndarray) -> None:
+        """
+        Append one or more sample rows.
+
+        Args:
+            rows (np.ndarray): Array of shape (stations,) or (samples, stations)
+        """
+        rows = np.asarray(rows, dtype=TRACE_DTYPE).reshape(-1, len(self.station_ids))
+        self.__file.write(rows.tobytes())
+        self.samples += len(rows)
+
+    def close(self) -> None:
+        """
+        Record the final sample count in the header and close the file.
+        """
+        self.__write_header()
+        self.__file.close()
+        logger.info(
+            f"Wrote {self.samples} samples of {len(self.station_ids)} stations to {self.path}"
+        )
+
+
+class TraceReader:
+    """
+    Memory-maps a trace file, so traces far larger than RAM can be streamed.
+
+    Attributes:
+        station_ids (list[str]): The POWER_STATION_ID of every column
+        interval (float): Seconds between two consecutive samples
+        start_time (float): Unix time of the first sample
+        samples (np.memmap): The (samples, stations) float32 matrix
+    """
+
+    def __init__(self, path: str):
+        """
+        Open and map a trace file.
+
+        Args:
+            path (str): Path of the trace file
+        """
+        with open(path, "rb") as trace_file:
+            header = trace_file.read(TRACE_HEADER.size)
+            (
+                magic,
+                version,
+                _,
+                self.interval,
+                self.start_time,
+                station_count,
+                sample_count,
+                ids_length,
+            ) = TRACE_HEADER.unpack(header)
+            if magic != TRACE_MAGIC:
+                raise ValueError(f"{path} is not a smart grid trace file")
+            if version != TRACE_VERSION:
+                raise ValueError(f"Unsupported trace file version: {version}")
+            ids = trace_file.read(ids_length).decode()
+
+        self.path: str = path
+        self.station_ids: list[str] = ids.split("\n") if ids else []
+        self.samples: np.memmap = np.memmap(
+            path,
+            dtype=TRACE_DTYPE,
+            mode="r",
+            offset=data_offset(ids_length),
+            shape=(sample_count, station_count),
+        )
+        self.__columns: dict[str, int] = {
+            station_id: column for column, station_id in enumerate(self.station_ids)
+        }
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def columns_of(self, station_ids: list[str]) -> np.ndarray:
+        """
+        Return the column of every station, -1 for stations not in the trace.
+
+        Args:
+            station_ids (list[str]): The stations to look up
+
+        Returns:
+            np.ndarray: int64 column indices
+        """
+        return np.array(
+            [self.__columns.get(station_id, -1) for station_id in station_ids],
+            dtype=np.int64,
+        )
+
+
+class TraceOutputSource:
+    """
+    Replays recorded outputs for a set of stations, one publish interval per call.
+
+    Offers the generate(running) interface of FleetOutputGenerator, so it can
+    replace the random output of a fleet batch or of a single station. With a
+    speed multiplier of N, every publish interval advances the trace by N times
+    that interval; with looping enabled the trace restarts after its last sample,
+    otherwise the last sample is held.
+
+    Attributes:
+        trace (TraceReader): The mapped trace file
+        speed (float): Trace seconds replayed per simulated second
+        loop (bool): Restart from the first sample after the last one
+        finished (bool): True once a non-looping replay reached the end
+        tick (int): Number of ticks generated so far
+    """
+
+    def __init__(
+        self,
+        trace: TraceReader,
+        station_ids: list[str],
+        publish_interval: float,
+        speed: float = 1.0,
+        loop: bool = True,
+    ):
+        """
+        Initialize the source.
+
+        Args:
+            trace (TraceReader): The mapped trace file
+            station_ids (list[str]): The stations to replay, in output order
+            publish_interval (float): Seconds between two calls of generate()
+            speed (float, optional): Replay speed multiplier. Defaults to 1.0.
+            loop (bool, optional): Restart after the last sample. Defaults to True.
+        """
+        if len(trace) == 0:
+            raise ValueError(f"Trace {trace.path} contains no samples")
+
+        self.trace: TraceReader = trace
+        self.speed: float = speed
+        self.loop: bool = loop
+        self.finished: bool = False
+        self.tick: int = 0
+        self.__samples_per_tick: float = publish_interval * speed / trace.interval
+
+        columns = trace.columns_of(station_ids)
+        missing = int((columns < 0).sum())
+        if missing:
+            logger.warning(
+                f"{missing} stations are not in trace {trace.path}, they replay 0 kW"
+            )
+        self.__present: np.ndarray = columns >= 0
+        self.__columns: np.ndarray = np.where(self.__present, columns, 0)
+        self.__outputs: np.ndarray = np.empty(len(station_ids), dtype=np.int64)
+
+    def generate(self, running: np.ndarray) -> np.ndarray:
+        """
+        Return the recorded output of every station for the next tick.
+
+        Args:
+            running (np.ndarray): Boolean running flag of every station; stopped
+                stations report 0 regardless of the trace
+
+        Returns:
+            np.ndarray: int64 output in kilowatts; the buffer is reused by the next call
+        """
+        index = int(self.tick * self.__samples_per_tick)
+        if index >= len(self.trace):
+            if self.loop:
+                index %= len(self.trace)
+            else:
+                index = len(self.trace) - 1
+                if not self.finished:
+                    self.finished = True
+                    logger.info(f"Trace {self.trace.path} replay reached its end")
+        self.tick += 1
+
+        # Only the pages of this one row are read from disk
+        self.__outputs[:] = self.trace.samples[index].take(self.__columns)
+        self.__outputs *= self.__present & running
+        return self.__outputs
+
+
+class TraceReplay:
+    """
+    Replay settings shared by every output batch of a fleet.
+
+    Attributes:
+        trace (TraceReader): The mapped trace file
+        speed (float): Replay speed multiplier
+        loop (bool): Restart from the first sample after the last one
+    """
+
+    def __init__(self, path: str, speed: float = 1.0, loop: bool = True):
+        """
+        Open the trace file.
+
+        Args:
+            path (str): Path of the trace file
+            speed (float, optional): Replay speed multiplier. Defaults to 1.0.
+            loop (bool, optional): Restart after the last sample. Defaults to True.
+        """
+        self.trace: TraceReader = TraceReader(path)
+        self.speed: float = speed
+        self.loop: bool = loop
+
+    def source_for(
+        self, station_ids: list[str], publish_interval: float
+    ) -> TraceOutputSource:
+        """
+        Create the output source of a group of stations.
+
+        Args:
+            station_ids (list[str]): The stations to replay, in output order
+            publish_interval (float): Seconds between two ticks of the group
+
+        Returns:
+            TraceOutputSource: The source replaying these stations
+        """
+        return TraceOutputSource(
+            self.trace,
+            station_ids,
+            publish_interval,
+            speed=self.speed,
+            loop=self.loop,
+        )
+
+
+def convert_csv(csv_path: str, trace_path: str, interval: float) -> None:
+    """
+    Convert output readings recorded as CSV into a trace file.
+
+    Accepts the timestamp,topic,payload rows written by FileSink, where payloads
+    are plain numbers or {"ts": ..., "value": ...} objects. Only `.../output`
+    topics are used. Rows must be sorted by timestamp; every station keeps its
+    last value until a newer reading arrives.
+
+    Args:
+        csv_path (str): The recorded CSV file
+        trace_path (str): The trace file to write
+        interval (float): Seconds between two trace samples
+    """
+
+    def readings():
+        with open(csv_path, newline="") as csv_file:
+            for timestamp, topic, payload in csv.reader(csv_file):
+                if not topic.endswith("/output"):
+                    continue
+                value = loads(payload)
+                if isinstance(value, dict):
+                    value = value["value"]
+                yield float(timestamp), topic.rsplit("/", 2)[-2], value
+
+    # First pass: the station columns and the start time
+    columns: dict[str, int] = {}
+    start_time = None
+    for timestamp, station_id, _ in readings():
+        start_time = timestamp if start_time is None else start_time
+        columns.setdefault(station_id, len(columns))
+    if start_time is None:
+        raise ValueError(f"{csv_path} contains no output readings")
+
+    # Second pass: stream the readings into sample rows
+    writer = TraceWriter(trace_path, list(columns), interval, start_time)
+    row = np.zeros(len(columns), dtype=TRACE_DTYPE)
+    sample = 0
+    for timestamp, station_id, value in readings():
+        while timestamp >= start_time + (sample + 1) * interval:
+            writer.write(row)
+            sample += 1
+        row[columns[station_id]] = value
+    writer.write(row)
+    writer.close()
+
+
+if __name__ == "__main__":
+    """
+    Convert recorded CSV telemetry into a memory-mappable trace file.
+
+    Example usage:
+        python trace_replay.py telemetry.csv telemetry.trace --interval 1
+    """
+    parser = argparse.ArgumentParser(
+        description="⚡ Convert CSV telemetry into a replayable trace file"
+    )
+    parser.add_argument("csv_path", help="CSV file written by FileSink")
+    parser.add_argument("trace_path", help="Trace file to create")
+    parser.add_argument(
+        "--interval", type=float, default=1.0, help="Seconds between two samples"
+    )
+    args = parser.parse_args()
+    convert_csv(args.csv_path, args.trace_path, args.interval)
@@ -0,0 +1,321 @@
+from time import localtime, perf_counter, time
+from typing import Callable
+
+import numpy as np
+
+from config import AppConfig
+from logger import getLogger
+from metrics import REGISTRY
+from mqtt_client import BackpressurePolicy, MQTTClient, get_mqtt_client
+from output_generator import FleetOutputGenerator, station_seeds
+from scheduler import AsyncScheduler, PeriodicTask, Scheduler, VirtualScheduler
+
+logger = getLogger(__name__)
+
+ZONE_PUBLISH = REGISTRY.histogram(
+    "zone_publish_seconds",
+    "Time spent generating and publishing the demand of every zone",
+).labels()
+ZONE_MESSAGES = REGISTRY.counter(
+    "zone_messages_published_total",
+    "Messages published by the consumption zones",
+).labels()
+
+ZONE_KINDS: tuple[str, ...] = ("residential", "commercial", "industrial")
+
+# Demand relative to the peak of the zone, for every hour of the day (local time)
+DAILY_PROFILES: np.ndarray = np.array(
+    [
+        # residential: morning bump, evening peak
+        [0.40, 0.35, 0.33, 0.32, 0.33, 0.40, 0.55, 0.70, 0.65, 0.55, 0.50, 0.50,
+         0.52, 0.50, 0.50, 0.55, 0.65, 0.80, 0.95, 1.00, 0.95, 0.80, 0.62, 0.48],
+        # commercial: business hours
+        [0.30, 0.28, 0.28, 0.28, 0.30, 0.35, 0.45, 0.65, 0.85, 0.95, 1.00, 1.00,
+         0.98, 1.00, 1.00, 0.97, 0.92, 0.80, 0.60, 0.48, 0.42, 0.38, 0.34, 0.32],
+        # industrial: round-the-clock shifts
+        [0.75, 0.72, 0.72, 0.72, 0.74, 0.78, 0.85, 0.92, 0.97, 1.00, 1.00, 1.00,
+         0.96, 0.98, 1.00, 1.00, 0.97, 0.92, 0.86, 0.82, 0.80, 0.78, 0.77, 0.76],
+    ]
+)  # fmt: skip
+
+# Demand relative to a working day, Monday to Sunday
+WEEKLY_PROFILES: np.ndarray = np.array(
+    [
+        [1.00, 1.00, 1.00, 1.00, 1.02, 1.08, 1.10],
+        [1.00, 1.00, 1.00, 1.00, 0.97, 0.55, 0.45],
+        [1.00, 1.00, 1.00, 1.00, 0.98, 0.75, 0.65],
+    ]
+)
+
+# Typical peak of a zone of every kind, relative to a residential zone
+KIND_SCALES: np.ndarray = np.array([1.0, 5.0, 20.0])
+
+
+class ZoneLoadGenerator:
+    """
+    Generates the demand of many consumption zones for one tick in a few array operations.
+
+    The demand of a zone is its peak, scaled by the daily profile of its kind
+    (linearly interpolated between the hours) and the weekly profile of its kind,
+    plus uniform noise of +/- `noise` of that value. The profiles are evaluated
+    once per tick for the three kinds, so the per-zone work is a gather and a few
+    multiplications. Noise uses the counter-based generator of FleetOutputGenerator,
+    so every zone has its own reproducible stream.
+
+    Attributes:
+        peaks (np.ndarray): Peak demand of every zone in kilowatts
+        kinds (np.ndarray): Index into ZONE_KINDS of every zone
+        noise (float): Relative amplitude of the noise
+    """
+
+    def __init__(
+        self,
+        peaks: np.ndarray,
+        kinds: np.ndarray,
+        seeds: np.ndarray,
+        noise: float = 0.05,
+    ):
+        """
+        Initialize the generator.
+
+        Args:
+            peaks (np.ndarray): Peak demand of every zone in kilowatts
+            kinds (np.ndarray): Index into ZONE_KINDS of every zone
+            seeds (np.ndarray): RNG seed of every zone, e.g. from station_seeds()
+            noise (float, optional): Relative amplitude of the noise. Defaults to 0.05.
+        """
+        self.peaks: np.ndarray = np.asarray(peaks, dtype=np.float64)
+        self.kinds: np.ndarray = np.asarray(kinds, dtype=np.intp)
+        if self.peaks.shape != self.kinds.shape:
+            raise ValueError("peaks and kinds must have the same shape")
+        self.noise: float = noise
+        self.__random = FleetOutputGenerator(self.peaks, seeds)
+
+        # Preallocated work buffers, reused on every tick
+        self.__factors: np.ndarray = np.empty_like(self.peaks)
+        self.__demand: np.ndarray = np.empty(self.peaks.shape, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.peaks)
+
+    @staticmethod
+    def profile_factors(timestamp: float) -> np.ndarray:
+        """
+        Evaluate the load profiles of every zone kind at a point in time.
+
+        Args:
+            timestamp (float): Unix time, evaluated in local time
+
+        Returns:
+            np.ndarray: Demand relative to the peak, one value per ZONE_KINDS entry
+        """
+        moment = localtime(timestamp)
+        hour = moment.tm_hour + moment.tm_min / 60 + moment.tm_sec / 3600
+        current, fraction = int(hour), hour % 1
+        daily = (
+            DAILY_PROFILES[:, current] * (1 - fraction)
+            + DAILY_PROFILES[:, (current + 1) % 24] * fraction
+        )
+        return daily * WEEKLY_PROFILES[:, moment.tm_wday]
+
+    def generate(self, timestamp: float) -> np.ndarray:
+        """
+        Generate the demand of every zone at a point in time.
+
+        Args:
+            timestamp (float): Unix time of the tick
+
+        Returns:
+            np.ndarray: int64 demand in kilowatts; the buffer is reused by the next call
+        """
+        factors = self.__factors
+        np.take(self.profile_factors(timestamp), self.kinds, out=factors)
+        np.multiply(factors, self.peaks, out=factors)
+
+        # value * (1 + noise * (2u - 1))
+        uniform = self.__random.uniform()
+        np.multiply(uniform, 2 * self.noise, out=uniform)
+        np.add(uniform, 1 - self.noise, out=uniform)
+        np.multiply(factors, uniform, out=factors)
+        np.floor(factors, out=factors)
+        self.__demand[:] = factors
+        return self.__demand
+
+
+class ZoneSimulator:
+    """
+    Simulates the electricity demand of many consumption zones in one process.
+
+    The consumption-side counterpart of FleetSimulator: every publish interval,
+    a ZoneLoadGenerator computes the demand of all zones at once, which is then
+    published to `{ZONE_TOPIC_PREFIX}/<zone id>/demand`. A retained metadata
+    message per zone describes its kind, peak and region.
+
+    Zones are split over ZONE_KINDS by `mix`, with peaks drawn around the
+    typical size of their kind and scaled so they add up to `demand_kw`, e.g.
+    a fraction of the capacity of the simulated fleet.
+
+    Attributes:
+        zone_ids (list[str]): The id of every zone
+        regions (list[str]): The region of every zone, empty if none
+        generator (ZoneLoadGenerator): Vectorized demand generator of the zones
+        demand_topic (str): Topic suffix for publishing demand
+        metadata_topic (str): Topic suffix for publishing zone metadata
+    """
+
+    demand_topic: str = "demand"
+    metadata_topic: str = "metadata"
+
+    def __init__(
+        self,
+        app_config: AppConfig,
+        zones: int,
+        demand_kw: float,
+        mqtt_client: MQTTClient | None = None,
+        mix: tuple[float, float, float] = (0.7, 0.25, 0.05),
+        regions: list[str] | None = None,
+        noise: float = 0.05,
+        seed: int = 0,
+        clock: Callable[[], float] = time,
+    ):
+        """
+        Initialize the zones.
+
+        Args:
+            app_config (AppConfig): Configuration providing the broker settings,
+                ZONE_TOPIC_PREFIX and PUBLISH_INTERVAL_SECONDS
+            zones (int): Number of zones
+            demand_kw (float): Sum of the peak demand of every zone, in kilowatts
+            mqtt_client (MQTTClient, optional): A shared, externally managed client.
+                If None, the zones create and own their own connection.
+            mix (tuple[float, float, float], optional): Share of residential,
+                commercial and industrial zones. Defaults to (0.7, 0.25, 0.05).
+            regions (list[str], optional): Regions the zones are assigned to in
+                turn. Defaults to no region.
+            noise (float, optional): Relative amplitude of the demand noise.
+                Defaults to 0.05.
+            seed (int, optional): RNG seed of the zone sizes and the noise.
+                Defaults to 0.
+            clock (Callable[[], float], optional): Returns the unix time of a
+                tick. Defaults to time.time.
+        """
+        if zones < 1:
+            raise ValueError("A zone simulator needs at least one zone")
+
+        self.app_config: AppConfig = app_config
+        self.clock: Callable[[], float] = clock
+        self.zone_ids: list[str] = [f"Z_{index:05d}" for index in range(zones)]
+        self.regions: list[str] = [
+            regions[index % len(regions)] if regions else "" for index in range(zones)
+        ]
+
+        rng = np.random.default_rng(seed)
+        kinds = rng.choice(len(ZONE_KINDS), size=zones, p=np.asarray(mix) / sum(mix))
+        sizes = KIND_SCALES[kinds] * rng.lognormal(0.0, 0.3, size=zones)
+        peaks = sizes * (demand_kw / sizes.sum())
+        self.generator: ZoneLoadGenerator = ZoneLoadGenerator(
+            peaks, kinds, station_seeds(self.zone_ids, seed), noise=noise
+        )
+
+        self.owns_client: bool = mqtt_client is None
+        self.mqqt_client: MQTTClient = mqtt_client or get_mqtt_client(
+            app_config=app_config.model_copy(update={"POWER_STATION_ID": "zones"})
+        )
+        prefix = app_config.ZONE_TOPIC_PREFIX
+        self.__topics: list[str] = [
+            f"{prefix}/{zone_id}/{self.demand_topic}" for zone_id in self.zone_ids
+        ]
+        self.__scheduler: Scheduler | AsyncScheduler | VirtualScheduler | None = None
+        self.__owns_scheduler: bool = False
+        self.__demand_policy: BackpressurePolicy = "coalesce_latest"
+        self.__task: PeriodicTask | None = None
+
+    def __len__(self) -> int:
+        return len(self.zone_ids)
+
+    def startup_sequence(
+        self, scheduler: Scheduler | AsyncScheduler | VirtualScheduler | None = None
+    ):
+        """
+        Publish the zone metadata and register the demand publisher.
+
+        Args:
+            scheduler (Scheduler | AsyncScheduler | VirtualScheduler, optional):
+                Shared scheduler driving the publisher. If None, the zones start
+                and own a private one.
+        """
+        logger.info(
+            f"Initializing ZoneSimulator startup-sequence for {len(self)} zones..."
+        )
+        if self.owns_client:
+            self.mqqt_client.connect()
+            timeout = self.app_config.MQTT_CONNECT_TIMEOUT_SECONDS
+            if not self.mqqt_client.wait_until_connected(timeout):
+                logger.warning(
+                    f"MQTT broker did not accept the connection within {timeout}s, "
+                    "retrying in the background"
+                )
+        self.publish_metadata()
+
+        self.__owns_scheduler = scheduler is None
+        self.__scheduler = scheduler or Scheduler(workers=1, name="zones")
+        # In virtual time every reading is a distinct sample, none may be coalesced
+        self.__demand_policy = (
+            "block"
+            if isinstance(self.__scheduler, VirtualScheduler)
+            else "coalesce_latest"
+        )
+        self.__task = self.__scheduler.schedule_periodic(
+            self.publish_demand, self.app_config.PUBLISH_INTERVAL_SECONDS
+        )
+        if self.__owns_scheduler:
+            self.__scheduler.start()
+        logger.info("ZoneSimulator startup-sequence COMPLETED.")
+
+    def shutdown_sequence(self):
+        """
+        Cancel the demand publisher and release the private scheduler and client.
+        """
+        logger.info("Initializing ZoneSimulator shutdown-sequence...")
+        if self.__scheduler is not None and self.__task is not None:
+            self.__scheduler.cancel(self.__task)
+            self.__task = None
+            if self.__owns_scheduler:
+                self.__scheduler.stop()
+        if self.owns_client:
+            self.mqqt_client.disconnect()
+        logger.info("ZoneSimulator shutdown-sequence COMPLETED.")
+
+    def publish_metadata(self):
+        """
+        Publish the retained metadata of every zone.
+        """
+        prefix = self.app_config.ZONE_TOPIC_PREFIX
+        kinds = self.generator.kinds.tolist()
+        peaks = self.generator.peaks.tolist()
+        for zone_id, kind, peak, region in zip(
+            self.zone_ids, kinds, peaks, self.regions
+        ):
+            metadata = dict(kind=ZONE_KINDS[kind], peak_kw=round(peak, 1))
+            if region:
+                metadata["region"] = region
+            self.mqqt_client.publish(
+                topic=f"{prefix}/{zone_id}/{self.metadata_topic}",
+                payload=metadata,
+                retain=True,
+            )
+        ZONE_MESSAGES.inc(len(self))
+
+    def publish_demand(self):
+        """
+        Generate the demand of every zone for this tick and publish it.
+        """
+        started = perf_counter()
+        demand = self.generator.generate(self.clock())
+        # Live, only the latest reading matters when the broker cannot keep up
+        for topic, value in zip(self.__topics, demand.tolist()):
+            self.mqqt_client.publish(
+                topic=topic, payload=value, policy=self.__demand_policy
+            )
+        ZONE_MESSAGES.inc(len(self))
+        ZONE_PUBLISH.observe(perf_counter() - started)